@@ -0,0 +1,34 @@
+"""
+Standalone performance benchmarks, run from the project's root:
+
+  python -m benchmarks.validation
+
+They use a local SQLite database (see `benchmarks/settings.py`) instead of
+the Postgres from docker-compose, so they can run anywhere.
+"""
+import os
+import time
+
+
+def setup_django():
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+  import django
+  django.setup()
+
+
+def best_time(func, repeat=5):
+  """Best wall time of `repeat` calls to `func`, in seconds"""
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def percentile(sorted_values, percent):
+  """Nearest-rank percentile of already sorted values"""
+  if not sorted_values:
+    return None
+  rank = max(int(round(percent / 100 * len(sorted_values) + 0.5)) - 1, 0)
+  return sorted_values[min(rank, len(sorted_values) - 1)]
@@ -0,0 +1,84 @@
+"""
+Runs every benchmark and writes the results as JSON, to compare them between commits:
+
+  python -m benchmarks --output before.json
+  python -m benchmarks --output after.json --compare before.json
+"""
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from . import setup_django
+
+
+def get_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                   universal_newlines=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def flatten(results, prefix=''):
+  """{'a': {'b': 1}} => {'a.b': 1}"""
+  flat = {}
+  for key, value in results.items():
+    if isinstance(value, dict):
+      flat.update(flatten(value, prefix + key + '.'))
+    else:
+      flat[prefix + key] = value
+  return flat
+
+
+def compare(results, baseline):
+  """Prints every measure next to the baseline's, with the change"""
+  baseline = flatten(baseline)
+  for name, value in flatten(results).items():
+    if name in baseline and baseline[name]:
+      print('{:60} {:14.2f} {:14.2f} {:+8.1f}%'.format(
+        name, baseline[name], value, 100 * (value - baseline[name]) / baseline[name]))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--output', default='benchmark_results.json')
+  parser.add_argument('--compare', metavar='BASELINE_JSON')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                      help='users table sizes')
+  parser.add_argument('--alpha', type=int, nargs='+', default=[8, 12, 16],
+                      help='alpha letters of the permutated words')
+  args = parser.parse_args(argv)
+
+  setup_django()
+  import django
+  from django.db import connection
+  from . import permutations, users_api, validation
+
+  results = {
+    'meta': {
+      'commit': get_commit(),
+      'date': datetime.now().isoformat(),
+      'python': platform.python_version(),
+      'django': django.get_version(),
+      'database': connection.vendor,
+    },
+    'permutations_variants_per_sec': permutations.run(args.alpha),
+    'validation_rows_per_sec': validation.run(),
+    'users_api': users_api.run(args.sizes),
+  }
+  with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print('Results written to', args.output)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    baseline.pop('meta', None)
+    compare({k: v for k, v in results.items() if k != 'meta'}, baseline)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,36 @@
+"""Variants/sec of the letter_digit permutation versions, by number of alpha letters"""
+import sys
+from . import best_time
+
+# Words of `alpha` letters: short, and long with non-alpha runs
+WORDS = {
+  'short': lambda alpha: 'abcdefghijklmnopqrstuvwx'[:alpha],
+  'long': lambda alpha: ('a' + '-' * 30) * alpha,
+}
+
+
+def run(alpha_counts=(8, 12, 16)):
+  from letter_digit.utils import permutate_upper_lower_recursive, \
+                                 permutate_upper_lower_imperative, \
+                                 permutate_upper_lower_segments
+  versions = {
+    'recursive': permutate_upper_lower_recursive,
+    'product': permutate_upper_lower_imperative,
+    'segments': permutate_upper_lower_segments,
+  }
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), 2000))  # For the recursive version
+  results = {}
+  for shape, build_word in WORDS.items():
+    for alpha in alpha_counts:
+      word = build_word(alpha)
+      results['{}-{}'.format(shape, alpha)] = {
+        name: 2 ** alpha / best_time(lambda: version(word), repeat=3)
+        for name, version in versions.items()
+      }
+  return results
+
+
+if __name__ == '__main__':
+  for word, results in run().items():
+    print('{:10} '.format(word) + '  '.join('{}: {:10.0f} variants/sec'.format(name, rate)
+                                            for name, rate in results.items()))
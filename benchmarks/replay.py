@@ -0,0 +1,189 @@
+"""
+Replays a recorded requests log against the app, with some concurrency, and reports
+the latency percentiles per endpoint:
+
+  python -m benchmarks.replay requests_log.jsonl --concurrency 8 --generate-users 10000
+  python -m benchmarks.replay requests_log.jsonl --url http://localhost:8000
+
+The log is a JSON object per line, like:
+
+  {"method": "GET", "path": "/api/v1/users/", "query": {"from": "0101", "to": "3101"}}
+  {"method": "POST", "path": "/api/v1/users/", "body": [{"first_name": ...}]}
+
+Only "path" is required, other keys (i.e a "request_id") are ignored. Without --url,
+requests go to the WSGI app in-process through django.test.Client, using a SQLite
+database file (BENCHMARK_DB, a temporary one by default). SQLite doesn't handle
+concurrent writers well, replaying POST requests with some concurrency is better
+done against a server using Postgres.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from . import setup_django, percentile
+
+
+def load_requests(path):
+  """Returns the requests of a log, and how many lines were skipped"""
+  requests, skipped = [], 0
+  with open(path) as f:
+    for line in f:
+      record = json.loads(line) if line.strip() else {}
+      if not isinstance(record, dict) or 'path' not in record:
+        skipped += 1
+        continue
+      requests.append(record)
+  return requests, skipped
+
+
+def encode_body(record):
+  body = record.get('body')
+  if body is None:
+    return None
+  return body if isinstance(body, str) else json.dumps(body)
+
+
+class InProcessSender:
+  """Sends requests to the WSGI app with a django.test.Client per thread"""
+
+  def __init__(self):
+    self._local = threading.local()
+
+  def __call__(self, record):
+    from django.test import Client
+    # Request exceptions are caught through a global signal, which is not thread safe
+    client = getattr(self._local, 'client', None) or Client(raise_request_exception=False)
+    self._local.client = client
+    method = record.get('method', 'GET').lower()
+    body = encode_body(record)
+    if method == 'get':
+      response = client.get(record['path'], record.get('query'))
+    else:
+      path = record['path']
+      if record.get('query'):
+        path += '?' + urllib.parse.urlencode(record['query'])
+      response = getattr(client, method)(path, body or '',
+                                         content_type=record.get('content_type', 'application/json'))
+    if response.streaming:
+      for _ in response.streaming_content:  # Consuming it, as a real client would
+        pass
+    return response.status_code
+
+
+class HttpSender:
+  """Sends requests to a running server"""
+
+  def __init__(self, base_url):
+    self.base_url = base_url.rstrip('/')
+
+  def __call__(self, record):
+    url = self.base_url + record['path']
+    if record.get('query'):
+      url += '?' + urllib.parse.urlencode(record['query'])
+    body = encode_body(record)
+    request = urllib.request.Request(
+      url, data=body.encode('utf-8') if body is not None else None,
+      method=record.get('method', 'GET').upper(),
+      headers={'Content-Type': record.get('content_type', 'application/json')})
+    try:
+      with urllib.request.urlopen(request) as response:
+        response.read()
+        return response.status
+    except urllib.error.HTTPError as err:
+      return err.code
+
+
+def endpoint_name(path):
+  from django.urls import resolve, Resolver404
+  try:
+    return resolve(urllib.parse.urlsplit(path).path).url_name
+  except Resolver404:
+    return path
+
+
+def replay(requests, send, concurrency=1, repeat=1):
+  """Returns the latency percentiles (ms) and errors of every endpoint"""
+  latencies, errors = defaultdict(list), defaultdict(int)
+
+  def timed_send(record):
+    start = time.perf_counter()
+    try:
+      status = send(record)
+    except Exception:  # Counting it, and going on with the replay
+      status = None
+    return endpoint_name(record['path']), time.perf_counter() - start, status
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    for name, elapsed, status in executor.map(timed_send, requests * repeat):
+      latencies[name].append(elapsed * 1000)
+      if status is None or status >= 500:
+        errors[name] += 1
+  total_time = time.perf_counter() - start
+
+  report = {}
+  for name, values in sorted(latencies.items()):
+    values.sort()
+    report[name] = {
+      'requests': len(values),
+      'errors': errors[name],
+      'p50_ms': percentile(values, 50),
+      'p95_ms': percentile(values, 95),
+      'p99_ms': percentile(values, 99),
+      'max_ms': values[-1],
+    }
+  report['total'] = {'requests': len(requests) * repeat, 'seconds': total_time,
+                     'requests_per_sec': len(requests) * repeat / total_time}
+  return report
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.replay', description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('log', help='requests log, as JSON lines')
+  parser.add_argument('--url', help='base url of a running server, instead of in-process')
+  parser.add_argument('--concurrency', type=int, default=1)
+  parser.add_argument('--repeat', type=int, default=1, help='times to replay the log')
+  parser.add_argument('--generate-users', type=int, default=0, metavar='N',
+                      help='in-process only: load N synthetic users before replaying')
+  parser.add_argument('--output', help='also write the report as JSON here')
+  args = parser.parse_args(argv)
+
+  if not args.url:  # Threads need a DB file, each one would get its own in-memory DB
+    os.environ.setdefault('BENCHMARK_DB', os.path.join(tempfile.mkdtemp(), 'replay.sqlite3'))
+  setup_django()
+  if not args.url:
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    if args.generate_users:
+      call_command('generate_users', args.generate_users, seed=0)
+
+  requests, skipped = load_requests(args.log)
+  if skipped:
+    print('Skipped {} lines without a "path"'.format(skipped), file=sys.stderr)
+  send = HttpSender(args.url) if args.url else InProcessSender()
+  report = replay(requests, send, args.concurrency, args.repeat)
+
+  print('{:28} {:>9} {:>7} {:>10} {:>10} {:>10}'.format(
+    'endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+  for name, stats in report.items():
+    if name != 'total':
+      print('{:28} {requests:9} {errors:7} {p50_ms:10.2f} {p95_ms:10.2f} {p99_ms:10.2f}'.format(
+        name, **stats))
+  print('{requests} requests in {seconds:.2f}s, {requests_per_sec:.1f} requests/sec'.format(
+    **report['total']))
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,12 @@
+from skill_test.settings import *  # noqa: F401,F403
+
+# Local stand-in for the Postgres database from docker-compose
+DATABASES = {
+  'default': {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.environ.get('BENCHMARK_DB', ':memory:'),
+    'OPTIONS': {'timeout': 30},  # Concurrent writers when replaying, wait instead of failing
+  }
+}
+DEBUG = False  # Otherwise every query is kept in memory
+USER_BIRTHDAY_CACHE = 'default'  # Not sharing the cache with a running server
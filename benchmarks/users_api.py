@@ -0,0 +1,55 @@
+"""Latency and throughput of the user_birthday endpoints, by users table size"""
+import json
+import time
+from . import best_time
+
+
+def make_users(count, seed=0):
+  """`count` users payload, with unique emails and realistic birthdays"""
+  from user_birthday.synthetic import iter_synthetic_users
+  return [dict(user, birthday=user['birthday'].strftime('%d.%m.%Y'))
+          for user in iter_synthetic_users(count, seed)]
+
+
+def run(sizes=(1000, 10000, 100000)):
+  from django.core.management import call_command
+  from django.test import Client
+  from user_birthday.models import User
+  from user_birthday.utils import invalidate_avg_age_cache
+  from user_birthday.cache import range_response_cache
+
+  call_command('migrate', verbosity=0)
+  client = Client()
+  results = {}
+  for size in sizes:
+    User.objects.all().delete()
+    payload = json.dumps(make_users(size))
+    start = time.perf_counter()
+    response = client.post('/api/v1/users/', payload, content_type='application/json')
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.content
+
+    def avg_age_cold():
+      invalidate_avg_age_cache()
+      client.get('/api/v1/users/avg_age')
+
+    def get_range(cold):
+      if cold:  # The query and its serialization, as before the range responses cache
+        range_response_cache.clear()
+      client.get('/api/v1/users/', {'from': '0103', 'to': '1503'})
+
+    results[str(size)] = {
+      'post_rows_per_sec': size / elapsed,
+      'get_all_ms': 1000 * best_time(lambda: client.get('/api/v1/users/'), repeat=3),
+      'get_range_ms': 1000 * best_time(lambda: get_range(cold=True), repeat=3),
+      'get_range_cached_ms': 1000 * best_time(lambda: get_range(cold=False), repeat=3),
+      'avg_age_cold_ms': 1000 * best_time(avg_age_cold),
+      'avg_age_warm_ms': 1000 * best_time(lambda: client.get('/api/v1/users/avg_age')),
+    }
+  return results
+
+
+if __name__ == '__main__':
+  from . import setup_django
+  setup_django()
+  print(json.dumps(run(), indent=2))
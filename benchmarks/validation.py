@@ -0,0 +1,41 @@
+"""Rows/sec of the POST rows validation: legacy layers vs the compiled validator"""
+import json
+from datetime import datetime
+from . import setup_django, best_time
+
+
+def legacy_validate_rows(rows):
+  """What every POST did before: jsonschema, then strptime, then a UserForm per row"""
+  from jsonschema import validate
+  from user_birthday.models import UserForm, json_user_birthday_schema
+  validate(rows, json_user_birthday_schema)
+  for row in rows:
+    row = dict(row)
+    row['birthday'] = datetime.strptime(row['birthday'], '%d.%m.%Y').date()
+    assert UserForm(row).is_valid()
+
+
+def compiled_validate_rows(rows):
+  from user_birthday.utils import validate_user_row
+  for row in rows:
+    validate_user_row(row)
+
+
+def run(rows_count=10000):
+  with open('user_birthday/tests/MOCK_DATA.json') as f:
+    mock_data = json.load(f)
+  rows = (mock_data * (rows_count // len(mock_data) + 1))[:rows_count]
+  results = {}
+  for name, func in [('legacy', legacy_validate_rows),
+                     ('compiled', compiled_validate_rows)]:
+    results[name] = rows_count / best_time(lambda: func(rows), repeat=3)
+  results['speedup'] = results['compiled'] / results['legacy']
+  return results
+
+
+if __name__ == '__main__':
+  setup_django()
+  results = run()
+  print('legacy:   {:10.0f} rows/sec'.format(results['legacy']))
+  print('compiled: {:10.0f} rows/sec'.format(results['compiled']))
+  print('speedup:  {:10.1f}x'.format(results['speedup']))
@@ -1,10 +1,36 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
 import json
 
-from .utils import permutate_upper_lower, word_has_reasonable_length
+from .settings import stream_min_variants
+from .cache import get_permutations_json
+from .utils import word_has_reasonable_length, \
+                   iter_upper_lower, count_upper_lower, iter_json_array, \
+                   upper_lower_range, parse_range_querystring, iter_json_array_parallel, \
+                   worth_generating_in_parallel, get_word_etag
 
+@condition(etag_func=get_word_etag)
 def letter_digit(request, word=''):
-  if not word_has_reasonable_length(word):
+  try:
+    offset, limit = parse_range_querystring(request.GET.get('offset'), request.GET.get('limit'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'offset&limit': str(err)}), status=400)
+  only_count = request.GET.get('count') in ('1', 'true')
+  # Counting, or computing a range of variants, doesn't need to enumerate the rest
+  if not word_has_reasonable_length(word, check_alpha_letters=not (only_count or limit)):
     return HttpResponse(status=412, reason="Word is too expensive to process")
-  result = permutate_upper_lower(word)
-  return HttpResponse(json.dumps(result, ensure_ascii=False), content_type='application/json')
+
+  if only_count:
+    return HttpResponse(json.dumps(count_upper_lower(word)), content_type='application/json')
+  if limit:
+    result = upper_lower_range(word, offset, limit)
+    return HttpResponse(json.dumps(result, ensure_ascii=False), content_type='application/json')
+  if worth_generating_in_parallel(word):
+    # Generated across a process pool, sending chunks in order as they are done
+    return StreamingHttpResponse(iter_json_array_parallel(word),
+                                 content_type='application/json')
+  if count_upper_lower(word) > stream_min_variants:
+    # Sending variants as they are generated, without building the whole list
+    return StreamingHttpResponse(iter_json_array(iter_upper_lower(word)),
+                                 content_type='application/json')
+  return HttpResponse(get_permutations_json(word), content_type='application/json')
@@ -0,0 +1,60 @@
+import json
+from skill_test.lru import SizedLRUCache
+from .settings import response_cache_max_bytes, template_cache_max_bytes
+from .utils import case_pairs, iter_variants
+
+# Serialized responses by word, and templates by layout: apart, so their hits are too
+response_cache = SizedLRUCache(response_cache_max_bytes, name='letter_digit_responses')
+template_cache = SizedLRUCache(template_cache_max_bytes, name='letter_digit_templates')
+
+# Template placeholders are single bytes, any but the ones of the JSON array itself
+_placeholders = bytes(b for b in range(256) if b not in b'[]", ')
+# Characters substituted as they are: 1 byte each, and not escaped in JSON
+_plain_chars = frozenset(chr(b) for b in range(0x20, 0x80)) - frozenset('"\\')
+
+
+def get_permutations_json(word):
+  """
+  Same as `json.dumps(permutate_upper_lower(word), ensure_ascii=False)`, as utf-8 bytes.
+  Responses are cached by the lowercased word, and (for plain ascii words) built by
+  substituting the word's letters into a template shared by every word with the same
+  layout (options of each character), with a single `bytes.translate`.
+  """
+  letters = case_pairs(word)
+  key = word.lower()
+  if case_pairs(key) != letters:  # A few unicode letters, i.e 'ẞ'.lower().upper() is 'SS'
+    return _serialize(letters)
+  data = response_cache.get(key)
+  if data is None:
+    layout = tuple(len(options) for options in letters)
+    if sum(layout) <= len(_placeholders) and _plain_chars.issuperset(key + key.upper()):
+      data = _get_layout_template(layout).translate(_get_template_table(letters))
+    else:
+      data = _serialize(letters)
+    response_cache.set(key, data)
+  return data
+
+def _serialize(letters):
+  return json.dumps(list(iter_variants(letters)), ensure_ascii=False).encode('utf-8')
+
+def _get_layout_template(layout):
+  """
+  The serialized variants of a word made of placeholders, one per option of each
+  character (lower and upper for letters). Substituting them gives any word's response.
+  """
+  template = template_cache.get(layout)
+  if template is None:
+    placeholders = iter(_placeholders.decode('latin-1'))
+    letters = [tuple(next(placeholders) for _ in range(options)) for options in layout]
+    # As json.dumps would write it, but without escaping the placeholders
+    template = '[{}]'.format(', '.join('"{}"'.format(variant) for variant in iter_variants(letters)))
+    template = template.encode('latin-1')
+    template_cache.set(layout, template)
+  return template
+
+def _get_template_table(letters):
+  """bytes.translate table from a layout template's placeholders to `letters`"""
+  table = bytearray(range(256))
+  for placeholder, c in zip(_placeholders, (c for options in letters for c in options)):
+    table[placeholder] = ord(c)
+  return bytes(table)
@@ -1,2 +1,10 @@
-max_alpha_letters = 20  # To avoid too expensive computations
-max_word_length = 500  # To avoid max recursion error
+max_alpha_letters = 24  # To avoid too expensive computations (big results are streamed)
+max_word_length = 500  # To avoid too big responses
+stream_min_variants = 2 ** 12  # Results with more variants are streamed
+stream_chunk_variants = 2 ** 12  # Variants encoded and sent at a time when streaming
+max_page_variants = 10000  # Max `limit` when asking for a range of the variants
+response_cache_max_bytes = 64 * 1024 * 1024  # Memory budget of the responses cache
+template_cache_max_bytes = 8 * 1024 * 1024  # Memory budget of the layout templates cache
+parallel_min_variants = 2 ** 20  # Results with more variants are generated by a process pool
+parallel_chunk_variants = 2 ** 16  # Variants generated by each task of the pool
+parallel_workers = None  # Processes in the pool, None for one per CPU
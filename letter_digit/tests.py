@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
 
-from django.test import TestCase, Client
-from .settings import max_alpha_letters, max_word_length
+from django.test import TestCase, Client, AsyncClient, override_settings
+import json
+from .settings import max_alpha_letters, max_word_length, max_page_variants
+from .utils import permutate_upper_lower, iter_upper_lower, count_upper_lower, \
+                   iter_json_array, upper_lower_at, permutate_upper_lower_imperative, \
+                   permutate_upper_lower_recursive, permutate_upper_lower_segments, \
+                   case_segments, case_pairs, iter_json_array_parallel
+from . import utils
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from asgiref.sync import sync_to_async
+from .cache import get_permutations_json, response_cache, template_cache
+from skill_test.lru import SizedLRUCache
 
 class LetterDigitTestCase(TestCase):
   def setUp(self):
@@ -61,5 +73,201 @@ class LetterDigitTestCase(TestCase):
     response = self.client.get(self.baseUrl + request)
     self.assertEqual(response.json(), [request])
 
-  
-    
\ No newline at end of file
+  def test_big_results_are_streamed(self):
+    request = 'a1B2c3d4e5f6g7h8i9j0kLm'
+    response = self.client.get(self.baseUrl + request)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.streaming)
+    content = b''.join(response.streaming_content)
+    self.assertEqual(content.decode('utf-8'),
+                     json.dumps(permutate_upper_lower(request), ensure_ascii=False))
+
+  def test_count(self):
+    response = self.client.get(self.baseUrl + 'a2B', {'count': 'true'})
+    self.assertEqual(response.json(), 4)
+
+  def test_count_huge_word(self):
+    response = self.client.get(self.baseUrl + 'a' * 300, {'count': '1'})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json(), 2 ** 300)
+
+  def test_range(self):
+    request = 'a2Bc'
+    response = self.client.get(self.baseUrl + request, {'offset': 2, 'limit': 3})
+    self.assertEqual(response.json(), permutate_upper_lower(request)[2:5])
+    response = self.client.get(self.baseUrl + request, {'offset': 6})
+    self.assertEqual(response.json(), permutate_upper_lower(request)[6:])
+    response = self.client.get(self.baseUrl + request, {'offset': 100})
+    self.assertEqual(response.json(), [])
+
+  def test_range_huge_word(self):
+    request = 'a1' * 200
+    response = self.client.get(self.baseUrl + request, {'offset': 2 ** 200 - 1, 'limit': 5})
+    self.assertEqual(response.json(), ['A1' * 200])
+
+  def test_range_bad_arguments(self):
+    for params in [{'offset': -1}, {'limit': 0}, {'limit': 'a'}, {'limit': max_page_variants + 1}]:
+      response = self.client.get(self.baseUrl + 'ab', params)
+      self.assertEqual(response.status_code, 400)
+
+  def test_conditional_get(self):
+    response = self.client.get(self.baseUrl + 'a2B')
+    etag = response['ETag']
+    self.assertRegex(etag, r'^"[0-9a-f]+"$')  # Strong
+    self.assertEqual(self.client.get(self.baseUrl + 'a2B')['ETag'], etag)
+    self.assertNotEqual(self.client.get(self.baseUrl + 'a2b')['ETag'], etag)
+    with mock.patch('letter_digit.apis.get_permutations_json') as get_permutations_json:
+      response = self.client.get(self.baseUrl + 'a2B', HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    get_permutations_json.assert_not_called()
+
+  def test_range_word_too_long(self):
+    request = 'a' * (max_word_length + 1)
+    response = self.client.get(self.baseUrl + request, {'limit': 1})
+    self.assertEqual(response.status_code, 412)
+
+  @mock.patch('letter_digit.utils.parallel_min_variants', 2 ** 10)
+  @mock.patch('letter_digit.utils.parallel_chunk_variants', 2 ** 5)
+  @mock.patch('letter_digit.utils.parallel_workers', 2)
+  def test_big_results_are_generated_in_parallel(self):
+    request = 'a1B2c3d4e5f6g7h8i9j0kL'
+    with mock.patch('letter_digit.apis.iter_json_array_parallel',
+                    side_effect=iter_json_array_parallel) as parallel:
+      response = self.client.get(self.baseUrl + request)
+    parallel.assert_called_once_with(request)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(b''.join(response.streaming_content).decode('utf-8'),
+                     json.dumps(permutate_upper_lower(request), ensure_ascii=False))
+
+
+@override_settings(ROOT_URLCONF='skill_test.asgi_urls')
+class LetterDigitAsyncTestCase(TestCase):
+  def setUp(self):
+    self.client = AsyncClient()
+    self.baseUrl = '/api/v1/letter_digit/'
+
+  async def test_same_as_sync(self):
+    # AsyncClient.get() ignores `data`, and decodes non-ASCII paths as latin-1, in Django 3.2
+    for request in ['a', 'a2B', 'a2Bc?offset=2&limit=3', 'a2B?count=1', 'ab?limit=a',
+                    'a' * (max_alpha_letters + 1)]:
+      response = await self.client.get(self.baseUrl + request)
+      expected = await sync_to_async(Client().get)(self.baseUrl + request)
+      self.assertEqual(response.status_code, expected.status_code)
+      self.assertEqual(response.content, expected.content)
+
+  async def test_big_results_are_streamed(self):
+    request = 'a1B2c3d4e5f6g7h8i9j0kLm'
+    response = await self.client.get(self.baseUrl + request)
+    self.assertTrue(response.streaming)
+    self.assertFalse(response.stream_thread_sensitive)
+    self.assertEqual(b''.join(response.streaming_content).decode('utf-8'),
+                     json.dumps(permutate_upper_lower(request), ensure_ascii=False))
+
+
+class LetterDigitUtilsTestCase(TestCase):
+  def test_iter_same_order_as_list(self):
+    for word in ['', '1', 'a', 'a2B', 'Ab-cD_eFgH', 'ñandú 42 ÇA', 'x' * 15 + '!']:
+      for tail_alpha_letters in [1, 3, 12]:
+        self.assertEqual(list(iter_upper_lower(word, tail_alpha_letters)),
+                         permutate_upper_lower(word))
+
+  def test_all_versions_same_order(self):
+    for word in ['', '1', 'a', 'a2B', '12Ab-cD_eFgH--', 'ñandú 42 ÇA', 'a1B' + '-' * 600 + 'c']:
+      expected = permutate_upper_lower_imperative(word)
+      self.assertEqual(permutate_upper_lower_segments(word), expected)
+      if len(word) < 500:  # Limited by the recursion depth
+        self.assertEqual(permutate_upper_lower_recursive(word), expected)
+
+  def test_case_segments(self):
+    self.assertEqual(case_segments(case_pairs('-1aB2 c.')),
+                     ('-1', [('a', 'A'), ('b2 ', 'B2 '), ('c.', 'C.')]))
+
+  def test_count(self):
+    self.assertEqual(count_upper_lower('a2B!c'), 8)
+    self.assertEqual(count_upper_lower('123'), 1)
+
+  def test_iter_json_array_parallel(self):
+    for word in ['', '1', 'a2B', '-Ab-cD_eFgH--', 'ñandú 42 ÇA"']:
+      for chunk_variants in [1, 2, 3, 16, 2 ** 16]:
+        for max_workers in [1, 4]:
+          self.assertEqual(''.join(iter_json_array_parallel(word, chunk_variants, max_workers)),
+                           json.dumps(permutate_upper_lower(word), ensure_ascii=False))
+
+  def test_broken_process_pool(self):
+    class BreakingExecutor:  # Its third task fails, as when a worker is killed
+      def __init__(self, broken_at):
+        self.tasks, self.broken_at, self.shutdown_called = 0, broken_at, False
+      def submit(self, func, *args):
+        self.tasks += 1
+        if self.tasks == 3 and self.broken_at == 'submit':
+          raise BrokenProcessPool()
+        future = Future()
+        if self.tasks == 3:
+          future.set_exception(BrokenProcessPool())
+        else:
+          future.set_result(func(*args))
+        return future
+      def shutdown(self, wait=True):
+        self.shutdown_called = True
+
+    word = '-Ab-cD_eFgH--'
+    for broken_at in ['result', 'submit']:
+      executor = BreakingExecutor(broken_at)
+      with mock.patch.object(utils, '_executor', executor):
+        self.assertEqual(''.join(iter_json_array_parallel(word, 4, 2)),
+                         json.dumps(permutate_upper_lower(word), ensure_ascii=False))
+        self.assertIsNone(utils._executor)  # A new one for the next request
+      self.assertTrue(executor.shutdown_called)
+
+  def test_process_pool_not_forked(self):
+    with mock.patch.object(utils, '_executor', None), \
+         mock.patch.object(utils, 'ProcessPoolExecutor') as pool_class:
+      self.assertIs(utils._get_executor(), utils._get_executor())
+    pool_class.assert_called_once()
+    self.assertIn(pool_class.call_args[1]['mp_context'].get_start_method(),
+                  ('forkserver', 'spawn'))
+
+  def test_upper_lower_at(self):
+    for word in ['', '1', 'a2B', 'Ab-cD_eFgH', 'ñandú 42 ÇA']:
+      self.assertEqual([upper_lower_at(word, i) for i in range(count_upper_lower(word))],
+                       permutate_upper_lower(word))
+
+  def test_cached_responses(self):
+    response_cache.clear()
+    for word in ['', ' ', '1"\\', 'a2B', 'A2b', 'x9Y', 'ñandú 42 ÇA', 'ẞa', 'abcdefghijkl']:
+      for _ in range(2):
+        self.assertEqual(get_permutations_json(word).decode('utf-8'),
+                         json.dumps(permutate_upper_lower(word), ensure_ascii=False))
+    self.assertGreater(response_cache.hits, 0)
+
+  def test_cache_shares_layouts(self):
+    response_cache.clear()
+    template_cache.clear()
+    get_permutations_json('a2B')
+    responses, templates = response_cache.stats(), template_cache.stats()
+    get_permutations_json('x9Y')  # New word, same layout
+    self.assertEqual(response_cache.stats()['misses'], responses['misses'] + 1)
+    self.assertEqual(template_cache.stats()['hits'], templates['hits'] + 1)
+    get_permutations_json('A2b')  # Same word
+    self.assertEqual(response_cache.stats()['hits'], responses['hits'] + 1)
+    self.assertEqual(template_cache.stats()['hits'], templates['hits'] + 1)
+    self.assertEqual((response_cache.stats()['entries'], template_cache.stats()['entries']),
+                     (2, 1))
+
+  def test_cache_byte_budget(self):
+    cache = SizedLRUCache(10, sizeof=len)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    cache.get('a')
+    cache.set('c', b'123')  # Evicts 'b', the least recently used
+    self.assertFalse(cache.set('d', b'12345678901'))
+    self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (b'12345', None, b'123'))
+    self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1, 'evictions': 1, 'entries': 2,
+                                     'bytes': 8, 'max_bytes': 10})
+
+  def test_iter_json_array(self):
+    for items in [[], ['a'], ['a"b', 'ñ\\', 'c'] * 5]:
+      for chunk_size in [1, 2, 100]:
+        self.assertEqual(''.join(iter_json_array(items, chunk_size)),
+                         json.dumps(items, ensure_ascii=False))
+
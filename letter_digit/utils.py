@@ -1,9 +1,33 @@
-from itertools import product
-from .settings import max_alpha_letters, max_word_length
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice, product
+from .settings import max_alpha_letters, max_word_length, stream_chunk_variants, \
+                      max_page_variants, parallel_min_variants, parallel_chunk_variants, \
+                      parallel_workers
+
+_executor = None  # Process pool, created on first use
+_executor_lock = threading.Lock()
 
 def permutate_upper_lower(word):
   assert(word_has_reasonable_length(word))
-  return permutate_upper_lower_recursive(word)
+  return permutate_upper_lower_segments(word)
+
+
+def permutate_upper_lower_segments(word):  # Iterative version, over fixed segments
+  """
+  Non-alpha characters are glued to the letter before them (or to a fixed prefix),
+  so only the two cases of every letter are combined, letters are lowered and
+  uppered only once, and every variant is built by a single join. No recursion,
+  and the same order as the other versions.
+  """
+  prefix, segments = case_segments(case_pairs(word))
+  return list(map("".join, product((prefix,), *segments)))
   
 
 def permutate_upper_lower_imperative(word):  # Iterative version using itertools
@@ -20,10 +44,162 @@ def permutate_upper_lower_recursive(word, words=['']):  # Recursive version
     new_words += [next_letter.upper() + w for w in words]
   return permutate_upper_lower_recursive(remaining_word, new_words)
 
-def word_has_reasonable_length(word):
+def iter_upper_lower(word, tail_alpha_letters=12):
+  """
+  Lazy version of `permutate_upper_lower`, yielding the variants in the same order.
+  The variants of the last `tail_alpha_letters` (at least 1) alpha letters are built
+  once and reused after every variant of the head, so only those are kept in memory.
+  """
+  return iter_variants(case_pairs(word), tail_alpha_letters)
+
+def case_pairs(word):
+  """Options for every character of `word`: (lower, upper) for letters, (lower,) for the rest"""
+  return [(c.lower(), c.upper()) if str.isalpha(c) else (c.lower(),) for c in word]
+
+def case_segments(letters):
+  """
+  Returns the fixed prefix of `letters` (see `case_pairs`), and for every letter
+  its (lower, upper) cases followed by the fixed characters up to the next letter.
+  """
+  prefix, segments = [], []
+  for options in letters:
+    if len(options) == 2:
+      segments.append([[options[0]], [options[1]]])
+    elif segments:
+      segments[-1][0].append(options[0])
+      segments[-1][1].append(options[0])
+    else:
+      prefix.append(options[0])
+  return "".join(prefix), [("".join(lower), "".join(upper)) for lower, upper in segments]
+
+def iter_variants(letters, tail_alpha_letters=12):
+  """Yields every combination of the `letters` options, see `iter_upper_lower`"""
+  prefix, segments = case_segments(letters)
+  split = max(len(segments) - tail_alpha_letters, 0)
+  tails = list(map("".join, product(*segments[split:])))
+  for head in map("".join, product((prefix,), *segments[:split])):
+    for tail in tails:
+      yield head + tail
+
+def count_alpha_letters(word):
+  return sum(1 for l in word if str.isalpha(l))
+
+def count_upper_lower(word):
+  """Number of variants of `word`"""
+  return 2 ** count_alpha_letters(word)
+
+def upper_lower_at(word, index):
+  """
+  The `index`-th variant of `word`, as in `permutate_upper_lower`, in O(len(word)):
+  letters are upper case where the bits of `index` (most significant first) are set.
+  """
+  bit = count_alpha_letters(word)
+  variant = []
+  for l in word:
+    if str.isalpha(l):
+      bit -= 1
+      variant.append(l.upper() if index >> bit & 1 else l.lower())
+    else:
+      variant.append(l.lower())
+  return "".join(variant)
+
+def upper_lower_range(word, offset, limit):
+  """Variants of `word` from `offset`, up to `limit` of them, without enumerating the rest"""
+  stop = min(offset + limit, count_upper_lower(word))
+  return [upper_lower_at(word, index) for index in range(offset, stop)]
+
+def parse_range_querystring(offset, limit):
+  """Returns either (offset, limit) or (None, None), or ValueError with description"""
+  if offset is None and limit is None:
+    return (None, None)
+  try:
+    offset = int(offset) if offset is not None else 0
+    limit = int(limit) if limit is not None else max_page_variants
+  except ValueError:
+    raise ValueError('Bad offset or limit, expected integers\n')
+  if offset < 0 or not 0 < limit <= max_page_variants:
+    raise ValueError('Expected offset >= 0 and limit from 1 to {}\n'.format(max_page_variants))
+  return (offset, limit)
+
+def iter_json_array(items, chunk_size=stream_chunk_variants):
+  """Yields the same as `json.dumps(list(items), ensure_ascii=False)`, in chunks"""
+  items = iter(items)
+  separator = '['
+  for chunk in iter(lambda: list(islice(items, chunk_size)), []):
+    yield separator + json.dumps(chunk, ensure_ascii=False)[1:-1]
+    separator = ', '
+  yield ']' if separator == ', ' else '[]'
+
+def worth_generating_in_parallel(word):
+  """Only for big results, and with more than one CPU"""
+  workers = parallel_workers or os.cpu_count() or 1
+  return workers > 1 and count_upper_lower(word) > parallel_min_variants
+
+def iter_json_array_parallel(word, chunk_variants=None, max_workers=None):
+  """
+  Same as `iter_json_array(iter_upper_lower(word))`, splitting the variants by their
+  high-order mask bits (the cases of the first letters) into tasks of `chunk_variants`
+  variants each, generated and encoded across a process pool. Chunks are yielded in
+  order as they are done, keeping only a few of them pending at a time.
+  """
+  executor = _get_executor()
+  chunk_variants = chunk_variants or parallel_chunk_variants
+  max_workers = max_workers or parallel_workers or os.cpu_count()
+  prefix, segments = case_segments(case_pairs(word))
+  split = max(len(segments) - max(chunk_variants.bit_length() - 1, 0), 0)
+  heads = map("".join, product((prefix,), *segments[:split]))
+  tail_segments = segments[split:]
+  pending = deque()  # (head, future), in order
+  separator = '['
+  try:
+    for head in heads:
+      pending.append((head, None))  # Kept if the pool breaks while submitting it
+      pending[-1] = (head, executor.submit(_variants_json_chunk, head, tail_segments))
+      if len(pending) >= 2 * max_workers:
+        yield separator + pending[0][1].result()
+        pending.popleft()
+        separator = ', '
+    while pending:
+      yield separator + pending[0][1].result()
+      pending.popleft()
+      separator = ', '
+  except BrokenProcessPool:  # A worker died: the next requests get a new pool,
+    _discard_executor(executor)  # and this one goes on in this process
+    for head in [head for head, _ in pending] + list(heads):
+      yield separator + _variants_json_chunk(head, tail_segments)
+      separator = ', '
+  yield ']'
+
+def _variants_json_chunk(head, segments):  # Runs in the pool's processes
+  return json.dumps(list(map("".join, product((head,), *segments))), ensure_ascii=False)[1:-1]
+
+def _get_executor():
+  """
+  The process pool, shared by the requests. Its processes are started by a fork
+  server (or spawned), not forked from this multi-threaded one.
+  """
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      methods = multiprocessing.get_all_start_methods()
+      context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+      _executor = ProcessPoolExecutor(max_workers=parallel_workers, mp_context=context)
+    return _executor
+
+def _discard_executor(executor):
+  global _executor
+  with _executor_lock:
+    if _executor is executor:
+      _executor = None
+  executor.shutdown(wait=False)
+
+def word_has_reasonable_length(word, check_alpha_letters=True):
+  """`check_alpha_letters` is only needed when every variant will be generated"""
   count = 0
   if max_word_length < len(word):
     return False
+  if not check_alpha_letters:
+    return True
   for l in word:
     if str.isalpha(l):
       count += 1
@@ -31,3 +207,10 @@ def word_has_reasonable_length(word):
       return False
   return True
     
+
+def get_word_etag(request, word=''):
+  """
+  Strong ETag for the `condition` decorator: variants only depend on the word
+  (ETags are compared for the same URL, so with the same offset, limit and count)
+  """
+  return '"{}"'.format(hashlib.blake2b(word.encode('utf-8'), digest_size=16).hexdigest())
@@ -0,0 +1,26 @@
+"""
+ASGI config for skill_test project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+serving the async versions of the views (see skill_test/asgi_urls.py), i.e:
+
+  uvicorn skill_test.asgi:application
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'skill_test.settings')
+# Every request runs in a thread of its own (see skill_test/handlers.py), so its DB
+# connection can't be reused by the next ones: closed at the end of each request
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+django.setup(set_prefix=False)
+
+from .handlers import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
@@ -0,0 +1,30 @@
+"""
+Same URLs as skill_test/urls.py, served by the async views (see skill_test/asgi.py)
+"""
+from django.urls import path
+from letter_digit import apis as letter_digit_apis
+from user_birthday import apis as user_birthday_apis
+from .handlers import async_view
+from .metrics import metrics_view
+
+urlpatterns = [
+    # Variants aren't read from the DB: generated in any thread of the pool
+    path('api/v1/letter_digit/<str:word>',
+         async_view(letter_digit_apis.letter_digit, thread_sensitive=False),
+         name="letter_digit"),
+    path('api/v1/users/', async_view(user_birthday_apis.user_birthdays), name="user_birthdays"),
+    path('api/v1/users/avg_age', async_view(user_birthday_apis.user_birthdays_avg_age),
+         name="user_birthdays_average"),
+    path('api/v1/users/upcoming', async_view(user_birthday_apis.user_birthdays_upcoming),
+         name="user_birthdays_upcoming"),
+    path('api/v1/users/age_histogram', async_view(user_birthday_apis.user_birthdays_age_histogram),
+         name="user_birthdays_age_histogram"),
+    path('api/v1/users/birthdays_count', async_view(user_birthday_apis.user_birthdays_count),
+         name="user_birthdays_count"),
+    path('api/v1/users/import_jobs/<uuid:job_id>',
+         async_view(user_birthday_apis.user_birthdays_import_job),
+         name="user_birthdays_import_job"),
+    path('api/v1/users/export', async_view(user_birthday_apis.user_birthdays_export),
+         name="user_birthdays_export"),
+    path('metrics', metrics_view, name="metrics"),
+]
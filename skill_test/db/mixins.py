@@ -0,0 +1,93 @@
+from functools import partial
+from .pool import ConnectionPool, get_pool
+
+
+class HealthCheckMixin:
+  """
+  DatabaseWrapper mixin checking that a persistent connection (CONN_MAX_AGE) still
+  works before its first use in a new request, reconnecting otherwise. A backport
+  of the CONN_HEALTH_CHECKS setting of Django 4.1.
+  """
+  health_check_done = False
+
+  @property
+  def health_check_enabled(self):
+    return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+  def connect(self):
+    super().connect()
+    self.health_check_done = True
+
+  def close_if_unusable_or_obsolete(self):
+    if self.connection is not None:
+      self.health_check_done = False
+    super().close_if_unusable_or_obsolete()
+
+  def close_if_health_check_failed(self):
+    if (self.connection is None or not self.health_check_enabled or self.health_check_done
+        or self.in_atomic_block):
+      return
+    if not self.is_usable():
+      self.close()
+    self.health_check_done = True
+
+  def _cursor(self, name=None):
+    self.close_if_health_check_failed()
+    return super()._cursor(name)
+
+
+class PooledConnectionMixin:
+  """
+  DatabaseWrapper mixin borrowing the connections from a pool shared by every
+  thread of the process, when the POOL setting is set (SIZE, MAX_OVERFLOW and
+  TIMEOUT, see skill_test.db.pool.ConnectionPool). Connections go back to the
+  pool when Django closes them, that is at the end of every request with
+  CONN_MAX_AGE = 0. Borrowed connections are checked by the pool, when they were idle.
+  """
+
+  @property
+  def pool(self):
+    options = self.settings_dict.get('POOL')
+    if not options:
+      return None
+    return get_pool(self.alias, partial(self.create_pool, options))
+
+  def create_pool(self, options):
+    return ConnectionPool(
+      # Every wrapper (one per thread) opens connections with the same parameters
+      connect=partial(super().get_new_connection, self.get_connection_params()),
+      size=options.get('SIZE', 5),
+      max_overflow=options.get('MAX_OVERFLOW', 10),
+      timeout=options.get('TIMEOUT', 30),
+      reset=self.reset_pooled_connection,
+      check=self.check_pooled_connection)
+
+  def get_new_connection(self, conn_params):
+    pool = self.pool
+    if pool is None:
+      return super().get_new_connection(conn_params)
+    return pool.acquire()
+
+  def _close(self):
+    pool = self.pool
+    if pool is None or self.connection is None:
+      return super()._close()
+    with self.wrap_database_errors:
+      # Closed inside a transaction, Django keeps using it until the transaction ends
+      pool.release(self.connection, discard=self.in_atomic_block)
+
+  def reset_pooled_connection(self, connection):
+    """Leaves `connection` ready for the next user, returns False if it's unusable"""
+    connection.rollback()
+
+  def check_pooled_connection(self, connection):
+    """
+    Checks that an idle `connection` still works when it's borrowed, so it's not
+    checked again by HealthCheckMixin during the request.
+    """
+    cursor = connection.cursor()
+    try:
+      cursor.execute('SELECT 1')
+    finally:
+      cursor.close()
+    return True
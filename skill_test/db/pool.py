@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import deque
+
+
+class PoolTimeout(Exception):
+  """No connection was released in time, with the pool and its overflow in use"""
+
+
+class ConnectionPool:
+  """
+  Thread safe pool of DB connections, opened by `connect()`. Keeps up to `size`
+  idle connections, and opens up to `max_overflow` more while they are all in
+  use (closed once given back). Beyond that, `acquire()` waits up to `timeout`
+  seconds for a connection to be released.
+  Connections given back are `reset(connection)` (discarded if it returns False
+  or fails), and idle ones are `check(connection)`ed before being reused.
+  """
+
+  def __init__(self, connect, size=5, max_overflow=10, timeout=30,
+               reset=None, check=None, close=None):
+    self.connect = connect
+    self.size = size
+    self.max_overflow = max_overflow
+    self.timeout = timeout
+    self.reset = reset
+    self.check = check
+    self.close_connection = close or (lambda connection: connection.close())
+    self.in_use = 0
+    self.created = self.closed = self.checkouts = self.waits = self.timeouts = 0
+    self._idle = deque()
+    self._lock = threading.Condition()
+
+  def acquire(self):
+    while True:
+      connection = self._checkout()
+      if connection is None:  # A slot for a new one
+        return self._open()
+      # Checked out of the lock, it may be a round trip to the server
+      if self.check is None or self._safe_call(self.check, connection):
+        with self._lock:
+          self.checkouts += 1
+        return connection
+      with self._lock:  # Broken while idle: its slot goes to the next try
+        self.in_use -= 1
+        self.closed += 1
+        self._lock.notify()
+      self._safe_call(self.close_connection, connection)
+
+  def _checkout(self):
+    """An idle connection, or None after reserving a slot to open a new one"""
+    deadline = None
+    with self._lock:
+      while True:
+        if self._idle:
+          self.in_use += 1
+          return self._idle.pop()  # The most recently used one
+        if self.in_use < self.size + self.max_overflow:
+          self.in_use += 1  # Opening a new one, out of the lock
+          return None
+        if deadline is None:
+          self.waits += 1
+          deadline = time.monotonic() + self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          self.timeouts += 1
+          raise PoolTimeout('No DB connection released in {}s ({} in use)'.format(
+            self.timeout, self.in_use))
+        self._lock.wait(remaining)
+
+  def _open(self):
+    try:
+      connection = self.connect()
+    except BaseException:
+      with self._lock:
+        self.in_use -= 1
+        self._lock.notify()
+      raise
+    with self._lock:
+      self.created += 1
+      self.checkouts += 1
+    return connection
+
+  def release(self, connection, discard=False):
+    """Gives `connection` back, or closes it if `discard` or the pool is full"""
+    keep = not discard and (self.reset is None or self._safe_call(self.reset, connection))
+    with self._lock:
+      self.in_use -= 1
+      keep = keep and len(self._idle) + self.in_use < self.size
+      if keep:
+        self._idle.append(connection)
+      else:
+        self.closed += 1
+      self._lock.notify()
+    if not keep:
+      self._safe_call(self.close_connection, connection)
+
+  def close_idle(self):
+    with self._lock:
+      while self._idle:
+        self._close(self._idle.pop())
+
+  def _close(self, connection):
+    self.closed += 1
+    self._safe_call(self.close_connection, connection)
+
+  @staticmethod
+  def _safe_call(func, connection):
+    try:
+      return func(connection) is not False
+    except Exception:  # A broken connection
+      return False
+
+  def stats(self):
+    return {
+      'size': self.size,
+      'max_overflow': self.max_overflow,
+      'in_use': self.in_use,
+      'idle': len(self._idle),
+      'created': self.created,
+      'closed': self.closed,
+      'checkouts': self.checkouts,
+      'waits': self.waits,
+      'timeouts': self.timeouts,
+    }
+
+
+# Pools of this process, by DB alias
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, factory):
+  """The pool of `alias`, created by `factory()` the first time"""
+  pool = pools.get(alias)
+  if pool is None:
+    with _pools_lock:
+      pool = pools.get(alias)
+      if pool is None:
+        pool = pools[alias] = factory()
+  return pool
@@ -0,0 +1,36 @@
+"""
+Django's PostgreSQL backend, with health checks of the persistent connections
+(CONN_HEALTH_CHECKS) and an optional in-process connection pool (POOL).
+See skill_test/db/mixins.py.
+"""
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from ..mixins import PooledConnectionMixin, HealthCheckMixin
+
+
+class DatabaseWrapper(PooledConnectionMixin, HealthCheckMixin, base.DatabaseWrapper):
+
+  def get_new_connection(self, conn_params):
+    connection = super().get_new_connection(conn_params)
+    # Set by Django when opening the connection, so not when it comes from the pool
+    self.isolation_level = self.settings_dict['OPTIONS'].get(
+      'isolation_level', connection.isolation_level)
+    return connection
+
+  def reset_pooled_connection(self, connection):
+    if connection.closed:
+      return False
+    if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+      connection.rollback()
+    return True
+
+  def check_pooled_connection(self, connection):
+    # `closed` isn't updated when the server drops the connection: a round trip
+    if connection.closed:
+      return False
+    with connection.cursor() as cursor:
+      cursor.execute('SELECT 1')
+    if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+      connection.rollback()  # Without autocommit, the query started a transaction
+    return True
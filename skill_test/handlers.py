@@ -0,0 +1,75 @@
+from functools import partial, wraps
+from asgiref.sync import sync_to_async, ThreadSensitiveContext
+from django.core.handlers import asgi
+
+
+def async_view(view, thread_sensitive=True):
+  """
+  The async version of the sync `view`, for ASGI: it runs in the request's thread
+  (the one of its ORM work, see ASGIHandler), or in any thread of the pool without
+  `thread_sensitive`, for views not using the ORM (their streamed responses too).
+  """
+  run_view = sync_to_async(view, thread_sensitive=thread_sensitive)
+
+  @wraps(view)
+  async def view_async(request, *args, **kwargs):
+    response = await run_view(request, *args, **kwargs)
+    if not thread_sensitive:
+      response.stream_thread_sensitive = False
+    return response
+  return view_async
+
+
+class ASGIHandler(asgi.ASGIHandler):
+  """
+  Django's ASGI handler, routing to the async views (`urlconf`), and sending
+  streamed responses without blocking the event loop: Django 3.2 iterates them
+  in the loop itself, where they can't use the ORM, and where generating a big
+  response stalls every other request. Here every chunk is generated in the
+  thread running the ORM work (`sync_to_async` thread sensitive), or in any
+  thread of the pool if the response sets `stream_thread_sensitive = False`.
+  Every request gets a thread of its own for that work, as in Django 4.
+  """
+  urlconf = 'skill_test.asgi_urls'
+
+  async def __call__(self, scope, receive, send):
+    # Otherwise asgiref runs the thread sensitive work of every request in the
+    # same single thread, one call at a time
+    async with ThreadSensitiveContext():
+      await super().__call__(scope, receive, send)
+
+  def create_request(self, scope, body_file):
+    request, error_response = super().create_request(scope, body_file)
+    if request is not None:
+      request.urlconf = self.urlconf
+    return request, error_response
+
+  async def send_response(self, response, send):
+    if not response.streaming:
+      return await super().send_response(response, send)
+
+    response_headers = []
+    for header, value in response.items():
+      if isinstance(header, str):
+        header = header.encode('ascii')
+      if isinstance(value, str):
+        value = value.encode('latin1')
+      response_headers.append((bytes(header), bytes(value)))
+    for c in response.cookies.values():
+      response_headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+    await send({
+      'type': 'http.response.start',
+      'status': response.status_code,
+      'headers': response_headers,
+    })
+    next_part = sync_to_async(
+      partial(next, iter(response)),
+      thread_sensitive=getattr(response, 'stream_thread_sensitive', True))
+    while True:
+      part = await next_part(None)
+      if part is None:
+        break
+      for chunk, _ in self.chunk_bytes(part):
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body'})
+    await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,67 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+# Caches by name, their stats are exported on /metrics (see skill_test/metrics.py)
+caches = {}
+
+
+class SizedLRUCache:
+  """
+  In-process LRU cache, bounded by the total size of its values (in bytes,
+  as measured by `sizeof`) instead of by the number of entries.
+  Thread safe, and counting hits, misses and evictions.
+  """
+
+  def __init__(self, max_bytes, sizeof=sys.getsizeof, name=None):
+    if name is not None:
+      caches[name] = self
+    self.max_bytes = max_bytes
+    self.sizeof = sizeof
+    self.size = 0
+    self.hits = self.misses = self.evictions = 0
+    self._items = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      try:
+        value = self._items[key]
+      except KeyError:
+        self.misses += 1
+        return default
+      self._items.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key, value):
+    """Returns False if `value` alone is bigger than the whole cache (not cached)"""
+    size = self.sizeof(value)
+    if size > self.max_bytes:
+      return False
+    with self._lock:
+      if key in self._items:
+        self.size -= self.sizeof(self._items.pop(key))
+      self._items[key] = value
+      self.size += size
+      while self.size > self.max_bytes:  # Evicting the least recently used
+        _, evicted = self._items.popitem(last=False)
+        self.size -= self.sizeof(evicted)
+        self.evictions += 1
+    return True
+
+  def clear(self):
+    with self._lock:
+      self._items.clear()
+      self.size = 0
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'entries': len(self._items),
+      'bytes': self.size,
+      'max_bytes': self.max_bytes,
+    }
@@ -0,0 +1,268 @@
+"""
+Per request instrumentation: wall time, DB queries count and time, and response
+bytes, aggregated by URL name. Sent back in the `Server-Timing` header, and
+exposed in the Prometheus text format by `metrics_view`.
+"""
+import time
+import bisect
+import asyncio
+import threading
+from contextvars import ContextVar
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from .db.pool import pools
+from .lru import caches
+
+# Upper bounds (seconds) of the requests duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class QueryTimer:
+  """`connection.execute_wrapper` counting the queries and their total time"""
+
+  def __init__(self):
+    self.count = 0
+    self.duration = 0.0
+
+  def __call__(self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.duration += time.perf_counter() - start
+      self.count += 1
+
+
+# Timer of the current request. A context variable, so queries run in other threads
+# by `sync_to_async` (with a copy of the request's context) are counted too
+_current_timer = ContextVar('request_query_timer', default=None)
+
+
+def _timed_execute(execute, sql, params, many, context):
+  timer = _current_timer.get()
+  if timer is None:
+    return execute(sql, params, many, context)
+  return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection, **kwargs):
+  """Permanently wraps the queries of `connection` (every thread has its own ones)"""
+  if _timed_execute not in connection.execute_wrappers:
+    connection.execute_wrappers.append(_timed_execute)
+
+
+connection_created.connect(install_query_timer)
+
+
+class ViewMetrics:
+
+  def __init__(self):
+    self.requests = {}  # By (method, status)
+    self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+    self.duration = 0.0
+    self.db_queries = 0
+    self.db_duration = 0.0
+    self.response_bytes = 0
+
+
+class RequestMetrics:
+  """Thread safe registry of the requests metrics, by URL name"""
+
+  def __init__(self):
+    self._views = {}
+    self._lock = threading.Lock()
+
+  def record(self, view, method, status, duration, db_queries, db_duration, response_bytes):
+    with self._lock:
+      metrics = self._views.get(view)
+      if metrics is None:
+        metrics = self._views[view] = ViewMetrics()
+      key = (method, status)
+      metrics.requests[key] = metrics.requests.get(key, 0) + 1
+      metrics.buckets[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+      metrics.duration += duration
+      metrics.db_queries += db_queries
+      metrics.db_duration += db_duration
+      metrics.response_bytes += response_bytes
+
+  def clear(self):
+    with self._lock:
+      self._views.clear()
+
+  def as_prometheus_text(self):
+    with self._lock:
+      views = sorted(self._views.items())
+      lines = [
+        '# HELP http_requests_total Requests by view, method and status.',
+        '# TYPE http_requests_total counter',
+      ]
+      for view, metrics in views:
+        for (method, status), count in sorted(metrics.requests.items()):
+          lines.append('http_requests_total{{view="{}",method="{}",status="{}"}} {}'.format(
+            view, method, status, count))
+
+      lines += [
+        '# HELP http_request_duration_seconds Requests wall time by view.',
+        '# TYPE http_request_duration_seconds histogram',
+      ]
+      for view, metrics in views:
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + ('+Inf',), metrics.buckets):
+          cumulative += count
+          lines.append('http_request_duration_seconds_bucket{{view="{}",le="{}"}} {}'.format(
+            view, bound, cumulative))
+        lines.append('http_request_duration_seconds_sum{{view="{}"}} {:.6f}'.format(
+          view, metrics.duration))
+        lines.append('http_request_duration_seconds_count{{view="{}"}} {}'.format(
+          view, cumulative))
+
+      for name, attr, kind, help_text in (
+          ('http_request_db_queries_total', 'db_queries', 'counter', 'DB queries by view.'),
+          ('http_request_db_duration_seconds_total', 'db_duration', 'counter',
+           'DB queries time by view.'),
+          ('http_response_bytes_total', 'response_bytes', 'counter', 'Response bytes by view.')):
+        lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, kind)]
+        for view, metrics in views:
+          value = getattr(metrics, attr)
+          lines.append('{}{{view="{}"}} {}'.format(
+            name, view, '{:.6f}'.format(value) if isinstance(value, float) else value))
+    return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+class RequestMetricsMiddleware:
+  """
+  Times every request and its DB queries (on every DB connection). Streaming
+  responses are measured until their content is fully sent, so their
+  `Server-Timing` header only has the time until the response started.
+  Works with both sync and async views, without adding a thread switch.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = asyncio.iscoroutinefunction(get_response)
+    if self.is_async:  # Marking the instance as a coroutine function, as MiddlewareMixin does
+      self._is_coroutine = asyncio.coroutines._is_coroutine
+    for connection in connections.all():  # Those connected before this module was loaded
+      install_query_timer(connection)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    timer, previous_timer = QueryTimer(), _current_timer.get()
+    _current_timer.set(timer)
+    start = time.perf_counter()
+    try:
+      response = self.get_response(request)
+    finally:
+      _current_timer.set(previous_timer)
+    return self._measure(request, response, timer, start)
+
+  async def __acall__(self, request):
+    timer, previous_timer = QueryTimer(), _current_timer.get()
+    _current_timer.set(timer)
+    start = time.perf_counter()
+    try:
+      response = await self.get_response(request)
+    finally:
+      _current_timer.set(previous_timer)
+    return self._measure(request, response, timer, start)
+
+  def _measure(self, request, response, timer, start):
+    duration = time.perf_counter() - start
+    response['Server-Timing'] = 'app;dur={:.2f}, db;dur={:.2f};desc="{} queries"'.format(
+      duration * 1000, timer.duration * 1000, timer.count)
+    view = getattr(request.resolver_match, 'url_name', None) or 'unresolved'
+    if response.streaming:
+      response.streaming_content = self._measured_stream(
+        response.streaming_content, timer, start, request.method, view, response.status_code)
+    else:
+      request_metrics.record(view, request.method, response.status_code, duration,
+                             timer.count, timer.duration, len(response.content))
+    return response
+
+  @staticmethod
+  def _measured_stream(content, timer, start, method, view, status):
+    response_bytes = 0
+    previous_timer = _current_timer.get()
+    _current_timer.set(timer)
+    try:
+      for chunk in content:
+        response_bytes += len(chunk)
+        yield chunk
+    finally:
+      _current_timer.set(previous_timer)
+      request_metrics.record(view, method, status, time.perf_counter() - start,
+                             timer.count, timer.duration, response_bytes)
+
+
+def pools_as_prometheus_text():
+  """Metrics of the DB connection pools of this process (see skill_test.db.pool)"""
+  stats = sorted((alias, pool.stats()) for alias, pool in pools.items())
+  if not stats:
+    return ''
+  lines = [
+    '# HELP db_pool_connections Pooled DB connections by state.',
+    '# TYPE db_pool_connections gauge',
+  ]
+  for alias, pool_stats in stats:
+    for state in ('in_use', 'idle'):
+      lines.append('db_pool_connections{{alias="{}",state="{}"}} {}'.format(
+        alias, state, pool_stats[state]))
+  lines += [
+    '# HELP db_pool_max_connections Pool size plus its overflow.',
+    '# TYPE db_pool_max_connections gauge',
+  ]
+  for alias, pool_stats in stats:
+    lines.append('db_pool_max_connections{{alias="{}"}} {}'.format(
+      alias, pool_stats['size'] + pool_stats['max_overflow']))
+  lines += [
+    '# HELP db_pool_events_total Connections created and closed, checkouts, waits and timeouts.',
+    '# TYPE db_pool_events_total counter',
+  ]
+  for alias, pool_stats in stats:
+    for event in ('created', 'closed', 'checkouts', 'waits', 'timeouts'):
+      lines.append('db_pool_events_total{{alias="{}",event="{}"}} {}'.format(
+        alias, event, pool_stats[event]))
+  return '\n'.join(lines) + '\n'
+
+
+def caches_as_prometheus_text():
+  """Metrics of the named in-process LRU caches (see skill_test.lru)"""
+  stats = sorted((name, cache.stats()) for name, cache in caches.items())
+  if not stats:
+    return ''
+  lines = [
+    '# HELP lru_cache_events_total Cache hits, misses and evictions.',
+    '# TYPE lru_cache_events_total counter',
+  ]
+  for name, cache_stats in stats:
+    for event in ('hits', 'misses', 'evictions'):
+      lines.append('lru_cache_events_total{{cache="{}",event="{}"}} {}'.format(
+        name, event, cache_stats[event]))
+  lines += [
+    '# HELP lru_cache_entries Entries in the cache.',
+    '# TYPE lru_cache_entries gauge',
+  ]
+  for name, cache_stats in stats:
+    lines.append('lru_cache_entries{{cache="{}"}} {}'.format(name, cache_stats['entries']))
+  lines += [
+    '# HELP lru_cache_bytes Size of the cached values, and the cache budget.',
+    '# TYPE lru_cache_bytes gauge',
+  ]
+  for name, cache_stats in stats:
+    for kind in ('bytes', 'max_bytes'):
+      lines.append('lru_cache_bytes{{cache="{}",kind="{}"}} {}'.format(
+        name, kind, cache_stats[kind]))
+  return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+  return HttpResponse(request_metrics.as_prometheus_text() + pools_as_prometheus_text() +
+                      caches_as_prometheus_text(),
+                      content_type='text/plain; version=0.0.4; charset=utf-8')
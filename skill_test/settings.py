@@ -52,6 +52,11 @@ MIDDLEWARE = [
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests timing and DB queries metrics (Server-Timing header and /metrics)
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', '1') == '1'
+if REQUEST_METRICS:
+    MIDDLEWARE.insert(0, 'skill_test.metrics.RequestMetricsMiddleware')
+
 ROOT_URLCONF = 'skill_test.urls'
 
 TEMPLATES = [
@@ -76,18 +81,50 @@ WSGI_APPLICATION = 'skill_test.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# In-process connections pool shared by the threads (see skill_test/db/mixins.py),
+# disabled with DB_POOL_SIZE=0. Without it, every thread keeps its own connection
+# for DB_CONN_MAX_AGE seconds. Either way, connections are checked before being
+# reused by a new request.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'skill_test.db.postgresql',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': 'db',
         'PORT': 5432,
+        # With the pool, connections go back to it at the end of every request
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'SIZE': DB_POOL_SIZE,
+            'MAX_OVERFLOW': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        } if DB_POOL_SIZE else None,
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {  # Shared by every worker process in the host, no external service needed
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_DIR', '/tmp/skill_test_cache'),
+    },
+}
+
+# Cache backend for user_birthday. Use 'default' (local memory) only with a single worker
+USER_BIRTHDAY_CACHE = os.environ.get('USER_BIRTHDAY_CACHE', 'shared')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,326 @@
+from django.test import TestCase, Client, override_settings
+from django.core.signals import request_started, request_finished
+from django.db import close_old_connections
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from unittest import mock
+import os
+import re
+import json
+import tempfile
+import asyncio
+import threading
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from user_birthday.models import User
+from user_birthday.synthetic import iter_synthetic_users
+from .metrics import request_metrics, RequestMetrics
+from .handlers import ASGIHandler
+from .metrics import pools_as_prometheus_text
+from .db import pool as db_pool
+from .db.pool import ConnectionPool, PoolTimeout
+from .db.mixins import PooledConnectionMixin, HealthCheckMixin
+from letter_digit.cache import response_cache
+from user_birthday.cache import range_response_cache
+
+
+@override_settings(MIDDLEWARE=['skill_test.metrics.RequestMetricsMiddleware'])
+class RequestMetricsTestCase(TestCase):
+  def setUp(self):
+    self.client = Client()
+    request_metrics.clear()
+
+  def get_metric(self, text, name, **labels):
+    pattern = r'^{}\{{{}\}} (\S+)$'.format(
+      re.escape(name), ','.join('{}="{}"'.format(key, re.escape(str(value)))
+                                for key, value in labels.items()))
+    match = re.search(pattern, text, re.MULTILINE)
+    return match and float(match.group(1))
+
+  def test_server_timing_header(self):
+    response = self.client.get('/api/v1/users/')
+    self.assertEqual(response.status_code, 200)
+    self.assertRegex(response['Server-Timing'],
+                     r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+
+  def test_metrics_by_url_name(self):
+    self.client.get('/api/v1/letter_digit/a1b')
+    self.client.get('/api/v1/letter_digit/a1b')
+    response = self.client.get('/api/v1/users/')
+    self.client.get('/api/v1/unknown')
+
+    response = self.client.get('/metrics')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+    text = response.content.decode()
+    self.assertEqual(self.get_metric(text, 'http_requests_total',
+                                     view='letter_digit', method='GET', status=200), 2)
+    self.assertEqual(self.get_metric(text, 'http_requests_total',
+                                     view='unresolved', method='GET', status=404), 1)
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_count',
+                                     view='letter_digit'), 2)
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_bucket',
+                                     view='letter_digit', le='+Inf'), 2)
+    self.assertEqual(self.get_metric(text, 'http_request_db_queries_total',
+                                     view='letter_digit'), 0)
+    self.assertGreater(self.get_metric(text, 'http_request_db_queries_total',
+                                       view='user_birthdays'), 0)
+    self.assertEqual(self.get_metric(text, 'http_response_bytes_total', view='letter_digit'),
+                     2 * len(b'["a1b", "a1B", "A1b", "A1B"]'))
+
+  def test_lru_caches(self):
+    response_cache.clear()
+    self.client.get('/api/v1/letter_digit/c3d')
+    self.client.get('/api/v1/letter_digit/C3D')
+    text = self.client.get('/metrics').content.decode()
+    self.assertEqual(self.get_metric(text, 'lru_cache_events_total',
+                                     cache='letter_digit_responses', event='hits'),
+                     response_cache.hits)
+    self.assertEqual(self.get_metric(text, 'lru_cache_entries',
+                                     cache='letter_digit_responses'), 1)
+    self.assertEqual(self.get_metric(text, 'lru_cache_bytes', cache='user_birthday_ranges',
+                                     kind='max_bytes'), range_response_cache.max_bytes)
+
+  def test_streamed_response_measured_when_sent(self):
+    response = self.client.get('/api/v1/users/?stream=true')
+    self.assertIsNone(request_metrics._views.get('user_birthdays'))
+    content = b''.join(response.streaming_content)
+
+    metrics = request_metrics._views['user_birthdays']
+    self.assertEqual(metrics.response_bytes, len(content))
+    self.assertGreater(metrics.db_queries, 0)
+
+  def test_duration_buckets(self):
+    metrics = RequestMetrics()
+    metrics.record('view', 'GET', 200, 0.003, 0, 0.0, 10)
+    metrics.record('view', 'GET', 200, 0.02, 1, 0.001, 10)
+    metrics.record('view', 'GET', 200, 60, 1, 0.001, 10)
+    text = metrics.as_prometheus_text()
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_bucket',
+                                     view='view', le='0.005'), 1)
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_bucket',
+                                     view='view', le='0.025'), 2)
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_bucket',
+                                     view='view', le='10'), 2)
+    self.assertEqual(self.get_metric(text, 'http_request_duration_seconds_bucket',
+                                     view='view', le='+Inf'), 3)
+    self.assertEqual(self.get_metric(text, 'http_request_db_queries_total', view='view'), 2)
+
+
+@override_settings(MIDDLEWARE=['skill_test.metrics.RequestMetricsMiddleware'])
+class ASGIHandlerTestCase(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    User.objects.bulk_create(User(birthday_mmdd=user['birthday'].month * 100 + user['birthday'].day,
+                                  **user) for user in iter_synthetic_users(300, seed=3))
+
+  def setUp(self):
+    request_metrics.clear()
+    # Closing the connection would end the test transaction (as Client does)
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    self.addCleanup(request_started.connect, close_old_connections)
+    self.addCleanup(request_finished.connect, close_old_connections)
+
+  async def asgi_get(self, path, query_string=b''):
+    messages = []
+
+    async def receive():
+      return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+      messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string,
+             'headers': [], 'root_path': ''}
+    await ASGIHandler()(scope, receive, send)
+    start, *body = messages
+    return start, b''.join(message.get('body', b'') for message in body)
+
+  async def test_streams_queryset_out_of_the_event_loop(self):
+    start, body = await self.asgi_get('/api/v1/users/', b'stream=true')
+    self.assertEqual(start['status'], 200)
+    self.assertIn(b'server-timing', {header.lower() for header, _ in start['headers']})
+    self.assertEqual(len(json.loads(body)), 300)
+
+    metrics = request_metrics._views['user_birthdays']
+    self.assertEqual(metrics.response_bytes, len(body))
+    self.assertGreater(metrics.db_queries, 0)  # Counted from the thread they ran in
+
+  async def test_serves_async_views(self):
+    start, body = await self.asgi_get('/api/v1/letter_digit/a1b')
+    self.assertEqual(start['status'], 200)
+    self.assertEqual(json.loads(body), ['a1b', 'a1B', 'A1b', 'A1B'])
+    start, body = await self.asgi_get('/api/v1/letter_digit/' + 'a1B2c3d4e5f6g7h8i9j0kLm')
+    self.assertEqual(len(json.loads(body)), 2 ** 13)
+    start, body = await self.asgi_get('/api/v1/users/avg_age')
+    self.assertEqual(start['status'], 200)
+
+  def test_thread_per_request(self):
+    """Thread sensitive work of concurrent requests isn't run by a single shared thread"""
+    threads, both_running = [], threading.Barrier(2, timeout=5)
+
+    def work():
+      threads.append(threading.get_ident())
+      both_running.wait()  # Would time out with a single thread for both
+      return HttpResponse()
+
+    async def get_response_async(request):
+      return await sync_to_async(work)()
+
+    async def requests():
+      handler = ASGIHandler()
+      handler.get_response_async = get_response_async
+      scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'',
+               'headers': [], 'root_path': ''}
+      receive = lambda: asyncio.sleep(0, {'type': 'http.request', 'body': b''})
+      send = lambda message: asyncio.sleep(0)
+      await asyncio.gather(handler(scope, receive, send), handler(scope, receive, send))
+
+    # From a thread without an event loop, as a server's (tests run the async ones in theirs)
+    runner = threading.Thread(target=asyncio.run, args=(requests(),))
+    runner.start()
+    runner.join()
+    self.assertEqual(len(set(threads)), 2)
+
+
+class FakeConnection:
+  """Stand-in for a DB-API connection"""
+  def __init__(self):
+    self.closed = False
+    self.rollbacks = 0
+
+  def rollback(self):
+    self.rollbacks += 1
+
+  def close(self):
+    self.closed = True
+
+
+class ConnectionPoolTestCase(TestCase):
+  def make_pool(self, **kwargs):
+    return ConnectionPool(FakeConnection, reset=lambda c: c.rollback(),
+                          check=lambda c: not c.closed, **kwargs)
+
+  def test_connections_are_reused(self):
+    pool = self.make_pool(size=2)
+    first = pool.acquire()
+    pool.release(first)
+    self.assertIs(pool.acquire(), first)
+    self.assertEqual(first.rollbacks, 1)
+    self.assertEqual(pool.stats()['created'], 1)
+    self.assertEqual(pool.stats()['checkouts'], 2)
+
+  def test_overflow_and_timeout(self):
+    pool = self.make_pool(size=1, max_overflow=1, timeout=0.01)
+    first, overflow = pool.acquire(), pool.acquire()
+    with self.assertRaises(PoolTimeout):
+      pool.acquire()
+    pool.release(overflow)
+    pool.release(first)
+    self.assertTrue(overflow.closed)  # Only `size` connections are kept
+    self.assertFalse(first.closed)
+    self.assertEqual(pool.stats(), {'size': 1, 'max_overflow': 1, 'in_use': 0, 'idle': 1,
+                                    'created': 2, 'closed': 1, 'checkouts': 2, 'waits': 1,
+                                    'timeouts': 1})
+
+  def test_waits_for_a_released_connection(self):
+    pool = self.make_pool(size=1, max_overflow=0, timeout=5)
+    first = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(first)
+    waiter.join()
+    self.assertEqual(acquired, [first])
+    self.assertEqual(pool.stats()['timeouts'], 0)
+
+  def test_broken_connections_are_discarded(self):
+    pool = self.make_pool(size=2)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    first.close()  # I.e closed by the server while idle
+    with mock.patch.object(second, 'rollback', side_effect=Exception('Connection lost')):
+      pool.release(second)
+    self.assertNotIn(pool.acquire(), (first, second))
+    self.assertEqual(pool.stats()['closed'], 2)
+
+  def test_prometheus_text(self):
+    pool = self.make_pool(size=3, max_overflow=2)
+    pool.acquire()
+    with mock.patch.dict(db_pool.pools, {'default': pool}, clear=True):
+      text = pools_as_prometheus_text()
+    self.assertIn('db_pool_connections{alias="default",state="in_use"} 1', text)
+    self.assertIn('db_pool_max_connections{alias="default"} 5', text)
+    self.assertIn('db_pool_events_total{alias="default",event="created"} 1', text)
+
+
+class PooledSQLiteDatabaseWrapper(PooledConnectionMixin, HealthCheckMixin,
+                                  SQLiteDatabaseWrapper):
+  """The same mixins as skill_test.db.postgresql, on a backend available in tests"""
+
+
+class PooledDatabaseWrapperTestCase(TestCase):
+  def setUp(self):
+    self.alias = 'pool_test'
+    db_file = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+    db_file.close()
+    self.addCleanup(os.remove, db_file.name)
+    self.settings_dict = dict(connection.settings_dict, NAME=db_file.name, OPTIONS={},
+                              CONN_HEALTH_CHECKS=True, POOL={'SIZE': 1, 'MAX_OVERFLOW': 0})
+    self.addCleanup(db_pool.pools.pop, self.alias, None)
+
+  def query(self, wrapper):
+    with wrapper.cursor() as cursor:
+      cursor.execute('SELECT 1')
+      return cursor.fetchone()[0]
+
+  def test_connections_shared_through_the_pool(self):
+    first = PooledSQLiteDatabaseWrapper(self.settings_dict, self.alias)
+    second = PooledSQLiteDatabaseWrapper(self.settings_dict, self.alias)  # Another thread's
+    self.assertEqual(self.query(first), 1)
+    raw_connection = first.connection
+    first.close()  # I.e at the end of a request
+    self.assertIsNone(first.connection)
+    self.assertEqual(self.query(second), 1)
+    self.assertIs(second.connection, raw_connection)
+    second.close()
+    stats = db_pool.pools[self.alias].stats()
+    self.assertEqual((stats['created'], stats['checkouts'], stats['idle']), (1, 2, 1))
+
+  def test_health_checks(self):
+    wrapper = PooledSQLiteDatabaseWrapper(dict(self.settings_dict, POOL=None, CONN_MAX_AGE=60),
+                                          self.alias)
+    self.query(wrapper)
+    raw_connection = wrapper.connection
+    with mock.patch.object(wrapper, 'is_usable', return_value=True) as is_usable:
+      self.query(wrapper)
+      is_usable.assert_not_called()  # Just connected
+      wrapper.close_if_unusable_or_obsolete()  # A new request
+      self.query(wrapper)
+      self.query(wrapper)
+      is_usable.assert_called_once()
+    self.assertIs(wrapper.connection, raw_connection)
+
+    with mock.patch.object(wrapper, 'is_usable', return_value=False):
+      wrapper.close_if_unusable_or_obsolete()
+      self.assertEqual(self.query(wrapper), 1)
+    self.assertIsNot(wrapper.connection, raw_connection)  # Reconnected
+    wrapper.close()
+
+  def test_borrowed_connections_are_checked(self):
+    wrapper = PooledSQLiteDatabaseWrapper(self.settings_dict, self.alias)
+    self.query(wrapper)
+    raw_connection = wrapper.connection
+    wrapper.close()  # Back to the pool
+    raw_connection.close()  # I.e dropped by the server while idle
+    with mock.patch.object(wrapper, 'is_usable', return_value=False) as is_usable:
+      self.assertEqual(self.query(wrapper), 1)
+      borrowed = wrapper.connection
+      self.assertEqual(self.query(wrapper), 1)
+      is_usable.assert_not_called()  # Already checked by the pool, not during the request
+    self.assertIsNot(borrowed, raw_connection)
+    self.assertIs(wrapper.connection, borrowed)
+    wrapper.close()
+    stats = db_pool.pools[self.alias].stats()
+    self.assertEqual((stats['created'], stats['closed'], stats['checkouts']), (2, 1, 2))
@@ -15,8 +15,10 @@ Including another URLconf
 """
 # from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 urlpatterns = [
     path('api/v1/letter_digit/', include('letter_digit.urls')),
-    path('api/v1/users/', include('user_birthday.urls'))
+    path('api/v1/users/', include('user_birthday.urls')),
+    path('metrics', metrics_view, name="metrics"),
 ]
@@ -1,47 +1,220 @@
 import json
-from .models import User
-from django.http import HttpResponse
+import datetime
+from .models import User, ImportJob, month_day_key
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import condition
 from .utils import parse_from_to_querystring, refine_query_for_users_in_birthday_range, \
-                   process_users_raw_incomming_data, get_date_from_long_date_str_format
+                   process_users_raw_incomming_data, get_date_from_long_date_str_format, \
+                   bulk_upsert_users, process_users_json_stream, \
+                   parse_pagination_querystring, get_users_page, iter_users_json, \
+                   get_users_in_birthday_range_json, get_upcoming_birthdays_json, \
+                   parse_upcoming_days_querystring, order_users_by_next_birthday, \
+                   parse_age_width_querystring, get_age_histogram, \
+                   parse_birthdays_count_by_querystring, get_birthdays_count
+from .serializers import users_json
+from .cache import get_users_etag, get_users_last_modified, get_request_users_version, \
+                   get_avg_age_etag, get_avg_age_last_modified, get_users_daily_etag, \
+                   get_users_daily_last_modified
+from .jobs import create_import_job, get_executor
+from .imports import import_formats, import_users
+from .exports import export_formats, parse_export_format_querystring, iter_users_export
+from .settings import stream_import_min_bytes, users_stream_chunk_size
 
 def user_birthdays(request):
   if request.method == 'GET':  # Point B
-    try:
-      # If we have from&to querystrings, process them
-      fdate, tdate = parse_from_to_querystring(
-                      request.GET.get('from'), request.GET.get('to'))
-    except ValueError as err:
-      return HttpResponse(json.dumps({'from&to': str(err)}), status=400)
-      
-    users = User.objects.all()  # By default, return all users
-    if fdate and tdate:  # Either both fdate and tdate are set, or none is
-      users = refine_query_for_users_in_birthday_range(users, fdate, tdate)
-    data = json.dumps([user.serialize_for_API() for user in users], 
-                      ensure_ascii=False)
+    return get_user_birthdays(request)
+  elif request.method == 'POST':  # Point A
+    return post_user_birthdays(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_users_etag, last_modified_func=get_users_last_modified)
+def get_user_birthdays(request):
+  try:
+    # If we have from&to querystrings, process them
+    fdate, tdate = parse_from_to_querystring(
+                    request.GET.get('from'), request.GET.get('to'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'from&to': str(err)}), status=400)
+    
+  try:
+    # If we have cursor/limit querystrings, return a single page
+    after, limit = parse_pagination_querystring(
+                    request.GET.get('cursor'), request.GET.get('limit'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'cursor&limit': str(err)}), status=400)
+
+  stream = request.GET.get('stream') in ('1', 'true')
+  if fdate and tdate and not limit and not stream:
+    # Dashboards poll the same ranges: served from prebuilt JSON until the users change
+    data = get_users_in_birthday_range_json(fdate, tdate, get_request_users_version(request))
     return HttpResponse(data, content_type='application/json', status=200)
 
-  elif request.method == 'POST':  # Point A
-    try:
+  users = User.objects.all()  # By default, return all users
+  if fdate and tdate:  # Either both fdate and tdate are set, or none is
+    users = refine_query_for_users_in_birthday_range(users, fdate, tdate)
+    if stream:  # Same order as the whole range response
+      users = order_users_by_next_birthday(users, month_day_key(fdate), month_day_key(tdate))
+  next_cursor = None
+  if limit:  # A single page
+    users_rows, next_cursor = get_users_page(users, after, limit)
+  elif stream:  # Read from the DB while it's written, at constant memory
+    users_rows = users.values_list(*User.api_fields).iterator(chunk_size=users_stream_chunk_size)
+
+  if stream:
+    response = StreamingHttpResponse(iter_users_json(users_rows),
+                                     content_type='application/json', status=200)
+  elif limit:
+    response = HttpResponse(users_json(users_rows), content_type='application/json', status=200)
+  else:
+    response = HttpResponse(users_json(users.values_list(*User.api_fields)),
+                            content_type='application/json', status=200)
+  if next_cursor:
+    querystring = request.GET.copy()
+    querystring['cursor'] = next_cursor
+    response['Link'] = '<{}?{}>; rel="next"'.format(request.path, querystring.urlencode())
+  return response
+
+
+def post_user_birthdays(request):
+  import_format = import_formats.get(request.content_type)  # Either CSV or NDJSON
+  if request.GET.get('async') in ('1', 'true'):
+    if import_format:
+      return HttpResponse(json.dumps({'async': 'Only JSON arrays are imported in background\n'}),
+                          status=400)
+    # Imported in the background: the payload is only written to disk
+    job = create_import_job(request)
+    response = HttpResponse(json.dumps({'job': str(job.pk)}), content_type='application/json',
+                            status=202)
+    response['Location'] = reverse('user_birthdays_import_job', args=[job.pk])
+    return response
+  try:
+    if import_format:
+      inserted, updated = import_users(request, import_format)
+    elif int(request.META.get('CONTENT_LENGTH') or 0) > stream_import_min_bytes:
+      # Big payload: validate and upsert while reading the request
+      inserted, updated = process_users_json_stream(request)
+    else:
       # Validate and process requet
       users_data = process_users_raw_incomming_data(request.body)
-    except ValueError as err:
-      return HttpResponse(json.dumps(str(err)), status=400)
-    # User's data seems valid (if any)
-    for user_data in users_data:
-      User.objects.update_or_create(email=user_data['email'],
-                                    defaults=user_data)
-    msg = '{} users upserted in DB\n'.format(len(users_data))
-    return HttpResponse(msg, content_type='application/json', status=200)
-  return HttpResponse(status=405)  # Method not allowed
+      # User's data seems valid (if any)
+      inserted, updated = bulk_upsert_users(users_data)
+  except ValueError as err:
+    return HttpResponse(json.dumps(str(err)), status=400)
+  msg = '{} users upserted in DB ({} inserted, {} updated)\n'.format(
+    inserted + updated, inserted, updated)
+  return HttpResponse(msg, content_type='application/json', status=200)
 
 
 def user_birthdays_avg_age(request):
   if request.method == 'GET':  # Point C
-    when_str = request.GET.get('when')
-    try:
-      when = get_date_from_long_date_str_format(when_str) if when_str else None
-      avg = User.objects.get_avg_age(when)
-    except ValueError as err:
-      return HttpResponse(json.dumps({'when': str(err)}), status=400)
-    return HttpResponse(json.dumps(avg), content_type='application/json', status=200)
-  return HttpResponse(status=405)  # Method not allowed
\ No newline at end of file
+    return get_user_birthdays_avg_age(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_avg_age_etag, last_modified_func=get_avg_age_last_modified)
+def get_user_birthdays_avg_age(request):
+  when_str = request.GET.get('when')
+  try:
+    when = get_date_from_long_date_str_format(when_str) if when_str else None
+    avg = User.objects.get_avg_age(when)
+  except ValueError as err:
+    return HttpResponse(json.dumps({'when': str(err)}), status=400)
+  return HttpResponse(json.dumps(avg), content_type='application/json', status=200)
+
+
+def user_birthdays_upcoming(request):
+  if request.method == 'GET':
+    return get_user_birthdays_upcoming(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_users_daily_etag, last_modified_func=get_users_daily_last_modified)
+def get_user_birthdays_upcoming(request):
+  try:
+    days = parse_upcoming_days_querystring(request.GET.get('days'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'days': str(err)}), status=400)
+  data = get_upcoming_birthdays_json(datetime.date.today(), days,
+                                     get_request_users_version(request))
+  return HttpResponse(data, content_type='application/json', status=200)
+
+
+def user_birthdays_age_histogram(request):
+  if request.method == 'GET':
+    return get_user_birthdays_age_histogram(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_avg_age_etag, last_modified_func=get_avg_age_last_modified)
+def get_user_birthdays_age_histogram(request):
+  when_str = request.GET.get('when')
+  try:
+    when = get_date_from_long_date_str_format(when_str) if when_str else datetime.date.today()
+  except ValueError as err:
+    return HttpResponse(json.dumps({'when': str(err)}), status=400)
+  try:
+    width = parse_age_width_querystring(request.GET.get('width'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'width': str(err)}), status=400)
+  histogram = get_age_histogram(when, width, get_request_users_version(request))
+  return HttpResponse(json.dumps(histogram), content_type='application/json', status=200)
+
+
+def user_birthdays_count(request):
+  if request.method == 'GET':
+    return get_user_birthdays_count(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_users_etag, last_modified_func=get_users_last_modified)
+def get_user_birthdays_count(request):
+  try:
+    by = parse_birthdays_count_by_querystring(request.GET.get('by'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'by': str(err)}), status=400)
+  counts = get_birthdays_count(by, get_request_users_version(request))
+  return HttpResponse(json.dumps(counts), content_type='application/json', status=200)
+
+
+def user_birthdays_import_job(request, job_id):
+  if request.method == 'GET':
+    return get_user_birthdays_import_job(request, job_id)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+def get_user_birthdays_import_job(request, job_id):
+  get_executor()  # Resuming the jobs of a stopped process, if this one didn't yet
+  job = ImportJob.objects.filter(pk=job_id).first()
+  if job is None:
+    return HttpResponse(status=404)
+  return HttpResponse(json.dumps(job.serialize_for_API()), content_type='application/json',
+                      status=200)
+
+
+def user_birthdays_export(request):
+  if request.method == 'GET':
+    return get_user_birthdays_export(request)
+  return HttpResponse(status=405)  # Method not allowed
+
+
+@condition(etag_func=get_users_etag, last_modified_func=get_users_last_modified)
+def get_user_birthdays_export(request):
+  try:
+    fdate, tdate = parse_from_to_querystring(request.GET.get('from'), request.GET.get('to'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'from&to': str(err)}), status=400)
+  try:
+    export_format = parse_export_format_querystring(request.GET.get('format'))
+  except ValueError as err:
+    return HttpResponse(json.dumps({'format': str(err)}), status=400)
+
+  users = User.objects.all()
+  if fdate and tdate:
+    users = refine_query_for_users_in_birthday_range(users, fdate, tdate)
+  # Written while it's read from the DB, at constant memory
+  response = StreamingHttpResponse(iter_users_export(users, export_format),
+                                   content_type=export_formats[export_format], status=200)
+  response['Content-Disposition'] = 'attachment; filename="users.{}"'.format(export_format)
+  return response
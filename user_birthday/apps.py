@@ -3,5 +3,6 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
   name = 'user_birthday'
+  default_auto_field = 'django.db.models.AutoField'
   def ready(self):
       from .signals import invalidate_avg_age_cache_on_model_change
\ No newline at end of file
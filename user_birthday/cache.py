@@ -0,0 +1,122 @@
+import os
+import time
+import fcntl
+import datetime
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import transaction
+from skill_test.lru import SizedLRUCache
+from .settings import range_response_cache_max_bytes
+
+users_version_key = 'user_birthday:users_version'
+users_version_lock_key = 'user_birthday:users_version_lock'
+_users_version_thread_lock = threading.Lock()
+
+# Serialized GET responses of birthday ranges, by (from, to, users version).
+# In-process: a few dashboards poll the same ranges, each worker keeps them warm
+range_response_cache = SizedLRUCache(range_response_cache_max_bytes, sizeof=len,
+                                     name='user_birthday_ranges')
+
+
+def get_cache():
+  """Cache backend shared by every worker (see settings.USER_BIRTHDAY_CACHE)"""
+  return caches[settings.USER_BIRTHDAY_CACHE]
+
+def get_users_version():
+  """
+  Version of the users table, to be part of the key of anything cached from it.
+  Starting from the current time in microseconds, so a version is never reused,
+  even if the key gets evicted from the cache.
+  """
+  cache = get_cache()
+  version = cache.get(users_version_key)
+  if version is None:
+    with _users_version_lock():
+      version = cache.get(users_version_key)  # Another worker could have set it
+      if version is None:
+        version = _set_next_users_version(None)
+  return version
+
+def bump_users_version():
+  """Invalidates everything cached from the users table, in every worker"""
+  with _users_version_lock():
+    return _set_next_users_version(get_cache().get(users_version_key))
+
+def _set_next_users_version(version):
+  version = int(time.time() * 1000000) if version is None \
+            else max(version + 1, int(time.time() * 1000000))
+  get_cache().set(users_version_key, version, timeout=None)
+  return version
+
+@contextmanager
+def _users_version_lock():
+  """
+  Serializes the read and write of the version, across workers: otherwise two bumps
+  could write it backwards (and so Last-Modified). The file based backend has no
+  atomic operation (not even `add`), so its directory gets a lock file
+  """
+  cache = get_cache()
+  with _users_version_thread_lock:
+    if isinstance(cache, FileBasedCache):
+      os.makedirs(cache._dir, exist_ok=True)
+      with open(os.path.join(cache._dir, 'users_version.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when closed
+        yield
+    else:
+      while not cache.add(users_version_lock_key, True, timeout=10):  # Expires if abandoned
+        time.sleep(0.001)
+      try:
+        yield
+      finally:
+        cache.delete(users_version_lock_key)
+
+def invalidate_users_cache():
+  """
+  Bumps the version now, and again once the running transaction is committed:
+  otherwise another worker could cache data read before the commit with the new version.
+  """
+  bump_users_version()
+  transaction.on_commit(bump_users_version)
+
+
+def get_request_users_version(request):
+  """The users version, read once per request (for both the ETag and Last-Modified)"""
+  try:
+    return request._users_version
+  except AttributeError:
+    request._users_version = get_users_version()
+    return request._users_version
+
+def get_users_etag(request, *args, **kwargs):
+  """
+  ETag of anything read from the users table, for the `condition` decorator: the
+  same version means the same response (ETags are compared for the same URL only)
+  """
+  return '"{}"'.format(get_request_users_version(request))
+
+def get_users_last_modified(request, *args, **kwargs):
+  """The version is the time of the last change (or a bit later), in microseconds"""
+  return datetime.datetime.fromtimestamp(get_request_users_version(request) / 1000000,
+                                         tz=datetime.timezone.utc)
+
+def get_users_daily_etag(request, *args, **kwargs):
+  """ETag of the responses that also change with the date of today"""
+  return '"{}-{}"'.format(get_request_users_version(request), datetime.date.today().toordinal())
+
+def get_users_daily_last_modified(request, *args, **kwargs):
+  today = datetime.datetime.combine(datetime.date.today(), datetime.time()).astimezone()
+  return max(get_users_last_modified(request), today)
+
+def get_avg_age_etag(request, *args, **kwargs):
+  """Without `when`, the average age also changes with the date of today"""
+  if request.GET.get('when'):
+    return get_users_etag(request)
+  return get_users_daily_etag(request)
+
+def get_avg_age_last_modified(request, *args, **kwargs):
+  if request.GET.get('when'):
+    return get_users_last_modified(request)
+  return get_users_daily_last_modified(request)
@@ -0,0 +1,114 @@
+"""
+Users exports: GET /api/v1/users/export streams every user (or the ones with birthday
+in a `from`/`to` range) as CSV, with a header row, or NDJSON (a JSON object per line,
+as GET /api/v1/users/ writes them), sorted by email, at constant memory.
+On PostgreSQL every chunk of rows is written by the DB itself, with a
+`COPY (SELECT ...) TO STDOUT` over a range of emails; other backends (or a
+DATE_FORMAT that `to_char` can't write) serialize the rows of a server side cursor.
+"""
+import io
+import re
+import csv
+import json
+from itertools import islice
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from .models import User
+from .serializers import users_json_fragments
+from .settings import users_stream_chunk_size
+
+# Formats, and their content type
+export_formats = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# strftime directives written the same by to_char. Without FM, to_char pads years
+# before 1000 with zeros, strftime (glibc) doesn't
+_to_char_directives = {'%d': 'DD', '%m': 'MM', '%Y': 'FMYYYY', '%y': 'YY', '%j': 'DDD',
+                       '%%': '"%"'}
+
+
+def parse_export_format_querystring(export_format):
+  """The export format, NDJSON by default, or ValueError with the description"""
+  if not export_format:
+    return 'ndjson'
+  if export_format not in export_formats:
+    raise ValueError('Expected one of: {}\n'.format(', '.join(export_formats)))
+  return export_format
+
+
+def iter_users_export(users_query, export_format, chunk_size=users_stream_chunk_size):
+  """Yields the users of `users_query` in `export_format`, as utf-8 bytes"""
+  if export_format == 'csv':
+    yield (','.join(User.api_fields) + '\n').encode('utf-8')
+  date_format = _to_char_format(settings.DATE_FORMAT)
+  if connection.vendor == 'postgresql' and date_format is not None:
+    yield from _iter_copy_export(users_query, export_format, date_format, chunk_size)
+  else:
+    yield from _iter_rows_export(users_query, export_format, chunk_size)
+
+
+def _to_char_format(date_format):
+  """The `to_char` format writing dates as `strftime(date_format)`, or None"""
+  parts = []
+  for directive, literal in re.findall(r'(%.?)|([^%]+)', date_format, re.S):
+    if directive:
+      if directive not in _to_char_directives:
+        return None
+      parts.append(_to_char_directives[directive])
+    else:  # Quoted, or its letters could be read as patterns
+      parts.append('"{}"'.format(literal.replace('\\', '\\\\').replace('"', '\\"')))
+  return ''.join(parts)
+
+
+def _iter_rows_export(users_query, export_format, chunk_size):
+  rows = users_query.order_by('email').values_list(*User.api_fields) \
+                    .iterator(chunk_size=chunk_size)
+  date_format = settings.DATE_FORMAT
+  for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+    if export_format == 'csv':
+      output = io.StringIO()
+      csv.writer(output, lineterminator='\n').writerows(
+        (first_name, last_name, email, birthday.strftime(date_format))
+        for first_name, last_name, email, birthday in chunk)
+      yield output.getvalue().encode('utf-8')
+    else:
+      yield b'\n'.join(users_json_fragments(chunk)) + b'\n'
+
+
+def _iter_copy_export(users_query, export_format, date_format, chunk_size):
+  users_query = users_query.order_by('email')
+  qn = connection.ops.quote_name
+  values = {name: 'users.{}'.format(qn(name)) for name in User.api_fields}
+  values['birthday'] = 'to_char(users.{}, %s)'.format(qn('birthday'))
+  if export_format == 'csv':
+    select = ', '.join(values[name] for name in User.api_fields)
+    options = 'FORMAT csv'
+  else:  # As the serializers' template: the keys, then the values encoded by to_json
+    select = " || ', ' || ".join("'{}: ' || to_json({})::text".format(json.dumps(name),
+                                                                     values[name])
+                                 for name in User.api_fields)
+    select = "'{' || " + select + " || '}'"
+    # Lines written as they are: quote and delimiter characters a JSON line can't have
+    options = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+  params = [date_format]  # The birthday's
+  after = None
+  while True:
+    # A chunk is the range of emails up to the `chunk_size`th one (both are indexed)
+    remaining = users_query if after is None else users_query.filter(email__gt=after)
+    last = list(remaining.values_list('email', flat=True)[chunk_size - 1:chunk_size])
+    chunk_query = remaining.filter(email__lte=last[0]) if last else remaining
+    try:
+      sql, sql_params = chunk_query.values_list(*User.api_fields).query.sql_with_params()
+    except EmptyResultSet:  # I.e a query that can't match (`none()`, `__in=[]`)
+      return
+    output = io.BytesIO()
+    with connection.cursor() as cursor:
+      copy_sql = cursor.mogrify(
+        'COPY (SELECT {} FROM ({}) AS users ORDER BY users.{}) TO STDOUT WITH ({})'.format(
+          select, sql, qn('email'), options), params + list(sql_params)).decode('utf-8')
+      cursor.copy_expert(copy_sql, output)
+    yield output.getvalue()
+    if not last:
+      return
+    after = last[0]
@@ -0,0 +1,248 @@
+"""
+CSV and NDJSON imports of users: a POST to /api/v1/users/ with a `text/csv` (with a
+header row naming the fields) or `application/x-ndjson` (a JSON object per line)
+content type. Same users written, and same errors, as with a JSON array.
+On PostgreSQL the rows are streamed with `COPY ... FROM STDIN` into a temporary
+staging table, checked there with SQL, and merged with a single INSERT ... ON CONFLICT.
+The SQL checks only vouch for plainly valid rows (i.e ASCII emails): the others are
+validated in Python, in order, as the JSON path does. Other backends validate and
+upsert the rows one by one.
+"""
+import csv
+import json
+from django.conf import settings
+from django.db import connection, transaction, DataError
+from .models import User, UserForm
+from . import settings as user_birthday_settings
+from .utils import bulk_upsert_users, validate_user_row, lock_user_age_aggregate, \
+                   update_user_age_aggregate, invalidate_avg_age_cache
+from .validators import RowFormatError
+
+# Content types, and the name of their format
+import_formats = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+
+def import_users(stream, import_format):
+  """
+  Validates and upserts the users in `stream` (i.e the request), read as `import_format`.
+  Returns an (inserted, updated) tuple of counts, or raises ValueError with the
+  description (nothing is written in that case).
+  """
+  if connection.vendor == 'postgresql':
+    return _copy_import_users(stream, import_format)
+  return _rowwise_import_users(stream, import_format)
+
+
+def read_csv_header(stream, import_format='csv'):
+  """The column names in the first line of `stream`, which must include every field"""
+  try:
+    header = next(csv.reader([stream.readline().decode('utf-8')]), [])
+  except (csv.Error, UnicodeDecodeError):
+    header = []
+  if not set(User.api_fields).issubset(header):
+    raise ValueError('Invalid {} format.\n'.format(import_format))
+  return header
+
+
+def iter_csv_rows(stream, header):
+  """
+  Dicts of the rows of a CSV `stream` (after its header), by column name (the last
+  column of a repeated name wins, as in csv.DictReader). Rows without exactly a value
+  per column, blank lines included, raise RowFormatError: COPY rejects them too.
+  """
+  rows = csv.reader(line.decode('utf-8') for line in stream)
+  for line, row in enumerate(rows, 2):
+    if len(row) != len(header):
+      raise RowFormatError(line)
+    yield dict(zip(header, row))
+
+
+def iter_ndjson_rows(stream):
+  """The JSON values of the non blank lines of `stream`"""
+  for line in stream:
+    if line.strip():
+      yield json.loads(line)
+
+
+def _rowwise_import_users(stream, import_format):
+  if import_format == 'csv':
+    rows = iter_csv_rows(stream, read_csv_header(stream))
+  else:
+    rows = iter_ndjson_rows(stream)
+
+  def iter_cleaned_users():
+    error_msg = ''
+    try:
+      for row in rows:
+        try:
+          yield validate_user_row(row)
+        except RowFormatError:
+          raise
+        except ValueError as err:  # As the JSON path, the last one is reported
+          error_msg = str(err)
+    except (RowFormatError, csv.Error, UnicodeDecodeError, json.JSONDecodeError):
+      raise ValueError('Invalid {} format.\n'.format(import_format))
+    if error_msg:
+      raise ValueError(error_msg)
+  # Raising from inside the upsert's transaction rolls back the written chunks
+  return bulk_upsert_users(iter_cleaned_users())
+
+
+# What Python's str.strip() removes (the forms strip names and emails), all in the BMP
+_whitespace = ''.join('\\u{:04x}'.format(code) for code in range(0x10000)
+                      if chr(code).isspace())
+# Rows matching these are valid for validate_user_row too: names without surrounding
+# whitespace, a subset of EmailValidator's emails, and dd.mm.yyyy birthdays
+_name_regex = '^[^{0}](.*[^{0}])?$'.format(_whitespace)
+_email_regex = r"^[-!#$%&'*+/=?^_`{}|~0-9A-Za-z]+(\.[-!#$%&'*+/=?^_`{}|~0-9A-Za-z]+)*" \
+               r"@([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}$"
+_birthday_regex = r'^(0?[1-9]|[12][0-9]|3[01])\.(0?[1-9]|1[012])\.[0-9]{4}$'
+_birthday_parts = "split_part(birthday, '.', 3)::int, split_part(birthday, '.', 2)::int, " \
+                  "split_part(birthday, '.', 1)::int"
+
+_plainly_valid_sql = '''
+  format_ok
+  AND first_name ~ %(name_regex)s AND char_length(first_name) <= %(first_name_max_length)s
+  AND last_name ~ %(name_regex)s AND char_length(last_name) <= %(last_name_max_length)s
+  AND email ~ %(email_regex)s AND char_length(email) <= %(email_max_length)s
+  AND %(fast_dates)s AND CASE  -- In order, so only dd.mm.yyyy values are cast
+    WHEN birthday !~ %(birthday_regex)s THEN false
+    WHEN split_part(birthday, '.', 3)::int = 0 THEN false
+    ELSE split_part(birthday, '.', 1)::int <= extract(day from make_date(
+      split_part(birthday, '.', 3)::int, split_part(birthday, '.', 2)::int, 1) +
+      interval '1 month - 1 day')
+    END
+'''
+
+
+def _copy_import_users(stream, import_format):
+  params = {
+    'name_regex': _name_regex,
+    'email_regex': _email_regex,
+    'birthday_regex': _birthday_regex,
+    'fast_dates': settings.DATE_FORMAT == '%d.%m.%Y',
+  }
+  for name in ('first_name', 'last_name', 'email'):  # As checked by validate_user_row
+    params[name + '_max_length'] = UserForm.base_fields[name].max_length
+  with transaction.atomic(), connection.cursor() as cursor:
+    cursor.execute(
+      'CREATE TEMPORARY TABLE user_import (line bigserial PRIMARY KEY, '
+      'format_ok boolean NOT NULL DEFAULT true, first_name text, last_name text, email text, '
+      'birthday text, birthday_date date) ON COMMIT DROP')
+    try:
+      if import_format == 'csv':
+        _copy_csv(cursor, stream)
+      else:
+        _copy_ndjson(cursor, stream)
+    except (DataError, connection.Database.DataError):
+      raise ValueError('Invalid {} format.\n'.format(import_format))
+
+    # The rows SQL can't vouch for, validated as the JSON path does: a bad formatted
+    # row fails right away, otherwise the last invalid one is reported
+    cursor.execute('SELECT line, format_ok, first_name, last_name, email, birthday '
+                   'FROM user_import WHERE NOT ({}) ORDER BY line'.format(_plainly_valid_sql),
+                   params)
+    birthdays, error_msg = [], ''
+    for line, format_ok, *values in cursor.fetchall():
+      try:
+        if not format_ok:
+          raise RowFormatError(line)
+        birthdays.append((validate_user_row(dict(zip(User.api_fields, values)))['birthday'],
+                          line))
+      except RowFormatError:
+        raise ValueError('Invalid {} format.\n'.format(import_format))
+      except ValueError as err:
+        error_msg = str(err)
+    if error_msg:
+      raise ValueError(error_msg)
+    cursor.executemany('UPDATE user_import SET birthday_date = %s WHERE line = %s', birthdays)
+    return _merge_staged_users(cursor)
+
+
+def _copy_csv(cursor, stream):
+  header = read_csv_header(stream)
+  # By position, as names come from the client. Only the last column of a field is
+  # kept, as in csv.DictReader
+  last = {name: position for position, name in enumerate(header)}
+  columns = [name if name in User.api_fields and last[name] == position
+             else 'extra_{}'.format(position)
+             for position, name in enumerate(header)]
+  extra = [column for column in columns if column.startswith('extra_')]
+  if extra:
+    cursor.execute('ALTER TABLE user_import {}'.format(
+      ', '.join('ADD COLUMN {} text'.format(column) for column in extra)))
+  cursor.copy_expert(
+    'COPY user_import ({0}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({0}))'.format(
+      ', '.join(columns)), stream)
+
+
+def _copy_ndjson(cursor, stream):
+  cursor.execute('CREATE TEMPORARY TABLE user_import_lines (line bigserial, doc text) '
+                 'ON COMMIT DROP')
+  # Every line as a single value, i.e with quote and delimiter characters that can't be
+  # in a JSON line (unescaped control characters)
+  cursor.copy_expert("COPY user_import_lines (doc) FROM STDIN "
+                     "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')", stream)
+  fields = [(name, "doc ->> '{}'".format(name)) for name in User.api_fields]
+  format_ok = "COALESCE(jsonb_typeof(doc) = 'object' AND {}, false)".format(' AND '.join(
+    "jsonb_typeof(doc -> '{}') = 'string'".format(name) for name in User.api_fields))
+  cursor.execute(
+    'INSERT INTO user_import (line, format_ok, {columns}) '
+    'SELECT line, {format_ok}, {values} '
+    'FROM (SELECT line, doc::jsonb AS doc FROM user_import_lines '
+    "      WHERE btrim(doc, %s) <> '') AS parsed".format(
+      columns=', '.join(name for name, _ in fields), format_ok=format_ok,
+      values=', '.join('CASE WHEN {} THEN {} END'.format(format_ok, value)
+                       for _, value in fields)),
+    [' \t\r\x0b\x0c'])
+
+
+def _merge_staged_users(cursor):
+  """Upserts the staged rows with a single statement, returns (inserted, updated)"""
+  qn = connection.ops.quote_name
+  cursor.execute(
+    'CREATE TEMPORARY TABLE user_import_merged ON COMMIT DROP AS '
+    'SELECT DISTINCT ON (email) first_name, last_name, email, birthday_date AS birthday '
+    'FROM (SELECT line, first_name, last_name, email, '
+    '             COALESCE(birthday_date, make_date({})) AS birthday_date '
+    '      FROM user_import) AS staged '
+    'ORDER BY email, line DESC'.format(_birthday_parts))  # Same email twice: last one wins
+  cursor.execute('SELECT count(*) FROM user_import')
+  (rows,) = cursor.fetchone()
+
+  table = qn(User._meta.db_table)
+  if user_birthday_settings.use_running_age_aggregate:
+    lock_user_age_aggregate()  # Before reading the old birthdays
+    cursor.execute(
+      "SELECT count(*) - count(users.{email}), "
+      "       COALESCE(sum(merged.birthday - DATE '0001-01-01'), 0) - "
+      "       COALESCE(sum(users.{birthday} - DATE '0001-01-01'), 0) "
+      "FROM user_import_merged AS merged "
+      "LEFT JOIN {table} AS users ON users.{email} = merged.email".format(
+        email=qn('email'), birthday=qn('birthday'), table=table))
+    count_delta, birthdays_delta = cursor.fetchone()
+    # Ordinals are one more than the days since 0001-01-01, the count delta adds those
+    birthdays_delta += count_delta
+
+  columns = [field.column for field in User._meta.concrete_fields]
+  values = {name: 'merged.{}'.format(name) for name in User.api_fields}
+  values['birthday_mmdd'] = 'CAST(EXTRACT(MONTH FROM merged.birthday) * 100 + ' \
+                            'EXTRACT(DAY FROM merged.birthday) AS smallint)'
+  cursor.execute(
+    'WITH upserted AS ('
+    '  INSERT INTO {table} ({columns}) SELECT {values} FROM user_import_merged AS merged '
+    '  ON CONFLICT ({pk}) DO UPDATE SET {updates} '
+    '  RETURNING (xmax = 0) AS inserted'  # xmax is 0 only for fresh inserts
+    ') SELECT count(*) FILTER (WHERE inserted) FROM upserted'.format(
+      table=table, columns=', '.join(qn(column) for column in columns),
+      values=', '.join(values[column] for column in columns),
+      pk=qn(User._meta.pk.column),
+      updates=', '.join('{0} = EXCLUDED.{0}'.format(qn(column))
+                        for column in columns if column != User._meta.pk.column)))
+  (inserted,) = cursor.fetchone()
+
+  if user_birthday_settings.use_running_age_aggregate:
+    update_user_age_aggregate(count_delta, birthdays_delta)
+  # Bulk queries don't send pre_save signals, so invalidate once per import
+  invalidate_avg_age_cache()
+  return inserted, rows - inserted
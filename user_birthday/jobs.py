@@ -0,0 +1,153 @@
+"""
+Background users imports, without a broker: a POST with `?async=true` spools its
+payload to `import_jobs_dir` and saves an ImportJob, then a pool of threads of the
+same process validates and upserts it in chunks. Every chunk is committed along with
+the job's progress, so nothing is upserted twice when a job is resumed.
+Jobs left behind by a stopped process (pending, or running without progress for
+`import_job_stale_seconds`) are resumed by the next process using the pool, or by
+the `run_import_jobs` command, in any host seeing their payload (`import_jobs_dir`
+is meant to be persistent, and shared by the web services).
+"""
+import os
+import json
+import uuid
+import datetime
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections, transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import ImportJob
+from .settings import upsert_chunk_size, stream_import_read_size, import_jobs_dir, \
+                      import_job_workers, import_job_stale_seconds, import_job_max_errors
+from .utils import iter_json_array_items, validate_user_row, bulk_upsert_users
+from .validators import RowFormatError
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+  """The import jobs threads of this process (None without `import_job_workers`)"""
+  global _executor
+  if _executor is None and import_job_workers:
+    with _executor_lock:
+      if _executor is None:
+        _executor = ThreadPoolExecutor(import_job_workers, thread_name_prefix='import-job')
+        _executor.submit(_in_thread, resume_import_jobs)  # Left behind by other processes
+  return _executor
+
+
+def _in_thread(func, *args):
+  try:
+    return func(*args)
+  finally:
+    connections.close_all()  # The ones opened by this thread
+
+
+def create_import_job(stream, read_size=stream_import_read_size):
+  """Spools `stream` (i.e the request) to a file, and queues the job importing it"""
+  os.makedirs(import_jobs_dir, exist_ok=True)
+  job_id = uuid.uuid4()
+  path = os.path.join(import_jobs_dir, '{}.json'.format(job_id))
+  size = 0
+  try:
+    with open(path, 'wb') as spool:
+      for data in iter(lambda: stream.read(read_size), b''):
+        spool.write(data)
+        size += len(data)
+    job = ImportJob.objects.create(id=job_id, path=path, size=size)
+  except BaseException:
+    try:
+      os.remove(path)
+    except OSError:  # I.e it couldn't be created
+      pass
+    raise
+  transaction.on_commit(lambda: submit_import_job(job_id))
+  return job
+
+
+def submit_import_job(job_id):
+  executor = get_executor()
+  if executor is not None:
+    executor.submit(_in_thread, run_import_job, job_id)
+
+
+def resume_import_jobs():
+  """
+  Runs the pending jobs, and the ones abandoned while running, one at a time. Only
+  the ones with their payload in reach: left for other hosts otherwise.
+  """
+  for job_id, path in ImportJob.objects.filter(_resumable_jobs()).order_by('created_at') \
+                                       .values_list('pk', 'path'):
+    if os.path.exists(path):
+      run_import_job(job_id)
+
+
+def _resumable_jobs():
+  stale = timezone.now() - datetime.timedelta(seconds=import_job_stale_seconds)
+  return Q(status=ImportJob.PENDING) | Q(status=ImportJob.RUNNING, heartbeat_at__lt=stale)
+
+
+def claim_import_job(job_id):
+  """Marks the job as running in this thread, unless another worker has it"""
+  now = timezone.now()
+  return ImportJob.objects.filter(_resumable_jobs(), pk=job_id).update(
+    status=ImportJob.RUNNING, heartbeat_at=now,
+    started_at=Coalesce(F('started_at'), Value(now, output_field=DateTimeField()))) == 1
+
+
+def run_import_job(job_id, chunk_size=upsert_chunk_size):
+  """
+  Imports the job's rows, after the ones done by a previous run. Invalid rows are
+  counted and skipped, while a malformed payload fails the whole job (keeping the
+  chunks already upserted). On other errors (i.e the DB) the job is left running, to
+  be resumed once it gets stale. Returns False when the job can't be claimed.
+  """
+  if not claim_import_job(job_id):
+    return False
+  job = ImportJob.objects.get(pk=job_id)
+  try:
+    with open(job.path, 'rb') as spool:
+      done = job.rows_done + job.rows_failed
+      rows = islice(enumerate(iter_json_array_items(spool)), done, None)
+      for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+        _import_chunk(job, chunk)
+  except ValueError:  # JSONDecodeError and UnicodeDecodeError included
+    _finish_import_job(job, ImportJob.FAILED, 'Invalid json format.')
+  except OSError as err:  # I.e the payload was removed
+    _finish_import_job(job, ImportJob.FAILED, str(err))
+  else:
+    _finish_import_job(job, ImportJob.DONE)
+  return True
+
+
+def _import_chunk(job, chunk):
+  users_data, errors = [], []
+  for index, row in chunk:
+    try:
+      users_data.append(validate_user_row(row))
+    except RowFormatError:
+      errors.append({'row': index, 'error': 'Invalid json format.'})
+    except ValueError as err:  # The form errors, as json
+      errors.append({'row': index, 'error': json.loads(str(err))})
+  with transaction.atomic():
+    if users_data:
+      bulk_upsert_users(users_data)
+    job.rows_done += len(users_data)
+    job.rows_failed += len(errors)
+    job.errors = (job.errors + errors)[:import_job_max_errors]
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=['rows_done', 'rows_failed', 'errors', 'heartbeat_at'])
+
+
+def _finish_import_job(job, status, error=''):
+  job.status, job.error = status, error
+  job.finished_at = job.heartbeat_at = timezone.now()
+  job.save(update_fields=['status', 'error', 'finished_at', 'heartbeat_at'])
+  try:
+    os.remove(job.path)
+  except OSError:
+    pass
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from user_birthday.synthetic import iter_synthetic_users
+from user_birthday.utils import bulk_upsert_users
+from user_birthday.settings import upsert_chunk_size
+
+
+class Command(BaseCommand):
+  help = 'Generates users with realistic birthdays, and bulk loads them in the DB'
+
+  def add_arguments(self, parser):
+    parser.add_argument('count', type=int, help='users to generate')
+    parser.add_argument('--seed', type=int, help='for reproducible data')
+    parser.add_argument('--start', type=int, default=0,
+                        help='number of the first email, to add users to previous ones')
+    parser.add_argument('--chunk-size', type=int, default=upsert_chunk_size)
+
+  def handle(self, *args, **options):
+    users = iter_synthetic_users(options['count'], options['seed'], options['start'])
+    inserted, updated = bulk_upsert_users(users, options['chunk_size'])
+    self.stdout.write('{} users upserted in DB ({} inserted, {} updated)'.format(
+      inserted + updated, inserted, updated))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from user_birthday.jobs import resume_import_jobs
+from user_birthday.models import ImportJob
+
+
+class Command(BaseCommand):
+  help = 'Runs the pending import jobs, and the ones abandoned by a stopped process'
+
+  def handle(self, *args, **options):
+    resume_import_jobs()
+    for status in (ImportJob.PENDING, ImportJob.RUNNING):
+      count = ImportJob.objects.filter(status=status).count()
+      if count:
+        self.stdout.write('{} import jobs still {}'.format(count, status))
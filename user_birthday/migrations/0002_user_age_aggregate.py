@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_birthday', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgeAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('users_count', models.BigIntegerField(default=0)),
+                ('birthdays_sum', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
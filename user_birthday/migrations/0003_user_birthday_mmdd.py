@@ -0,0 +1,24 @@
+from django.db import migrations, models
+from django.db.models.functions import ExtractDay, ExtractMonth
+
+
+def populate_birthday_mmdd(apps, schema_editor):
+    User = apps.get_model('user_birthday', 'User')
+    User.objects.update(birthday_mmdd=ExtractMonth('birthday') * 100 + ExtractDay('birthday'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_birthday', '0002_user_age_aggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='birthday_mmdd',
+            field=models.SmallIntegerField(db_index=True, default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_birthday_mmdd, migrations.RunPython.noop),
+    ]
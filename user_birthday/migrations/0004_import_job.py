@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:39
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_birthday', '0003_user_birthday_mmdd'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('size', models.BigIntegerField()),
+                ('rows_done', models.BigIntegerField(default=0)),
+                ('rows_failed', models.BigIntegerField(default=0)),
+                ('errors', models.JSONField(default=list)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('heartbeat_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -1,7 +1,24 @@
+import uuid
 from django import forms
 from datetime import date
-from django.db import models
+from django.utils import timezone
+from django.db import models, transaction
 from django.conf import settings
+from .validators import build_json_schema
+
+
+class DateOrdinal(models.Func):
+  """Same as `date.toordinal()`, calculated in the DB"""
+  output_field = models.BigIntegerField()
+
+  def as_postgresql(self, compiler, connection, **extra_context):
+    return self.as_sql(compiler, connection, template="(%(expressions)s - DATE '0001-01-01' + 1)",
+                       **extra_context)
+
+  def as_sqlite(self, compiler, connection, **extra_context):
+    return self.as_sql(compiler, connection,
+                       template="CAST(julianday(%(expressions)s) - 1721424.5 AS INTEGER)",
+                       **extra_context)
 
 
 class UserAverageAgeManager(models.Manager):
@@ -12,11 +29,32 @@ class UserAverageAgeManager(models.Manager):
     return get_avg_age(when if when else date.today())
 
 
+def month_day_key(day):
+  """Month and day of a date as a MMDD integer, i.e 1231 for December 31st"""
+  return day.month * 100 + day.day
+
+
 class User(models.Model):
   first_name = models.CharField(max_length=40)
   last_name = models.CharField(max_length=40)
   email = models.EmailField(max_length=150, unique=True, primary_key=True)
   birthday = models.DateField()
+  # Indexed copy of the birthday's month and day, for birthday range queries
+  birthday_mmdd = models.SmallIntegerField(db_index=True, editable=False)
+
+  def save(self, *args, **kwargs):
+    self.birthday_mmdd = month_day_key(self._meta.get_field('birthday').to_python(self.birthday))
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'birthday' in update_fields \
+       and 'birthday_mmdd' not in update_fields:
+      kwargs['update_fields'] = [*update_fields, 'birthday_mmdd']
+    # The running age aggregate is read in pre_save and written in post_save (see
+    # user_birthday/signals.py): both in the transaction of the write
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+
+  # Fields returned by the API, in order
+  api_fields = ('first_name', 'last_name', 'email', 'birthday')
 
   def serialize_for_API(self):
     # Serialize and convert birthday to given string format
@@ -30,6 +68,57 @@ class User(models.Model):
   objects = UserAverageAgeManager()  # Replacing default mananger
 
 
+class UserAgeAggregate(models.Model):
+  """
+  Running count and sum of the birthdays (as ordinals) of all users, in a single row.
+  Maintained on every user change when `use_running_age_aggregate` is set.
+  """
+  users_count = models.BigIntegerField(default=0)
+  birthdays_sum = models.BigIntegerField(default=0)
+
+
+class ImportJob(models.Model):
+  """
+  A users import running in the background (see user_birthday/jobs.py), from the
+  payload spooled to `path`. Its progress is saved with every chunk upserted, so an
+  interrupted job resumes after the last one.
+  """
+  PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+  STATUSES = [(status, status) for status in (PENDING, RUNNING, DONE, FAILED)]
+
+  id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+  status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+  path = models.CharField(max_length=500)
+  size = models.BigIntegerField()  # Payload bytes
+  rows_done = models.BigIntegerField(default=0)
+  rows_failed = models.BigIntegerField(default=0)
+  errors = models.JSONField(default=list)  # The first failed rows, with their errors
+  error = models.TextField(blank=True)  # Why the whole job failed, if it did
+  created_at = models.DateTimeField(auto_now_add=True)
+  started_at = models.DateTimeField(null=True)
+  finished_at = models.DateTimeField(null=True)
+  heartbeat_at = models.DateTimeField(null=True)  # Last progress saved by its worker
+
+  def serialize_for_API(self):
+    elapsed = None
+    if self.started_at:
+      elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+    rows = self.rows_done + self.rows_failed
+    return {
+      'id': str(self.id),
+      'status': self.status,
+      'bytes': self.size,
+      'rows_done': self.rows_done,
+      'rows_failed': self.rows_failed,
+      'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+      'errors': self.errors,
+      'error': self.error,
+      'created_at': self.created_at.isoformat(),
+      'started_at': self.started_at and self.started_at.isoformat(),
+      'finished_at': self.finished_at and self.finished_at.isoformat(),
+    }
+
+
 class UserForm(forms.ModelForm):
   email = forms.EmailField(max_length=100)  # Removing unique constrain to allow upsert
   class Meta:
@@ -37,31 +126,5 @@ class UserForm(forms.ModelForm):
     fields = ['first_name', 'last_name', 'birthday']
 
 
-# JSON Schema to validate post requests
-# TODO: build this automatically from model.
-json_user_birthday_schema = \
-{
-  "type": "array",
-  "items": {
-    "type": "object",
-    "properties": {
-      "first_name": {
-        "type": "string"
-      },
-      "last_name": {
-        "type": "string"
-      },
-      "email": {
-        "type": "string",
-        "format": "email"
-      },
-      "birthday": {
-        "type": "string",
-        "pattern": "^(0?[1-9]|[12][0-9]|3[01])\\.(0?[1-9]|1[012])\\.\\d{4}$"
-      }
-    },
-    "required": [
-      "first_name", "last_name", "email", "birthday"
-    ]
-  }
-}
\ No newline at end of file
+# JSON Schema to validate post requests, built from the model's fields
+json_user_birthday_schema = build_json_schema(User)
@@ -0,0 +1,65 @@
+"""
+Bulk serialization of users for the API, from `values_list(*User.api_fields)` rows
+instead of model instances. The output is the same as `json.dumps` (with
+`ensure_ascii=False`) of their `serialize_for_API()` dicts, byte for byte: every row
+fills a prebuilt template with its JSON encoded strings, and birthdays are formatted
+and encoded once per distinct date. Strings are encoded by orjson when installed
+(same escaping as the stdlib), or by the stdlib's C encoder otherwise.
+"""
+import json
+from functools import lru_cache
+from json.encoder import encode_basestring
+from django.conf import settings
+from .models import User
+
+try:
+  import orjson
+except ImportError:  # Optional, ~1.7x faster than the stdlib here
+  orjson = None
+
+# As json.dumps(user.serialize_for_API()) writes it, with the values left out
+_row_template = '{' + ', '.join('{}: %s'.format(json.dumps(name)) for name in User.api_fields) + '}'
+_row_template_bytes = _row_template.replace('%s', '%b').encode('utf-8')
+
+
+@lru_cache(maxsize=1 << 16)
+def _encode_date(day, date_format):
+  return encode_basestring(day.strftime(date_format))
+
+def _serialize_rows_stdlib(rows):
+  encode, date_format = encode_basestring, settings.DATE_FORMAT
+  return ', '.join(_row_template % (encode(first_name), encode(last_name),
+                                    encode(email), _encode_date(birthday, date_format))
+                   for first_name, last_name, email, birthday in rows).encode('utf-8')
+
+@lru_cache(maxsize=1 << 16)
+def _encode_date_orjson(day, date_format):
+  return orjson.dumps(day.strftime(date_format))
+
+def _serialize_rows_orjson(rows):
+  encode, date_format = orjson.dumps, settings.DATE_FORMAT
+  return b', '.join(_row_template_bytes % (encode(first_name), encode(last_name),
+                                           encode(email), _encode_date_orjson(birthday, date_format))
+                    for first_name, last_name, email, birthday in rows)
+
+def _rows_fragments_stdlib(rows):
+  encode, date_format = encode_basestring, settings.DATE_FORMAT
+  return [(_row_template % (encode(first_name), encode(last_name),
+                            encode(email), _encode_date(birthday, date_format))).encode('utf-8')
+          for first_name, last_name, email, birthday in rows]
+
+def _rows_fragments_orjson(rows):
+  encode, date_format = orjson.dumps, settings.DATE_FORMAT
+  return [_row_template_bytes % (encode(first_name), encode(last_name),
+                                 encode(email), _encode_date_orjson(birthday, date_format))
+          for first_name, last_name, email, birthday in rows]
+
+# JSON of the users in a list of rows, comma separated (no brackets), as utf-8 bytes
+serialize_users_rows = _serialize_rows_stdlib if orjson is None else _serialize_rows_orjson
+# The same, as a list with the JSON of every user (joining them is slower than the above)
+users_json_fragments = _rows_fragments_stdlib if orjson is None else _rows_fragments_orjson
+
+
+def users_json(rows):
+  """Same as json.dumps of the serialized users in `rows`, as utf-8 bytes"""
+  return b'[' + serialize_users_rows(rows) + b']'
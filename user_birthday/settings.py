@@ -0,0 +1,18 @@
+import os
+
+upsert_chunk_size = 1000  # Rows written per bulk upsert statement
+stream_import_min_bytes = 1024 * 1024  # Bigger POST payloads are parsed incrementally
+stream_import_read_size = 64 * 1024  # Bytes read from the request at a time
+use_running_age_aggregate = False  # Maintain UserAgeAggregate, for O(1) average ages
+avg_age_cache_timeout = 24 * 60 * 60  # Seconds, entries are also versioned
+users_max_page_size = 1000  # Max `limit` of a GET users page (also the default)
+users_stream_chunk_size = 2000  # Rows fetched and written at a time when streaming
+range_response_cache_max_bytes = 32 * 1024 * 1024  # Per process, for GET birthday ranges
+use_users_snapshot = False  # Per process copy of the users, for ranges and average ages
+aggregates_cache_timeout = 24 * 60 * 60  # Seconds, for the age and birthdays histograms
+# Spooled payloads of the import jobs: persistent, and shared by the processes resuming them
+import_jobs_dir = os.environ.get('IMPORT_JOBS_DIR', os.path.join(
+  os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'import_jobs'))
+import_job_workers = 2  # Threads per process running import jobs (0: only `run_import_jobs`)
+import_job_stale_seconds = 5 * 60  # Running jobs without progress for longer are resumed
+import_job_max_errors = 100  # Failed rows kept in a job, with their errors
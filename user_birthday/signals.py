@@ -1,9 +1,34 @@
 from .models import User
-from datetime import date
 from django.dispatch import receiver  
-from django.db.models.signals import pre_save, pre_delete
-from .utils import get_avg_age
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from . import settings as user_birthday_settings
+from .utils import invalidate_avg_age_cache, lock_user_age_aggregate, update_user_age_aggregate
 
 @receiver([pre_save, pre_delete], sender=User)
 def invalidate_avg_age_cache_on_model_change(sender, instance, *args, **kwargs):
-  get_avg_age.__defaults__[0]['valid_until'] = date.fromtimestamp(1)
+  invalidate_avg_age_cache()
+
+@receiver([pre_save, pre_delete], sender=User)
+def remember_old_birthday_for_age_aggregate(sender, instance, *args, **kwargs):
+  if user_birthday_settings.use_running_age_aggregate:
+    # Inside the write's transaction (User.save and deletes are atomic), until it ends
+    lock_user_age_aggregate()
+    # Reading it from the DB, `instance` could be outdated
+    instance._old_birthday = User.objects.filter(pk=instance.pk) \
+                                         .values_list('birthday', flat=True).first()
+
+@receiver(post_save, sender=User)
+def update_age_aggregate_on_save(sender, instance, *args, **kwargs):
+  if user_birthday_settings.use_running_age_aggregate:
+    birthday = User._meta.get_field('birthday').to_python(instance.birthday)
+    old_birthday = getattr(instance, '_old_birthday', None)
+    if old_birthday is None:
+      update_user_age_aggregate(1, birthday.toordinal())
+    else:
+      update_user_age_aggregate(0, birthday.toordinal() - old_birthday.toordinal())
+
+@receiver(post_delete, sender=User)
+def update_age_aggregate_on_delete(sender, instance, *args, **kwargs):
+  if user_birthday_settings.use_running_age_aggregate:
+    if instance._old_birthday is not None:
+      update_user_age_aggregate(-1, -instance._old_birthday.toordinal())
@@ -0,0 +1,85 @@
+"""
+Optional per process copy of the users table (see settings.use_users_snapshot),
+to answer birthday ranges, upcoming birthdays and the average age without the DB.
+Users are kept sorted by birthday month-day: their MMDD keys in an `array`, searched
+with bisect, next to their serialized JSON. The average age only needs the users
+count and the sum of their birthdays ordinals, added up once per load.
+A snapshot belongs to a users version: it's loaded again, by a single thread, once
+the version changes (the other threads keep using the DB meanwhile).
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from .models import User
+from .serializers import users_json_fragments
+from .settings import users_stream_chunk_size
+
+
+class UsersSnapshot:
+
+  def __init__(self, version, rows, chunk_size=users_stream_chunk_size):
+    """`rows` are (birthday_mmdd, *User.api_fields) values, sorted by MMDD"""
+    self.version = version
+    self.mmdd = array('H')  # 101 to 1231
+    self.users = []  # JSON of every user, as utf-8 bytes
+    self.birthdays_sum = 0
+    birthday_index = User.api_fields.index('birthday')
+    rows = iter(rows)
+    for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+      self.mmdd.extend(row[0] for row in chunk)
+      self.users += users_json_fragments(row[1:] for row in chunk)
+      self.birthdays_sum += sum(row[1 + birthday_index].toordinal() for row in chunk)
+
+  @classmethod
+  def load(cls, version):
+    rows = User.objects.order_by('birthday_mmdd', 'email') \
+                       .values_list('birthday_mmdd', *User.api_fields) \
+                       .iterator(chunk_size=users_stream_chunk_size)
+    return cls(version, rows)
+
+  def birthdays_totals(self):
+    """(users count, sum of the birthdays as ordinals), as `get_users_birthdays_totals`"""
+    return len(self.mmdd), self.birthdays_sum
+
+  def next_month_day_key(self, key):
+    """The first birthday MMDD key after `key` (in the same year), or None"""
+    index = bisect_right(self.mmdd, key)
+    return self.mmdd[index] if index < len(self.mmdd) else None
+
+  def month_day_range_json(self, fkey, tkey):
+    """
+    JSON array of the users with birthday from the `fkey` to the `tkey` MMDD keys,
+    wrapping the end of the year when `fkey` is greater, sorted by the next birthday.
+    """
+    start, end = bisect_left(self.mmdd, fkey), bisect_right(self.mmdd, tkey)
+    users = self.users[start:end] if fkey <= tkey else self.users[start:] + self.users[:end]
+    return b'[' + b', '.join(users) + b']'
+
+
+_snapshot = None
+_loading = threading.Lock()
+
+
+def get_users_snapshot(version):
+  """
+  The snapshot of the users `version`, loading it if needed. Returns None while
+  another thread loads it.
+  """
+  global _snapshot
+  snapshot = _snapshot
+  if snapshot is not None and snapshot.version == version:
+    return snapshot
+  if not _loading.acquire(blocking=False):
+    return None
+  try:
+    if _snapshot is None or _snapshot.version != version:
+      _snapshot = UsersSnapshot.load(version)
+    return _snapshot
+  finally:
+    _loading.release()
+
+
+def clear_users_snapshot():
+  global _snapshot
+  _snapshot = None
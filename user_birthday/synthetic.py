@@ -0,0 +1,44 @@
+import random
+import unicodedata
+from datetime import date
+from calendar import monthrange
+
+FIRST_NAMES = ['Melamie', 'Rosemonde', 'Casie', 'Nico', 'Murielle', 'Karna', 'Tomás',
+               'Eike', 'Hans', 'Alan', 'Maria', 'Sofia', 'Lukas', 'Emma', 'Mateo',
+               'Noah', 'Mia', 'Leon', 'Lucía', 'Ben', 'Hannah', 'Jonas', 'Anna', 'Paul']
+LAST_NAMES = ['Mandrey', 'Hatchman', 'Giveen', 'Dyers', 'Passo', 'Skyrme', 'Hayes',
+              'Bartel', 'Peter', 'Brito', 'Müller', 'Schmidt', 'García', 'Fernández',
+              'Smith', 'Jones', 'Weber', 'Wagner', 'López', 'Becker', 'Hoffmann']
+# Share of the population by age decade, from 10-19 to 90-99 years old
+AGE_DECADES_WEIGHTS = [12, 14, 15, 14, 14, 13, 10, 6, 2]
+# Births are not evenly spread along the year: a few more in summer and september
+MONTHS_WEIGHTS = [8.0, 7.5, 8.2, 7.9, 8.3, 8.2, 8.7, 8.9, 8.6, 8.5, 8.0, 8.2]
+
+
+def iter_synthetic_users(count, seed=None, start=0, today=None):
+  """
+  Yields `count` users data (with the birthday as a date), with a realistic spread of
+  ages and birthdays along the year. Emails are unique, numbered from `start`
+  (generating again from a previous number updates those users).
+  """
+  rand = random.Random(seed)
+  today = today or date.today()
+  decades = range(10, 100, 10)
+  for i in range(start, start + count):
+    # Names only depend on the number, so the same emails are generated again
+    first_name = FIRST_NAMES[i % len(FIRST_NAMES)]
+    last_name = LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]
+    age = rand.choices(decades, AGE_DECADES_WEIGHTS)[0] + rand.randrange(10)
+    month = rand.choices(range(1, 13), MONTHS_WEIGHTS)[0]
+    year = today.year - age
+    day = rand.randint(1, monthrange(year, month)[1])
+    yield {
+      'first_name': first_name,
+      'last_name': last_name,
+      'email': _ascii('{}.{}{}@example.com'.format(first_name, last_name, i).lower()),
+      'birthday': date(year, month, day),
+    }
+
+def _ascii(text):
+  """i.e 'tomás' => 'tomas'"""
+  return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
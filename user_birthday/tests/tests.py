@@ -1,10 +1,42 @@
 # -*- coding: utf-8 -*-
-from django.test import TestCase, Client
-from user_birthday.models import User, UserForm
-from user_birthday.utils import get_date_from_long_date_str_format, get_avg_age
-from datetime import date
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, override_settings
+from asgiref.sync import sync_to_async
+from user_birthday.models import User, UserForm, UserAgeAggregate, json_user_birthday_schema
+from user_birthday.utils import get_date_from_long_date_str_format, get_avg_age, \
+                                bulk_upsert_users, iter_json_array_items, \
+                                process_users_json_stream, validate_user_row, \
+                                get_users_birthdays_totals, _get_avg_age_cache_key, \
+                                get_upcoming_birthdays_json, _calculate_avg_age, \
+                                get_age_histogram
+from user_birthday.cache import get_cache, get_users_version, bump_users_version, \
+                                users_version_key, range_response_cache
+from user_birthday.validators import RowFormatError
+from jsonschema import validate, ValidationError
+from user_birthday.synthetic import iter_synthetic_users
+from user_birthday import serializers
+from user_birthday.snapshot import get_users_snapshot, clear_users_snapshot
+from user_birthday.models import ImportJob
+from user_birthday.jobs import run_import_job
+from django.db import DatabaseError, connection
+from user_birthday import imports
+from user_birthday import exports
+import csv
+import re
+from django.core.management import call_command
+from unittest import mock, skipUnless
+import threading
+import time
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db.models import Q
+from django.db.models.functions import ExtractDay, ExtractMonth
+from datetime import date, datetime
+import io
+import os
 import json
 import math
+import tempfile
+import datetime as dt
 
 class UserTestPOST(TestCase):
   """Testing Point A"""
@@ -64,12 +96,172 @@ class UserTestPOST(TestCase):
     self.assertEqual(len(users_in_db), len(users_data))
     self.assertEqual(response.status_code, 200)
 
+  def test_upserting_reports_inserted_and_updated(self):
+    self.client.post(self.baseUrl, json.dumps(self.mock_data[0:2]),
+                     content_type='application/json')
+    users = self.mock_data[1:3]
+    users[0]['first_name'] = 'Updated'
+    response = self.client.post(self.baseUrl, json.dumps(users),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('(1 inserted, 1 updated)', response.content.decode())
+    self.assertEqual(User.objects.count(), 3)
+    self.assertEqual(User.objects.get(email=users[0]['email']).first_name, 'Updated')
+
+  def test_repeated_email_in_payload_last_one_wins(self):
+    users = [dict(self.mock_data[0]), dict(self.mock_data[0], last_name='Last')]
+    response = self.client.post(self.baseUrl, json.dumps(users),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('(1 inserted, 1 updated)', response.content.decode())
+    self.assertEqual(User.objects.get().last_name, 'Last')
+
+  def test_bulk_upsert_in_chunks(self):
+    users_data = self.mock_data[0:10]
+    for user_data in users_data:
+      user_data['birthday'] = get_date_from_long_date_str_format(user_data['birthday'])
+    self.assertEqual(bulk_upsert_users(users_data[0:4], chunk_size=3), (4, 0))
+    self.assertEqual(bulk_upsert_users(users_data, chunk_size=3), (6, 4))
+    self.assertEqual(User.objects.count(), 10)
+
+
+class UserTestStreamingPOST(TestCase):
+  """Testing Point A, with the incremental parser"""
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/'
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      self.mock_data = json.load(f)
+
+  def test_iter_json_array_items_small_reads(self):
+    payload = ' [ {"a": [1, "]"]} ,\n 12345 , "\u00e1\u00e9" , null ] '
+    items = list(iter_json_array_items(io.BytesIO(payload.encode()), read_size=3))
+    self.assertEqual(items, json.loads(payload))
+
+  def test_iter_json_array_items_invalid(self):
+    for payload in ['', '{}', '[1, 2', '[1 2]', '[1,]', '"asc"', '[1] 2', '[]x', '[1]\n]']:
+      with self.assertRaises(ValueError):
+        list(iter_json_array_items(io.BytesIO(payload.encode()), read_size=2))
+
+  def test_process_users_json_stream(self):
+    payload = json.dumps(self.mock_data).encode()
+    inserted, updated = process_users_json_stream(io.BytesIO(payload), chunk_size=100)
+    self.assertEqual((inserted, updated), (len(self.mock_data), 0))
+    self.assertEqual(User.objects.count(), len(self.mock_data))
+
+  def test_invalid_user_rolls_back_previous_chunks(self):
+    users = self.mock_data[0:10]
+    users[-1]['birthday'] = '31.02.2000'
+    payload = json.dumps(users).encode()
+    with self.assertRaises(ValueError):
+      process_users_json_stream(io.BytesIO(payload), chunk_size=3)
+    self.assertEqual(User.objects.count(), 0)
+
+  @mock.patch('user_birthday.apis.stream_import_min_bytes', 0)
+  def test_streamed_post(self):
+    response = self.client.post(self.baseUrl, json.dumps(self.mock_data),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(User.objects.count(), len(self.mock_data))
+
+  @mock.patch('user_birthday.apis.stream_import_min_bytes', 0)
+  def test_streamed_post_malformed_user(self):
+    user = {'first_name': 'Melamie', 'last_name': 'Mandrey', 'email': '', 'birthday': '28.04.2000'}
+    response = self.client.post(self.baseUrl, json.dumps([user]),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(User.objects.count(), 0)
+
+  def test_same_errors_as_the_buffered_post(self):
+    users = self.mock_data[:10]
+    users[2] = dict(users[2], first_name='')
+    users[7] = dict(users[7], birthday='31.02.2000')
+    for payload in [json.dumps(users), json.dumps(self.mock_data[:3]) + ' garbage']:
+      response = self.client.post(self.baseUrl, payload, content_type='application/json')
+      with mock.patch('user_birthday.apis.stream_import_min_bytes', 0):
+        streamed = self.client.post(self.baseUrl, payload, content_type='application/json')
+      self.assertEqual(response.status_code, 400)
+      self.assertEqual((streamed.status_code, streamed.content),
+                       (response.status_code, response.content))
+    self.assertEqual(User.objects.count(), 0)
+
+
+class UserTestRowValidator(TestCase):
+  """The compiled row validator should behave as the schema + form + strptime did"""
+  def legacy_validate_row(self, row):
+    try:
+      validate(row, json_user_birthday_schema['items'])
+    except ValidationError:
+      raise RowFormatError(row)
+    row = dict(row)
+    try:
+      row['birthday'] = datetime.strptime(row['birthday'], '%d.%m.%Y').date()
+    except ValueError:
+      raise ValueError(json.dumps({'birthday': 'Bad date format, expected: %d.%m.%Y'}))
+    u_form = UserForm(row)
+    if not u_form.is_valid():
+      raise ValueError(u_form.errors.as_json())
+    return row
+
+  def test_schema_built_from_model(self):
+    name = {"type": "string"}
+    self.assertEqual(json_user_birthday_schema['items'], {
+      "type": "object",
+      "properties": {
+        "first_name": name,
+        "last_name": name,
+        "email": {"type": "string", "format": "email"},
+        "birthday": {
+          "type": "string",
+          "pattern": "^(0?[1-9]|[12][0-9]|3[01])\\.(0?[1-9]|1[012])\\.\\d{4}$"
+        }
+      },
+      "required": ["first_name", "last_name", "email", "birthday"]
+    })
+
+  def test_same_results_as_legacy_validation(self):
+    user = {'first_name': 'Melamie', 'last_name': 'Mandrey',
+            'email': 'mmandrey0@hubpages.com', 'birthday': '28.04.2000'}
+    rows = [
+      user, dict(user, birthday='3.2.1998'), dict(user, birthday='31.02.2000'),
+      dict(user, birthday='28-04-2000'), dict(user, birthday='28.04.0000'),
+      dict(user, first_name=''), dict(user, first_name='   '),
+      dict(user, last_name='x' * 41), dict(user, last_name='a\x00b'),
+      dict(user, email=''), dict(user, email='not-an-email'),
+      dict(user, email='a' * 95 + '@b.com'), dict(user, first_name='', email='@'),
+      dict(user, first_name=1), {'first_name': 'Melamie'}, 'Melamie', None,
+    ]
+    for row in rows:
+      try:
+        expected = self.legacy_validate_row(row)
+      except ValueError as err:
+        expected = err
+      try:
+        result = validate_user_row(row)
+      except ValueError as err:
+        result = err
+      if isinstance(expected, ValueError):
+        self.assertIs(type(result), type(expected), row)
+        self.assertEqual(str(result), str(expected), row)
+      else:
+        self.assertEqual(result, expected, row)
+
+  def test_fast_date_parser(self):
+    for date_string in ['28.04.2000', '3.2.1998', '29.02.2000', '01.12.0001']:
+      self.assertEqual(get_date_from_long_date_str_format(date_string),
+                       datetime.strptime(date_string, '%d.%m.%Y').date())
+    for date_string in ['29.02.2001', '00.01.2000', '1.13.2000', '1.1.20000', '']:
+      with self.assertRaises(ValueError):
+        get_date_from_long_date_str_format(date_string)
+
 
 class UserTestGET(TestCase):
   """Testing Point B"""
   def setUp(self):
     self.client = Client()
     self.baseUrl = '/api/v1/users/'
+    # Test transactions are rolled back, without bumping the users version
+    range_response_cache.clear()
   
   @classmethod
   def setUpTestData(cls):
@@ -89,6 +281,37 @@ class UserTestGET(TestCase):
     response_users = response.json()
     self.assertEqual(len(response_users), len(users_in_db))
 
+  def test_keyset_pagination(self):
+    emails, url, params = [], self.baseUrl, {'limit': 300}
+    while url:
+      response = self.client.get(url, params)
+      self.assertEqual(response.status_code, 200)
+      page = response.json()
+      self.assertLessEqual(len(page), 300)
+      emails += [user['email'] for user in page]
+      url, params = response.get('Link', '')[1:].partition('>')[0], None
+    self.assertEqual(emails, sorted(User.objects.values_list('email', flat=True)))
+
+  def test_pagination_with_range(self):
+    response = self.client.get(self.baseUrl, {'from': '0101', 'to': '3101', 'limit': 5})
+    self.assertEqual(len(response.json()), 5)
+    self.assertIn('from=0101', response['Link'])
+    page = response.json() + self.client.get(response['Link'][1:].partition('>')[0]).json()
+    users_on_month = User.objects.filter(birthday__month=1).order_by('email')[:10]
+    self.assertEqual(page, [user.serialize_for_API() for user in users_on_month])
+
+  def test_bad_pagination_arguments(self):
+    for params in [{'limit': 0}, {'limit': 'a'}, {'limit': 10 ** 6}, {'cursor': '!'}]:
+      response = self.client.get(self.baseUrl, params)
+      self.assertEqual(response.status_code, 400)
+
+  def test_streamed_response(self):
+    for params in [{}, {'from': '0101', 'to': '3101'}, {'from': '0101', 'to': '0101'}]:
+      response = self.client.get(self.baseUrl, dict(params, stream='true'))
+      self.assertTrue(response.streaming)
+      self.assertEqual(b''.join(response.streaming_content),
+                       self.client.get(self.baseUrl, params).content)
+
   def test_no_complete_arguments(self):
     response = self.client.get(self.baseUrl, {'from':1010})
     self.assertEqual(response.status_code, 400)
@@ -109,13 +332,34 @@ class UserTestGET(TestCase):
     self.assertEqual(len(response_users), len(users_in_db))
     self.assertEqual(len(response_users), users_in_mock_data_for_this_day)
 
-  def test_overlapping_dates_no_results(self):
-    """If from is later that to, no results are expected"""
-    # For this date, I know there are 3 users in mock_data having birthday
+  def test_year_wrapping_range(self):
+    """If from is later that to, the range wraps the end of the year"""
+    response = self.client.get(self.baseUrl, {'from': '2012', 'to': '0501'})
+    self.assertEqual(response.status_code, 200)
+    users_in_range = User.objects.filter(
+      Q(birthday__month=12, birthday__day__gte=20) |
+      Q(birthday__month=1, birthday__day__lte=5))
+    self.assertEqual(len(response.json()), users_in_range.count())
+    self.assertGreater(users_in_range.count(), 0)
+
+  def test_overlapping_dates_whole_year(self):
+    """From 12.12 to 11.12 wraps the whole year"""
     response = self.client.get(self.baseUrl, {'from': '1212', 'to': '1112'})
     self.assertEqual(response.status_code, 200)
-    response_users = response.json()
-    self.assertEqual(len(response_users), 0)
+    self.assertEqual(len(response.json()), User.objects.count())
+
+  def test_birthday_mmdd_in_sync(self):
+    user = User.objects.first()
+    user.birthday = date(1990, 7, 4)
+    user.save()
+    self.assertEqual(User.objects.get(pk=user.pk).birthday_mmdd, 704)
+    bulk_upsert_users([dict(user.serialize_for_API(), birthday=date(1990, 12, 31))])
+    self.assertEqual(User.objects.get(pk=user.pk).birthday_mmdd, 1231)
+    user.birthday = date(1990, 3, 9)
+    user.save(update_fields=('birthday',))
+    self.assertEqual(User.objects.get(pk=user.pk).birthday_mmdd, 309)
+    self.assertFalse(User.objects.exclude(
+      birthday_mmdd=ExtractMonth('birthday') * 100 + ExtractDay('birthday')).exists())
 
   def test_correct_boundaries(self):
     """Can we obtain all users using from&to args?"""
@@ -131,6 +375,48 @@ class UserTestGET(TestCase):
     response_users = response.json()
     users_on_month = User.objects.filter(birthday__month='1')
     self.assertEqual(len(response_users), users_on_month.count())
+
+  def test_conditional_get(self):
+    params = {'from': '0101', 'to': '3101'}
+    response = self.client.get(self.baseUrl, params)
+    etag = response['ETag']
+    self.assertRegex(etag, r'^"[0-9]+"$')
+    self.assertTrue(response.has_header('Last-Modified'))
+    with self.assertNumQueries(0):
+      response = self.client.get(self.baseUrl, params, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.content, b'')
+    response = self.client.get(self.baseUrl, params,
+                               HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+    self.assertEqual(response.status_code, 304)
+
+    user = User.objects.first()
+    user.first_name = 'Changed'
+    user.save()
+    response = self.client.get(self.baseUrl, params, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+
+  def test_range_responses_cached(self):
+    params = {'from': '0101', 'to': '3101'}
+    response = self.client.get(self.baseUrl, params)
+    with self.assertNumQueries(0):
+      cached = self.client.get(self.baseUrl, params)
+    self.assertEqual(cached.content, response.content)
+    self.assertIn((101, 131, get_users_version()), range_response_cache._items)
+
+    user = User.objects.filter(birthday__month=1).first()
+    user.first_name = 'Changed'
+    user.save()
+    response = self.client.get(self.baseUrl, params)
+    self.assertIn('Changed', [user['first_name'] for user in response.json()])
+
+  def test_conditional_get_after_upsert(self):
+    etag = self.client.get(self.baseUrl)['ETag']
+    bulk_upsert_users([{'first_name': 'New', 'last_name': 'User', 'email': 'new@user.com',
+                        'birthday': date(1990, 1, 1)}])
+    response = self.client.get(self.baseUrl, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
   
 
 class UserTestAverageAge(TestCase):
@@ -173,7 +459,75 @@ class UserTestAverageAge(TestCase):
     response = self.client.get(self.baseUrl, {'when': when})
     self.assertEqual(response.status_code, 200)
     self.assertEqual(response.json(), expected_result)
-    self.assertEqual(get_avg_age.__defaults__[0], expected_cache_after)
+    self.assertEqual(get_cache().get(_get_avg_age_cache_key()), expected_cache_after)
+
+  def test_leap_day_birthday_in_common_year(self):
+    """The cache of a February of a common year ends on Feb 28 for Feb 29 birthdays"""
+    User.objects.all().delete()
+    User.objects.create(first_name='Leap', last_name='Day', email='leap@day.com',
+                        birthday=date(2000, 2, 29))
+    response = self.client.get(self.baseUrl, {'when': '10.2.2021'})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json(), 21)
+    self.assertEqual(get_cache().get(_get_avg_age_cache_key())['valid_until'], date(2021, 2, 28))
+    response = self.client.get(self.baseUrl, {'when': '10.2.2024'})
+    self.assertEqual(get_cache().get(_get_avg_age_cache_key())['valid_until'], date(2024, 2, 29))
+
+  def test_cache_invalidated_on_changes(self):
+    when = date(1998, 2, 3)
+    self.assertEqual(get_avg_age(when), 17)
+    version = get_users_version()
+    User.objects.all().update(birthday=date(1988, 2, 3))  # No signals, still cached
+    self.assertEqual(get_avg_age(when), 17)
+    User.objects.first().save()
+    self.assertGreater(get_users_version(), version)
+    self.assertEqual(get_avg_age(when), 10)
+
+  def test_version_not_reused_after_eviction(self):
+    version = bump_users_version()
+    get_cache().delete(users_version_key)
+    self.assertGreater(get_users_version(), version)
+
+  def test_concurrent_bumps_only_grow(self):
+    with tempfile.TemporaryDirectory() as cache_dir:
+      for cache in (LocMemCache('bumps', {}), FileBasedCache(cache_dir, {})):
+        slow_get = cache.get
+        def get(*args, **kwargs):
+          value = slow_get(*args, **kwargs)
+          time.sleep(0.005)  # Every bump reads before the others write, unless serialized
+          return value
+        cache.set(users_version_key, 100, timeout=None)
+        barrier = threading.Barrier(8)
+        def bump():
+          barrier.wait()
+          versions.append(bump_users_version())
+        versions = []
+        with mock.patch('user_birthday.cache.get_cache', return_value=cache), \
+             mock.patch.object(cache, 'get', get), \
+             mock.patch('user_birthday.cache.time.time', return_value=0):
+          threads = [threading.Thread(target=bump) for _ in range(8)]
+          [thread.start() for thread in threads]
+          [thread.join() for thread in threads]
+        self.assertEqual(sorted(versions), list(range(101, 109)))
+        self.assertEqual(cache.get(users_version_key), 108)
+
+  def test_conditional_get(self):
+    for params in ({}, {'when': '01.06.2010'}):
+      response = self.client.get(self.baseUrl, params)
+      etag = response['ETag']
+      with self.assertNumQueries(0):
+        response = self.client.get(self.baseUrl, params, HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, 304)
+
+    User.objects.first().delete()
+    response = self.client.get(self.baseUrl, {'when': '01.06.2010'}, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+
+  def test_etag_changes_with_today(self):
+    response = self.client.get(self.baseUrl)
+    self.assertTrue(response['ETag'].endswith('-{}"'.format(date.today().toordinal())))
+    response = self.client.get(self.baseUrl, {'when': '01.06.2010'})
+    self.assertRegex(response['ETag'], r'^"[0-9]+"$')
 
   def test_from_today(self):
     today = date.today()
@@ -186,3 +540,582 @@ class UserTestAverageAge(TestCase):
     self.assertEqual(response.json(), expected_result)
     
     
+
+
+class UserTestAgeAggregate(TestCase):
+  """Average age calculated in the DB, and the optional running aggregate"""
+  def setUp(self):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      self.mock_data = json.load(f)
+    for user_data in self.mock_data:
+      user_data['birthday'] = get_date_from_long_date_str_format(user_data['birthday'])
+
+  def test_totals_calculated_in_db(self):
+    bulk_upsert_users(self.mock_data)
+    self.assertEqual(get_users_birthdays_totals(), (
+      len(self.mock_data), sum(u['birthday'].toordinal() for u in self.mock_data)))
+
+  def test_empty_totals(self):
+    self.assertEqual(get_users_birthdays_totals(), (0, 0))
+
+  @mock.patch('user_birthday.settings.use_running_age_aggregate', True)
+  def test_running_aggregate_follows_changes(self):
+    def assert_aggregate_in_sync():
+      aggregate = UserAgeAggregate.objects.get()
+      self.assertEqual((aggregate.users_count, aggregate.birthdays_sum),
+                       get_users_birthdays_totals())
+
+    User.objects.create(**self.mock_data[0])
+    assert_aggregate_in_sync()
+    user = User.objects.create(**self.mock_data[1])
+    user.birthday = date(1950, 1, 1)
+    user.save()
+    assert_aggregate_in_sync()
+    bulk_upsert_users(self.mock_data[0:500] + [dict(self.mock_data[0], birthday=date(1990, 5, 5))])
+    assert_aggregate_in_sync()
+    user.delete()
+    User.objects.filter(email__startswith='a').delete()
+    assert_aggregate_in_sync()
+    self.assertEqual(User.objects.get_avg_age(date(2020, 3, 1)),
+                     _calculate_avg_age_in_python(date(2020, 3, 1)))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrent writers need row locks')
+class UserTestAgeAggregateConcurrency(TransactionTestCase):
+  """Writers running at the same time don't count the same change twice"""
+  def setUp(self):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      self.mock_data = json.load(f)[:200]
+    for user_data in self.mock_data:
+      user_data['birthday'] = get_date_from_long_date_str_format(user_data['birthday'])
+
+  def run_concurrently(self, func, threads=4):
+    barrier = threading.Barrier(threads)
+    def run():
+      try:
+        barrier.wait()
+        func()
+      finally:
+        connection.close()  # The thread's own
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+
+  @mock.patch('user_birthday.settings.use_running_age_aggregate', True)
+  def test_concurrent_writers(self):
+    User.objects.create(**self.mock_data[0])
+    self.run_concurrently(lambda: bulk_upsert_users(self.mock_data))
+    self.run_concurrently(lambda: User(**dict(self.mock_data[1], birthday=date(1950, 1, 1))).save())
+    payload = ''.join(json.dumps(dict(user, birthday='01.02.1960')) + '\n'
+                      for user in User.objects.order_by('email')[:50].values(*User.api_fields))
+    self.run_concurrently(lambda: imports.import_users(io.BytesIO(payload.encode()), 'ndjson'))
+    aggregate = UserAgeAggregate.objects.get()
+    self.assertEqual((aggregate.users_count, aggregate.birthdays_sum),
+                     get_users_birthdays_totals())
+
+
+def _calculate_avg_age_in_python(when):
+  users = User.objects.all()
+  return round(sum([(when - user.birthday).days/365 for user in users]) / len(users))
+
+
+class UserTestSyntheticData(TestCase):
+  def test_generate_users_command(self):
+    out = io.StringIO()
+    call_command('generate_users', 500, seed=1, chunk_size=128, stdout=out)
+    self.assertIn('500 users upserted in DB (500 inserted, 0 updated)', out.getvalue())
+    call_command('generate_users', 100, seed=1, start=450, stdout=out)
+    self.assertEqual(User.objects.count(), 550)
+
+  def test_synthetic_users_are_valid(self):
+    today = date(2020, 6, 1)
+    users = list(iter_synthetic_users(2000, seed=2, today=today))
+    self.assertEqual(len({user['email'] for user in users}), 2000)
+    for user in users:
+      self.assertTrue(9 <= (today - user['birthday']).days / 365.25 < 100)
+      payload = dict(user, birthday=user['birthday'].strftime('%d.%m.%Y'))
+      self.assertEqual(validate_user_row(payload), user)
+
+
+@override_settings(ROOT_URLCONF='skill_test.asgi_urls')
+class UserTestAsync(TestCase):
+  """Async views (served through ASGI) answer the same as the sync ones"""
+  def setUp(self):
+    self.client = Client()
+    self.async_client = AsyncClient()
+    self.baseUrl = '/api/v1/users/'
+
+  @classmethod
+  def setUpTestData(cls):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      cls.mock_data = json.load(f)
+    bulk_upsert_users(dict(user, birthday=get_date_from_long_date_str_format(user['birthday']))
+                      for user in cls.mock_data[:300])
+
+  async def test_get(self):
+    for querystring in ('', 'from=0101&to=3103', 'limit=50', 'from=32'):
+      # AsyncClient.get() ignores `data` in Django 3.2
+      response = await self.async_client.get(self.baseUrl + '?' + querystring)
+      expected = await sync_to_async(self.client.get)(self.baseUrl + '?' + querystring)
+      self.assertEqual(response.status_code, expected.status_code)
+      self.assertEqual(response.content, expected.content)
+
+  async def test_get_streamed(self):
+    response = await self.async_client.get(self.baseUrl + '?stream=true')
+    self.assertTrue(response.streaming)
+    # Iterating a queryset, so out of the event loop (as skill_test.handlers does)
+    content = await sync_to_async(b''.join)(response.streaming_content)
+    expected = await sync_to_async(self.client.get)(self.baseUrl)
+    self.assertEqual(json.loads(content), json.loads(expected.content))
+
+  async def test_post(self):
+    response = await self.async_client.post(self.baseUrl, json.dumps(self.mock_data[250:400]),
+                                            content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.content, b'150 users upserted in DB (100 inserted, 50 updated)\n')
+    self.assertEqual(await sync_to_async(User.objects.count)(), 400)
+
+  async def test_avg_age(self):
+    for querystring in ('', 'when=01.06.2010', 'when=2010'):
+      response = await self.async_client.get(self.baseUrl + 'avg_age?' + querystring)
+      expected = await sync_to_async(self.client.get)(self.baseUrl + 'avg_age?' + querystring)
+      self.assertEqual(response.status_code, expected.status_code)
+      self.assertEqual(response.content, expected.content)
+
+
+class UserTestSerializers(TestCase):
+  def setUp(self):
+    users = list(iter_synthetic_users(200, seed=4))
+    users[0].update(first_name='Zoë "Q"\\', last_name='Ñ\n\t\x01\x7f\u2028 😀')
+    users[1].update(birthday=date(987, 3, 4))
+    self.users = [User(**user) for user in users]
+    self.rows = [tuple(getattr(user, name) for name in User.api_fields) for user in self.users]
+
+  def test_same_bytes_as_serialize_for_API(self):
+    expected = json.dumps([user.serialize_for_API() for user in self.users],
+                          ensure_ascii=False).encode('utf-8')
+    self.assertEqual(serializers.users_json(self.rows), expected)
+    self.assertEqual(b'[' + serializers._serialize_rows_stdlib(self.rows) + b']', expected)
+    if serializers.orjson is not None:
+      self.assertEqual(b'[' + serializers._serialize_rows_orjson(self.rows) + b']', expected)
+    self.assertEqual(serializers.users_json([]), b'[]')
+
+  def test_date_format_setting(self):
+    with self.settings(DATE_FORMAT='%Y-%m-%d'):
+      self.assertEqual(json.loads(serializers.users_json(self.rows[1:2]))[0]['birthday'],
+                       self.users[1].birthday.strftime('%Y-%m-%d'))
+
+
+@mock.patch('user_birthday.settings.use_users_snapshot', True)
+class UserTestSnapshot(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/'
+    # Test transactions are rolled back, without bumping the users version
+    range_response_cache.clear()
+    clear_users_snapshot()
+    self.addCleanup(clear_users_snapshot)
+
+  @classmethod
+  def setUpTestData(cls):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      for user_data in json.load(f):
+        user_data['birthday'] = get_date_from_long_date_str_format(user_data['birthday'])
+        User.objects.create(**user_data)
+
+  def test_same_responses_as_the_db(self):
+    ranges = [('0101', '3101'), ('2012', '0501'), ('2902', '2902'), ('0103', '0103')]
+    from_snapshot = [self.client.get(self.baseUrl, {'from': fdm, 'to': tdm}).content
+                     for fdm, tdm in ranges]
+    range_response_cache.clear()
+    with mock.patch('user_birthday.settings.use_users_snapshot', False):
+      from_db = [self.client.get(self.baseUrl, {'from': fdm, 'to': tdm}).content
+                 for fdm, tdm in ranges]
+    self.assertEqual(from_snapshot, from_db)
+    self.assertGreater(len(json.loads(from_db[1])), 0)
+
+  def test_served_without_queries(self):
+    get_users_snapshot(get_users_version())
+    with self.assertNumQueries(0):
+      response = self.client.get(self.baseUrl, {'from': '0101', 'to': '3101'})
+      self.client.get(self.baseUrl + 'avg_age')
+      self.client.get(self.baseUrl + 'upcoming')
+    self.assertEqual(len(response.json()), User.objects.filter(birthday__month=1).count())
+
+  def test_reloaded_when_the_users_change(self):
+    snapshot = get_users_snapshot(get_users_version())
+    self.assertIs(get_users_snapshot(get_users_version()), snapshot)
+    user = User.objects.filter(birthday__month=1).first()
+    user.first_name = 'Changed'
+    user.save()
+    response = self.client.get(self.baseUrl, {'from': '0101', 'to': '3101'})
+    self.assertIn('Changed', [user['first_name'] for user in response.json()])
+    self.assertIsNot(get_users_snapshot(get_users_version()), snapshot)
+
+  def test_avg_age(self):
+    when = date(2021, 6, 15)
+    from_snapshot = _calculate_avg_age(when)
+    with mock.patch('user_birthday.settings.use_users_snapshot', False):
+      self.assertEqual(from_snapshot, _calculate_avg_age(when))
+
+  def test_avg_age_with_leap_day_birthday(self):
+    User.objects.filter(birthday_mmdd__gt=210, birthday_mmdd__lte=229).delete()
+    User.objects.create(first_name='Leap', last_name='Day', email='leap@day.com',
+                        birthday=date(2000, 2, 29))
+    when = date(2021, 2, 10)
+    from_snapshot = get_avg_age(when)
+    self.assertEqual(get_cache().get(_get_avg_age_cache_key())['valid_until'], date(2021, 2, 28))
+    get_cache().delete(_get_avg_age_cache_key())
+    with mock.patch('user_birthday.settings.use_users_snapshot', False):
+      self.assertEqual(get_avg_age(when), from_snapshot)
+    self.assertEqual(get_cache().get(_get_avg_age_cache_key())['valid_until'], date(2021, 2, 28))
+
+  def test_upcoming_birthdays(self):
+    version = get_users_version()
+    users = json.loads(get_upcoming_birthdays_json(date(2021, 12, 30), 5, version))
+    birthdays = [get_date_from_long_date_str_format(user['birthday']) for user in users]
+    self.assertEqual(len(birthdays), User.objects.filter(
+      Q(birthday_mmdd__gte=1230) | Q(birthday_mmdd__lte=103)).count())
+    self.assertEqual([(day.month, day.day) for day in birthdays],
+                     sorted(((day.month, day.day) for day in birthdays),
+                            key=lambda month_day: month_day[0] == 1))  # Next year's last
+    self.assertEqual(len(json.loads(get_upcoming_birthdays_json(date(2021, 1, 1), 366, version))),
+                     User.objects.count())
+    self.assertEqual(len(json.loads(get_upcoming_birthdays_json(date(2020, 3, 1), 366, version))),
+                     User.objects.count())
+
+    with mock.patch('user_birthday.settings.use_users_snapshot', False):
+      range_response_cache.clear()
+      self.assertEqual(json.loads(get_upcoming_birthdays_json(date(2021, 12, 30), 5, version)),
+                       users)
+
+  def test_upcoming_endpoint(self):
+    response = self.client.get(self.baseUrl + 'upcoming', {'days': 30})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json(), json.loads(get_upcoming_birthdays_json(
+      date.today(), 30, get_users_version())))
+    response = self.client.get(self.baseUrl + 'upcoming', {'days': 30},
+                               HTTP_IF_NONE_MATCH=response['ETag'])
+    self.assertEqual(response.status_code, 304)
+    response = self.client.get(self.baseUrl + 'upcoming', {'days': 367})
+    self.assertEqual(response.status_code, 400)
+
+
+class UserTestAggregates(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/'
+    bump_users_version()  # Test transactions are rolled back, without bumping it
+
+  @classmethod
+  def setUpTestData(cls):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      for user_data in json.load(f):
+        user_data['birthday'] = get_date_from_long_date_str_format(user_data['birthday'])
+        User.objects.create(**user_data)
+
+  def test_age_histogram(self):
+    when = date(2020, 6, 15)
+    ages = [when.year - user.birthday.year - ((user.birthday.month, user.birthday.day) >
+                                               (when.month, when.day))
+            for user in User.objects.all()]
+    response = self.client.get(self.baseUrl + 'age_histogram', {'when': '15.06.2020', 'width': 5})
+    self.assertEqual(response.status_code, 200)
+    histogram = response.json()
+    self.assertEqual(sum(bucket['count'] for bucket in histogram), len(ages))
+    for bucket in histogram:
+      self.assertEqual(bucket['to'] - bucket['from'], 4)
+      self.assertEqual(bucket['count'], sum(bucket['from'] <= age <= bucket['to'] for age in ages))
+    self.assertEqual(histogram[0]['from'], min(ages) // 5 * 5)
+    self.assertEqual(histogram[-1]['from'], max(ages) // 5 * 5)
+
+  def test_age_histogram_birthday_today(self):
+    User.objects.all().delete()
+    User.objects.create(first_name='A', last_name='B', email='a@b.com', birthday=date(2000, 6, 15))
+    User.objects.create(first_name='C', last_name='D', email='c@d.com', birthday=date(2000, 6, 16))
+    histogram = get_age_histogram(date(2020, 6, 15), 1, get_users_version())
+    self.assertEqual(histogram, [{'from': 19, 'to': 19, 'count': 1},
+                                 {'from': 20, 'to': 20, 'count': 1}])
+    with self.assertNumQueries(0):
+      self.assertEqual(get_age_histogram(date(2020, 6, 15), 10, get_users_version()),
+                       [{'from': 10, 'to': 19, 'count': 1}, {'from': 20, 'to': 29, 'count': 1}])
+
+  def test_birthdays_count(self):
+    by_month = self.client.get(self.baseUrl + 'birthdays_count').json()
+    self.assertEqual([row['month'] for row in by_month], list(range(1, 13)))
+    for row in by_month:
+      self.assertEqual(row['count'], User.objects.filter(birthday__month=row['month']).count())
+
+    by_day = self.client.get(self.baseUrl + 'birthdays_count', {'by': 'day'}).json()
+    self.assertEqual(len(by_day), 366)
+    self.assertEqual(sum(row['count'] for row in by_day), User.objects.count())
+    self.assertEqual(by_day[59], {'month': 2, 'day': 29, 'count': User.objects.filter(
+      birthday__month=2, birthday__day=29).count()})
+
+  def test_single_query_cached_until_users_change(self):
+    with self.assertNumQueries(1):
+      self.client.get(self.baseUrl + 'birthdays_count')
+      self.client.get(self.baseUrl + 'birthdays_count', {'by': 'day'})
+    with self.assertNumQueries(1):
+      self.client.get(self.baseUrl + 'age_histogram', {'width': 10})
+      self.client.get(self.baseUrl + 'age_histogram', {'width': 1})
+    count = self.client.get(self.baseUrl + 'birthdays_count').json()[0]['count']
+    User.objects.create(first_name='A', last_name='B', email='a@b.com', birthday=date(2000, 1, 1))
+    self.assertEqual(self.client.get(self.baseUrl + 'birthdays_count').json()[0]['count'],
+                     count + 1)
+
+  def test_bad_arguments(self):
+    for path, params in [('age_histogram', {'width': 0}), ('age_histogram', {'width': 'a'}),
+                         ('age_histogram', {'when': '2020'}), ('birthdays_count', {'by': 'year'})]:
+      response = self.client.get(self.baseUrl + path, params)
+      self.assertEqual(response.status_code, 400)
+
+
+class UserTestImportJobs(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/'
+    spool_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(spool_dir.cleanup)
+    for name, value in (('import_jobs_dir', spool_dir.name), ('import_job_workers', 0)):
+      patcher = mock.patch('user_birthday.jobs.' + name, value)  # Run by the tests instead
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      self.mock_data = json.load(f)
+
+  def post_job(self, payload):
+    response = self.client.post(self.baseUrl + '?async=true', payload,
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 202)
+    job = ImportJob.objects.get(pk=response.json()['job'])
+    self.assertEqual(response['Location'], self.baseUrl + 'import_jobs/{}'.format(job.pk))
+    return job
+
+  def test_payload_spooled(self):
+    payload = json.dumps(self.mock_data)
+    job = self.post_job(payload)
+    self.assertEqual(job.status, ImportJob.PENDING)
+    self.assertEqual(job.size, len(payload))
+    with open(job.path) as spooled:
+      self.assertEqual(spooled.read(), payload)
+    self.assertEqual(User.objects.count(), 0)
+
+  def test_job_imported(self):
+    job = self.post_job(json.dumps(self.mock_data))
+    self.assertTrue(run_import_job(job.pk, chunk_size=300))
+    self.assertFalse(run_import_job(job.pk))  # Already done
+    self.assertEqual(User.objects.count(), len(self.mock_data))
+    self.assertFalse(os.path.exists(job.path))
+
+    status = self.client.get(self.baseUrl + 'import_jobs/{}'.format(job.pk)).json()
+    self.assertEqual((status['status'], status['rows_done'], status['rows_failed']),
+                     (ImportJob.DONE, len(self.mock_data), 0))
+    self.assertGreater(status['rows_per_second'], 0)
+
+  def test_failed_rows_skipped(self):
+    users = self.mock_data[:10]
+    users[3] = dict(users[3], email='not an email')
+    users[7] = {'first_name': 'Missing fields'}
+    job = self.post_job(json.dumps(users))
+    run_import_job(job.pk)
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.rows_done, job.rows_failed), (ImportJob.DONE, 8, 2))
+    self.assertEqual([error['row'] for error in job.errors], [3, 7])
+    self.assertIn('email', job.errors[0]['error'])
+    self.assertEqual(User.objects.count(), 8)
+
+  def test_malformed_payload(self):
+    job = self.post_job(json.dumps(self.mock_data[:10])[:-30])
+    run_import_job(job.pk, chunk_size=5)
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.error), (ImportJob.FAILED, 'Invalid json format.'))
+    self.assertEqual(job.rows_done, User.objects.count())
+    self.assertEqual(job.rows_done, 5)
+
+  def test_resumed_after_restart(self):
+    job = self.post_job(json.dumps(self.mock_data))
+    upsert = bulk_upsert_users
+    calls = []
+    def interrupted_upsert(users_data):
+      calls.append(len(users_data))
+      if len(calls) == 3:
+        raise DatabaseError('Connection lost')
+      return upsert(users_data)
+    with mock.patch('user_birthday.jobs.bulk_upsert_users', interrupted_upsert):
+      with self.assertRaises(DatabaseError):
+        run_import_job(job.pk, chunk_size=200)
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.rows_done), (ImportJob.RUNNING, 400))
+    call_command('run_import_jobs', stdout=io.StringIO())  # Not stale yet
+    self.assertEqual(User.objects.count(), 400)
+
+    ImportJob.objects.filter(pk=job.pk).update(
+      heartbeat_at=job.heartbeat_at - dt.timedelta(hours=1))
+    call_command('run_import_jobs', stdout=io.StringIO())
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.rows_done), (ImportJob.DONE, len(self.mock_data)))
+    self.assertEqual(User.objects.count(), len(self.mock_data))
+
+  def test_payload_elsewhere_not_resumed(self):
+    job = self.post_job(json.dumps(self.mock_data[:10]))
+    ImportJob.objects.filter(pk=job.pk).update(path=job.path + '.elsewhere')
+    call_command('run_import_jobs', stdout=io.StringIO())
+    job.refresh_from_db()
+    self.assertEqual(job.status, ImportJob.PENDING)  # Left for the host having it
+    ImportJob.objects.filter(pk=job.pk).update(path=job.path[:-len('.elsewhere')])
+    call_command('run_import_jobs', stdout=io.StringIO())
+    job.refresh_from_db()
+    self.assertEqual(job.status, ImportJob.DONE)
+
+  def test_spool_error_not_hidden(self):
+    # Raised by the spool's open, not by the cleanup of a file never created
+    with mock.patch('user_birthday.jobs.open', create=True,
+                    side_effect=PermissionError('Read only')):
+      with self.assertRaises(PermissionError):
+        self.client.post(self.baseUrl + '?async=true', '[]', content_type='application/json')
+
+  def test_unknown_job(self):
+    response = self.client.get(self.baseUrl + 'import_jobs/{}'.format(
+      '00000000-0000-0000-0000-000000000000'))
+    self.assertEqual(response.status_code, 404)
+
+
+class UserTestCSVImport(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/'
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      self.mock_data = json.load(f)
+
+  def to_csv(self, users, fields=('birthday', 'email', 'extra', 'first_name', 'last_name')):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fields, restval='x', extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(users)
+    return output.getvalue()
+
+  def to_ndjson(self, users):
+    return '\n'.join(json.dumps(user) for user in users) + '\n\n'
+
+  def assert_same_as_json(self, users, payload, content_type):
+    response = self.client.post(self.baseUrl, json.dumps(users), content_type='application/json')
+    expected = (response.status_code, response.content, [
+      user.serialize_for_API() for user in User.objects.order_by('email')])
+    User.objects.all().delete()
+    response = self.client.post(self.baseUrl, payload, content_type=content_type)
+    self.assertEqual((response.status_code, response.content, [
+      user.serialize_for_API() for user in User.objects.order_by('email')]), expected)
+    return response
+
+  def test_csv(self):
+    users = self.mock_data + [dict(self.mock_data[0], first_name='Last, "wins"')]
+    response = self.assert_same_as_json(users, self.to_csv(users), 'text/csv')
+    self.assertEqual(response.status_code, 200)
+
+  def test_ndjson(self):
+    users = self.mock_data[:100]
+    response = self.assert_same_as_json(users, self.to_ndjson(users), 'application/x-ndjson')
+    self.assertEqual(response.status_code, 200)
+
+  def test_invalid_rows(self):
+    users = self.mock_data[:20]
+    users[5] = dict(users[5], email='not an email')
+    users[9] = dict(users[9], birthday='31.02.2000')
+    self.assert_same_as_json(users, self.to_csv(users), 'text/csv')
+    self.assert_same_as_json(users, self.to_ndjson(users), 'application/x-ndjson')
+    self.assertEqual(User.objects.count(), 0)
+
+  def test_invalid_format(self):
+    header, *lines = self.to_csv(self.mock_data[:5]).splitlines(True)
+    for payload, content_type in [
+        (self.to_csv(self.mock_data[:5], fields=('email', 'birthday')), 'text/csv'),
+        # A value per column in every row, as COPY requires
+        (header + ''.join(lines[:2]) + '\n' + ''.join(lines[2:]), 'text/csv'),
+        (header + ''.join(lines) + '\r\n', 'text/csv'),
+        (header + ''.join(lines[:4]) + lines[4].replace(',x,', ','), 'text/csv'),
+        (header + ''.join(lines[:4]) + lines[4].rstrip('\r\n') + ',x\r\n', 'text/csv'),
+        (self.to_ndjson(self.mock_data[:5]) + '[]\n', 'application/x-ndjson'),
+        (self.to_ndjson(self.mock_data[:5]) + '{"email": \n', 'application/x-ndjson')]:
+      response = self.client.post(self.baseUrl, payload, content_type=content_type)
+      self.assertEqual(response.status_code, 400)
+      self.assertIn('format', json.loads(response.content))
+    self.assertEqual(User.objects.count(), 0)
+    response = self.client.post(self.baseUrl + '?async=true', self.to_csv(self.mock_data[:5]),
+                                content_type='text/csv')
+    self.assertEqual(response.status_code, 400)
+
+  def test_plainly_valid_rows_are_valid(self):
+    """What the SQL checks of the COPY path let through is valid for validate_user_row"""
+    name, email = re.compile(imports._name_regex, re.S), re.compile(imports._email_regex)
+    for value in ['Ann', 'A', 'Mary Ann', 'Ñandú', ' Ann', 'Ann\u00a0', '\u3000', '']:
+      row = {'first_name': value, 'last_name': 'L', 'email': 'a@b.co', 'birthday': '1.2.2000'}
+      if name.match(value):
+        validate_user_row(row)
+      else:
+        self.assertNotEqual(value, value.strip() or None)
+    for value in ['john.doe+x@mail.example.org', "o'neil@b.co", 'a@b', 'a@-b.com', 'a b@c.de',
+                  'ñ@b.co', 'a@b.c0m']:
+      row = {'first_name': 'F', 'last_name': 'L', 'email': value, 'birthday': '1.2.2000'}
+      if email.match(value):
+        validate_user_row(row)
+
+
+class UserTestExport(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.baseUrl = '/api/v1/users/export'
+    bump_users_version()
+
+  @classmethod
+  def setUpTestData(cls):
+    with open('user_birthday/tests/MOCK_DATA.json', 'r') as f:
+      mock_data = json.load(f)
+    bulk_upsert_users([dict(user, birthday=get_date_from_long_date_str_format(user['birthday']))
+                       for user in mock_data])
+
+  def export(self, params):
+    response = self.client.get(self.baseUrl, params)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.streaming)
+    return response, b''.join(response.streaming_content).decode('utf-8')
+
+  def test_ndjson(self):
+    response, content = self.export({})
+    self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+    lines = content.split('\n')
+    self.assertEqual(lines.pop(), '')
+    self.assertEqual(lines, [json.dumps(user.serialize_for_API(), ensure_ascii=False)
+                             for user in User.objects.order_by('email')])
+
+  def test_csv_with_range(self):
+    response, content = self.export({'format': 'csv', 'from': '2012', 'to': '1001'})
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    users = self.client.get('/api/v1/users/', {'from': '2012', 'to': '1001'}).json()
+    self.assertEqual(list(csv.DictReader(io.StringIO(content))),
+                     sorted(users, key=lambda user: user['email']))
+    # What's exported can be imported back
+    response = self.client.post('/api/v1/users/', content, content_type='text/csv')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('(0 inserted, {} updated)'.format(len(users)), response.content.decode())
+
+  def test_chunks(self):
+    users = User.objects.filter(birthday__year__lt=1990)
+    chunks = list(exports.iter_users_export(users, 'csv', chunk_size=7))
+    self.assertEqual(len(chunks), 1 + math.ceil(users.count() / 7))  # And the header
+    self.assertEqual(len(b''.join(chunks).splitlines()), 1 + users.count())
+    self.assertEqual(list(exports.iter_users_export(User.objects.none(), 'ndjson')), [])
+    self.assertEqual(list(exports.iter_users_export(User.objects.filter(pk__in=[]), 'csv')),
+                     [b'first_name,last_name,email,birthday\n'])
+
+  def test_to_char_format(self):
+    self.assertEqual(exports._to_char_format('%d.%m.%Y'), 'DD"."MM"."FMYYYY')
+    self.assertEqual(exports._to_char_format('%d/%m %% "%y'), 'DD"/"MM" ""%"" \\""YY')
+    self.assertIsNone(exports._to_char_format('%d %B %Y'))
+
+  def test_bad_arguments(self):
+    for params in [{'format': 'xml'}, {'from': '0101'}, {'from': '3202', 'to': '0101'}]:
+      response = self.client.get(self.baseUrl, params)
+      self.assertEqual(response.status_code, 400)
@@ -3,5 +3,11 @@ from . import apis
 
 urlpatterns = [
   path('', apis.user_birthdays, name="user_birthdays"),
-  path('avg_age', apis.user_birthdays_avg_age, name="user_birthdays_average")
+  path('avg_age', apis.user_birthdays_avg_age, name="user_birthdays_average"),
+  path('upcoming', apis.user_birthdays_upcoming, name="user_birthdays_upcoming"),
+  path('age_histogram', apis.user_birthdays_age_histogram, name="user_birthdays_age_histogram"),
+  path('birthdays_count', apis.user_birthdays_count, name="user_birthdays_count"),
+  path('import_jobs/<uuid:job_id>', apis.user_birthdays_import_job,
+       name="user_birthdays_import_job"),
+  path('export', apis.user_birthdays_export, name="user_birthdays_export"),
 ]
\ No newline at end of file
@@ -1,17 +1,32 @@
+import re
 import json
+import base64
+import binascii
+import codecs
 import datetime
 from datetime import date
 from calendar import monthrange
-from django.conf import settings
-from django.db.models import Avg
+from itertools import islice
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Cast, ExtractYear
 from json.decoder import JSONDecodeError
-from jsonschema import validate, ValidationError
-from .models import json_user_birthday_schema, UserForm, User
+from .models import UserForm, User, UserAgeAggregate, DateOrdinal, month_day_key
+from . import settings as user_birthday_settings
+from .settings import upsert_chunk_size, stream_import_read_size, avg_age_cache_timeout, \
+                      users_max_page_size, users_stream_chunk_size, aggregates_cache_timeout
+from .cache import get_cache, get_users_version, invalidate_users_cache, range_response_cache
+from .validators import compile_row_validator, parse_long_date, RowFormatError
+from .serializers import serialize_users_rows, users_json
+from .snapshot import get_users_snapshot
+
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+validate_user_row = compile_row_validator(User, UserForm)  # Built once, at import time
 
 
 def get_date_from_long_date_str_format(date_string):
   """ Parse %d.%m.%Y format recieved from json in POST """
-  return datetime.datetime.strptime(date_string, settings.DATE_FORMAT).date()
+  return parse_long_date(date_string)
 
 def get_date_from_short_date_str_format(date_string):
   """ This is to parse %d.%m / %d%m format recieved in GET """
@@ -44,69 +59,382 @@ def parse_from_to_querystring(fromdm, todm):
 def refine_query_for_users_in_birthday_range(users_query, fdate, tdate):
   """
   Returns a refined query of users, only including the ones having birthday
-  in the given range of dates (day and month).
+  in the given range of dates (day and month), using the indexed `birthday_mmdd`.
+  When `fdate` is after `tdate` the range wraps the end of the year.
   """
   assert(type(fdate) == datetime.date)
   assert(type(tdate) == datetime.date)
-  return users_query.filter(  # Grabing superset of users, between given months
-    birthday__month__gte=fdate.month,
-    birthday__month__lte=tdate.month,
-  ).exclude(  # Refining head: exluding days before the `from` day, in `from` month
-    birthday__month=fdate.month,
-    birthday__day__lt=fdate.day,
-  ).exclude(  # Refining tail, exluding days after the `to` day, in `to` month
-    birthday__month=tdate.month,
-    birthday__day__gt=tdate.day,
-  )
-
-def is_json_format_valid(json_input):
+  fkey, tkey = month_day_key(fdate), month_day_key(tdate)
+  if fkey <= tkey:
+    return users_query.filter(birthday_mmdd__gte=fkey, birthday_mmdd__lte=tkey)
+  # i.e from 20.12 to 05.01: two index ranges, until the end and from the start of the year
+  return users_query.filter(Q(birthday_mmdd__gte=fkey) | Q(birthday_mmdd__lte=tkey))
+
+def get_users_in_birthday_range_json(fdate, tdate, version):
+  """
+  The GET response of the users with birthday in the given range, as utf-8 JSON bytes.
+  Cached by the range's month-day keys and the users `version`, so repeated ranges
+  skip both the query and the serialization until the users change.
+  """
+  return get_users_in_month_day_range_json(month_day_key(fdate), month_day_key(tdate), version)
+
+def get_upcoming_birthdays_json(today, days, version):
+  """The users with birthday in the `days` days from `today` (included), sooner first"""
+  assert(type(today) == datetime.date)
+  fkey = month_day_key(today)
+  # A whole year from any day, leap or not, is its key up to the one before
+  tkey = month_day_key(today + datetime.timedelta(days=days - 1)) if days < 366 else fkey - 1
+  return get_users_in_month_day_range_json(fkey, tkey, version)
+
+def get_users_in_month_day_range_json(fkey, tkey, version):
+  """
+  JSON array of the users with birthday from the `fkey` to the `tkey` MMDD keys (the
+  range wraps the end of the year when `fkey` is greater), sorted by the next birthday.
+  """
+  key = (fkey, tkey, version)
+  data = range_response_cache.get(key)
+  if data is None:
+    snapshot = _get_users_snapshot(version)
+    if snapshot is not None:
+      data = snapshot.month_day_range_json(fkey, tkey)
+    else:
+      users = User.objects.filter(birthday_mmdd__gte=fkey, birthday_mmdd__lte=tkey) \
+              if fkey <= tkey else \
+              User.objects.filter(Q(birthday_mmdd__gte=fkey) | Q(birthday_mmdd__lte=tkey))
+      users = order_users_by_next_birthday(users, fkey, tkey)
+      data = users_json(users.values_list(*User.api_fields))
+    range_response_cache.set(key, data)
+  return data
+
+def order_users_by_next_birthday(users_query, fkey, tkey):
+  """Sorts the users with birthday in the `fkey` to `tkey` range as they'll happen"""
+  if fkey <= tkey:
+    return users_query.order_by('birthday_mmdd', 'email')
+  # Until the end of the year first
+  return users_query.order_by(Case(When(birthday_mmdd__gte=fkey, then=0), default=1),
+                              'birthday_mmdd', 'email')
+
+def _get_users_snapshot(version=None):
+  """The users snapshot, when enabled and not being loaded by another thread"""
+  if not user_birthday_settings.use_users_snapshot:
+    return None
+  return get_users_snapshot(get_users_version() if version is None else version)
+
+def parse_upcoming_days_querystring(days):
+  """Number of days of the upcoming birthdays, from 1 to a whole year (7 by default)"""
+  if days is None:
+    return 7
+  try:
+    days = int(days)
+  except ValueError:
+    raise ValueError('Bad days, expected an integer\n')
+  if not 0 < days <= 366:
+    raise ValueError('Bad days, expected a value from 1 to 366\n')
+  return days
+
+def parse_pagination_querystring(cursor, limit):
+  """Returns either (email after which the page starts, page size), or (None, None)"""
+  if cursor is None and limit is None:
+    return (None, None)
+  try:
+    limit = int(limit) if limit is not None else users_max_page_size
+  except ValueError:
+    raise ValueError('Bad limit, expected an integer\n')
+  if not 0 < limit <= users_max_page_size:
+    raise ValueError('Bad limit, expected a value from 1 to {}\n'.format(users_max_page_size))
   try:
-      data = json.loads(json_input)
-      validate(data, json_user_birthday_schema)
-  except (JSONDecodeError, ValidationError) as _:
-    return False
-  return True
-  
+    after = None
+    if cursor is not None:  # Cursors are url-safe base64
+      after = base64.b64decode(cursor, b'-_', validate=True).decode()
+  except (binascii.Error, UnicodeDecodeError):
+    raise ValueError('Bad cursor\n')
+  return (after, limit)
+
+def encode_users_cursor(email):
+  """Opaque cursor for the page starting after `email`"""
+  return base64.urlsafe_b64encode(email.encode()).decode()
+
+def get_users_page(users_query, after, limit):
+  """
+  Keyset pagination on the primary key (email), returns (users rows, next cursor).
+  The next cursor is None when there are no more users.
+  """
+  if after is not None:
+    users_query = users_query.filter(email__gt=after)
+  rows = list(users_query.order_by('email').values_list(*User.api_fields)[:limit])
+  email_index = User.api_fields.index('email')
+  next_cursor = encode_users_cursor(rows[-1][email_index]) if len(rows) == limit else None
+  return rows, next_cursor
+
+def iter_users_json(users_rows, chunk_size=users_stream_chunk_size):
+  """
+  Yields the same JSON array as json.dumps of the serialized users would (utf-8
+  bytes), a chunk of rows at a time. `users_rows` is any iterable of `User.api_fields`
+  values.
+  """
+  users_rows = iter(users_rows)
+  separator = b'['
+  for chunk in iter(lambda: list(islice(users_rows, chunk_size)), []):
+    yield separator + serialize_users_rows(chunk)
+    separator = b', '
+  yield b']' if separator == b', ' else b'[]'
+
 def process_users_raw_incomming_data(raw_data):
   """Returns validated and cleaned users data, or ValueError with description"""
   result = []
   error_msg = ""
-  if is_json_format_valid(raw_data):
-    for user_raw_data in json.loads(raw_data):
-      try:
-        user_raw_data['birthday'] = get_date_from_long_date_str_format(user_raw_data['birthday'])
-        u_form = UserForm(user_raw_data)
-        if not u_form.is_valid():
-          error_msg = u_form.errors.as_json()
-        result.append(u_form.data)
-      except ValueError:
-        error_msg = json.dumps({'birthday': 'Bad date format, expected: %d.%m.%Y'})
-  else:
-    error_msg ='Invalid json format.\n'
+  try:
+    users_raw_data = json.loads(raw_data)  # Parsing only once
+  except JSONDecodeError as _:
+    raise ValueError('Invalid json format.\n')
+  if type(users_raw_data) is not list:
+    raise ValueError('Invalid json format.\n')
+  for user_raw_data in users_raw_data:
+    try:
+      result.append(validate_user_row(user_raw_data))
+    except RowFormatError as _:
+      raise ValueError('Invalid json format.\n')
+    except ValueError as err:
+      error_msg = str(err)
   if error_msg:
     raise ValueError(error_msg)
   return result
 
-def get_avg_age(when, cache={'result': 0, 'valid_until': date(1970,1,1), 'valid_from': date(1970,1,2)}):
+def iter_json_array_items(stream, read_size=stream_import_read_size):
+  """
+  Yields the items of a JSON array, reading `stream` (a file-like object returning
+  bytes, i.e the request) `read_size` bytes at a time. Raises JSONDecodeError.
+  """
+  decoder = json.JSONDecoder()
+  utf8 = codecs.getincrementaldecoder('utf-8')()
+  buffer, pos, eof = '', 0, False
+
+  def fill():  # Drops what was already consumed and reads one more chunk
+    nonlocal buffer, pos, eof
+    data = stream.read(read_size)
+    eof = not data
+    buffer = buffer[pos:] + utf8.decode(data or b'', final=eof)
+    pos = 0
+
+  def next_char():  # Skips whitespace, returns '' at the end of the stream
+    nonlocal pos
+    while True:
+      pos = _json_whitespace.match(buffer, pos).end()
+      if pos < len(buffer) or eof:
+        return buffer[pos:pos + 1]
+      fill()
+
+  def end_of_array():  # Only whitespace can follow the closing bracket, as in json.loads
+    nonlocal pos
+    pos += 1
+    if next_char():
+      raise JSONDecodeError('Extra data', buffer, pos)
+
+  if next_char() != '[':
+    raise JSONDecodeError('Expecting JSON array', buffer, pos)
+  pos += 1
+  if next_char() == ']':
+    end_of_array()
+    return
+  while True:
+    next_char()
+    try:
+      item, end = decoder.raw_decode(buffer, pos)
+      incomplete = end == len(buffer) and not eof  # i.e a number cut in half
+    except JSONDecodeError:
+      if eof:
+        raise
+      incomplete = True
+    if incomplete:
+      fill()
+      continue
+    pos = end
+    yield item
+    separator = next_char()
+    if separator == ']':
+      end_of_array()
+      return
+    if separator != ',':
+      raise JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+    pos += 1
+
+def process_users_json_stream(stream, chunk_size=upsert_chunk_size):
+  """
+  Validates and upserts users read one by one from `stream`, without loading
+  the whole payload in memory. Returns an (inserted, updated) tuple of counts,
+  or ValueError with description (nothing is written in that case).
+  """
+  def iter_cleaned_users():
+    error_msg = ''
+    try:
+      for user_raw_data in iter_json_array_items(stream):
+        try:
+          yield validate_user_row(user_raw_data)
+        except RowFormatError:
+          raise
+        except ValueError as err:  # As process_users_raw_incomming_data, the last one
+          error_msg = str(err)
+    except (JSONDecodeError, RowFormatError) as _:
+      raise ValueError('Invalid json format.\n')
+    if error_msg:
+      raise ValueError(error_msg)
+  # Raising from inside the upsert's transaction rolls back the written chunks
+  return bulk_upsert_users(iter_cleaned_users(), chunk_size)
+
+def bulk_upsert_users(users_data, chunk_size=upsert_chunk_size):
+  """
+  Upserts validated users data (any iterable) in chunks, all inside one transaction.
+  Returns an (inserted, updated) tuple of counts.
+  """
+  inserted = updated = 0
+  aggregate_deltas = [0, 0]  # Users count and birthdays sum changes
+  users_data = iter(users_data)  # Works with lists and generators alike
+  with transaction.atomic():
+    if user_birthday_settings.use_running_age_aggregate:
+      lock_user_age_aggregate()  # Before reading the old birthdays
+    for chunk in iter(lambda: list(islice(users_data, chunk_size)), []):
+      # Same email twice in a chunk: last one wins, as with update_or_create
+      by_email = {
+        user_data['email']: dict(user_data, birthday_mmdd=month_day_key(user_data['birthday']))
+        for user_data in chunk
+      }
+      updated += len(chunk) - len(by_email)
+      if user_birthday_settings.use_running_age_aggregate:
+        count_delta, birthdays_delta = _get_upsert_aggregate_deltas(by_email)
+        aggregate_deltas[0] += count_delta
+        aggregate_deltas[1] += birthdays_delta
+      if connection.vendor == 'postgresql':
+        chunk_inserted = _upsert_chunk_on_conflict(list(by_email.values()))
+      else:
+        chunk_inserted = _upsert_chunk_portable(by_email)
+      inserted += chunk_inserted
+      updated += len(by_email) - chunk_inserted
+    if user_birthday_settings.use_running_age_aggregate:
+      update_user_age_aggregate(*aggregate_deltas)
+  # Bulk queries don't send pre_save signals, so invalidate once per batch
+  invalidate_avg_age_cache()
+  return inserted, updated
+
+def _upsert_chunk_on_conflict(users_data):
+  """Single INSERT ... ON CONFLICT statement, returns the inserted count"""
+  fields = User._meta.concrete_fields
+  qn = connection.ops.quote_name
+  pk_column = qn(User._meta.pk.column)
+  columns = ', '.join(qn(f.column) for f in fields)
+  updates = ', '.join('{0} = EXCLUDED.{0}'.format(qn(f.column))
+                      for f in fields if not f.primary_key)
+  row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+  sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT ({}) DO UPDATE SET {} ' \
+        'RETURNING (xmax = 0)'.format(  # xmax is 0 only for fresh inserts
+          qn(User._meta.db_table), columns,
+          ', '.join([row_placeholder] * len(users_data)), pk_column, updates)
+  params = [user_data[f.attname] for user_data in users_data for f in fields]
+  with connection.cursor() as cursor:
+    cursor.execute(sql, params)
+    return sum(1 for (was_inserted,) in cursor.fetchall() if was_inserted)
+
+def _upsert_chunk_portable(users_by_email):
+  """bulk_create + bulk_update fallback (SQLite), returns the inserted count"""
+  fields = [f.attname for f in User._meta.concrete_fields]
+  existing = set(User.objects.filter(pk__in=users_by_email.keys())
+                             .values_list('pk', flat=True))
+  new_users, old_users = [], []
+  for email, user_data in users_by_email.items():
+    user = User(**{field: user_data[field] for field in fields})
+    (old_users if email in existing else new_users).append(user)
+  User.objects.bulk_create(new_users)
+  if old_users:
+    User.objects.bulk_update(old_users, [f for f in fields if f != 'email'])
+  return len(new_users)
+
+def _get_upsert_aggregate_deltas(users_by_email):
+  """Changes to the running aggregate that upserting `users_by_email` would cause"""
+  old_birthdays = dict(User.objects.filter(pk__in=users_by_email.keys())
+                                   .values_list('pk', 'birthday'))
+  count_delta = len(users_by_email) - len(old_birthdays)
+  birthdays_delta = sum(user_data['birthday'].toordinal()
+                        for user_data in users_by_email.values()) \
+                    - sum(birthday.toordinal() for birthday in old_birthdays.values())
+  return count_delta, birthdays_delta
+
+def get_users_birthdays_totals():
+  """Returns (users count, sum of the birthdays as ordinals), calculated in the DB"""
+  totals = User.objects.aggregate(users_count=Count('pk'),
+                                  birthdays_sum=Sum(DateOrdinal('birthday')))
+  return totals['users_count'], totals['birthdays_sum'] or 0
+
+def rebuild_user_age_aggregate():
+  """Recalculates the running aggregate from the users table"""
+  users_count, birthdays_sum = get_users_birthdays_totals()
+  UserAgeAggregate.objects.update_or_create(
+    pk=1, defaults={'users_count': users_count, 'birthdays_sum': birthdays_sum})
+  return users_count, birthdays_sum
+
+def lock_user_age_aggregate():
+  """
+  Locks the running aggregate until the end of the transaction (creating it on first
+  use), so concurrent writers read the old birthdays and apply their changes one at a
+  time. Called in a transaction, before reading the users being written.
+  """
+  aggregate, created = UserAgeAggregate.objects.select_for_update().get_or_create(pk=1)
+  if created:  # The users table without the caller's changes, yet
+    aggregate.users_count, aggregate.birthdays_sum = get_users_birthdays_totals()
+    aggregate.save()
+
+def update_user_age_aggregate(count_delta, birthdays_delta):
+  """Applies the changes of an already written insert, update or delete"""
+  if not (count_delta or birthdays_delta):
+    return
+  updated = UserAgeAggregate.objects.filter(pk=1).update(
+    users_count=F('users_count') + count_delta,
+    birthdays_sum=F('birthdays_sum') + birthdays_delta)
+  if not updated:  # First use, the table already includes the change
+    rebuild_user_age_aggregate()
+
+def invalidate_avg_age_cache():
+  """Forces the next `get_avg_age` call to recalculate the average, in every worker"""
+  invalidate_users_cache()
+
+def _get_avg_age_cache_key():
+  return 'user_birthday:avg_age:{}'.format(get_users_version())
+
+def get_avg_age(when):
   """`when` argument was introduced just for testing porpuses"""
   assert(type(when) == datetime.date)
-  if cache['valid_from'] <= when <= cache['valid_until']:
-    return cache['result']
-  cache['result'] = _calculate_avg_age(when)
-  cache['valid_from'] = when
-  cache['valid_until'] = _get_avg_age_last_cache_valid_date(when)
-  return cache['result']
+  cache_key = _get_avg_age_cache_key()
+  cached = get_cache().get(cache_key)
+  if cached and cached['valid_from'] <= when <= cached['valid_until']:
+    return cached['result']
+  cached = {
+    'result': _calculate_avg_age(when),
+    'valid_from': when,
+    'valid_until': _get_avg_age_last_cache_valid_date(when),
+  }
+  get_cache().set(cache_key, cached, timeout=avg_age_cache_timeout)
+  return cached['result']
 
 def _calculate_avg_age(when):
   """
-  This is neither efficient enough, or exact enought (is that's even posible).
+  This is not exact enought (is that's even posible).
   Leap years could be considered, but I think a rough stimation is fear enough.
+  The average of `(when - birthday).days` is `when`'s ordinal minus the average of
+  the birthdays ordinals, so only the users count and birthdays sum are needed:
+  either from the users snapshot or the running aggregate (O(1)), or from a single
+  SQL aggregate.
   """
   assert(type(when) == datetime.date)
-  users = User.objects.all()
-  if not users:
+  snapshot = _get_users_snapshot()
+  if snapshot is not None:
+    users_count, birthdays_sum = snapshot.birthdays_totals()
+  elif user_birthday_settings.use_running_age_aggregate:
+    totals = UserAgeAggregate.objects.filter(pk=1) \
+                                     .values_list('users_count', 'birthdays_sum').first()
+    users_count, birthdays_sum = totals or rebuild_user_age_aggregate()
+  else:
+    users_count, birthdays_sum = get_users_birthdays_totals()
+  if not users_count:
     return float('nan')
-  avg_year = sum([(when - user.birthday).days/365 for user in users]) / len(users)
+  avg_year = (when.toordinal() * users_count - birthdays_sum) / users_count / 365
   return round(avg_year)
 
 def _get_avg_age_last_cache_valid_date(when):
@@ -115,12 +443,96 @@ def _get_avg_age_last_cache_valid_date(when):
   or a date for the end of this month.
   """
   assert(type(when) == datetime.date)
-  users = User.objects.filter(
-    birthday__month=when.month,
-    birthday__day__gt=when.day,
-  ).order_by('birthday__day')[:1]
-  if users:  # Returns the next birthday in `when` month
-    birthday = users[0].birthday
-    return date(when.year, birthday.month, birthday.day)
+  after_key, month_end_key = month_day_key(when), when.month * 100 + 31
+  snapshot = _get_users_snapshot()
+  if snapshot is not None:
+    next_key = snapshot.next_month_day_key(after_key)
+  else:
+    next_key = User.objects.filter(
+      birthday_mmdd__gt=after_key,
+      birthday_mmdd__lte=month_end_key,
+    ).order_by('birthday_mmdd').values_list('birthday_mmdd', flat=True).first()
+  last_day = monthrange(when.year, when.month)[1]
+  if next_key is not None and next_key <= month_end_key:
+    # Returns the next birthday in `when` month (Feb 29 ones on Feb 28 of common years)
+    return date(when.year, when.month, min(next_key % 100, last_day))
   # Returns the last day of `when` month
-  return date(when.year, when.month, monthrange(when.year, when.month)[1])
+  return date(when.year, when.month, last_day)
+
+def parse_age_width_querystring(width):
+  """Years per bucket of the age histogram (10 by default)"""
+  if width is None:
+    return 10
+  try:
+    width = int(width)
+  except ValueError:
+    raise ValueError('Bad width, expected an integer\n')
+  if not 0 < width <= 150:
+    raise ValueError('Bad width, expected a value from 1 to 150\n')
+  return width
+
+def get_age_histogram(when, width, version):
+  """
+  Users count by age (whole years at `when`), in buckets of `width` years, from the
+  youngest to the oldest users' bucket (empty ones included): a list of
+  {'from': first age, 'to': last age, 'count': users}.
+  """
+  counts = _get_users_count_by_age(when, version)
+  buckets = {}
+  for age, count in counts.items():
+    bucket = age // width * width
+    buckets[bucket] = buckets.get(bucket, 0) + count
+  if not buckets:
+    return []
+  return [{'from': bucket, 'to': bucket + width - 1, 'count': buckets.get(bucket, 0)}
+          for bucket in range(min(buckets), max(buckets) + 1, width)]
+
+def _get_users_count_by_age(when, version):
+  """{age: users count}, a single GROUP BY cached by `when` and the users `version`"""
+  assert(type(when) == datetime.date)
+  cache_key = 'user_birthday:ages_count:{}:{}'.format(when.toordinal(), version)
+  counts = get_cache().get(cache_key)
+  if counts is None:
+    # One less when the birthday didn't happen yet in `when`'s year. Cast, as
+    # PostgreSQL's EXTRACT isn't an integer
+    age = Cast(Value(when.year) - ExtractYear('birthday') -
+               Case(When(birthday_mmdd__gt=month_day_key(when), then=1), default=0),
+               output_field=IntegerField())
+    counts = dict(User.objects.annotate(age=age).order_by()
+                              .values('age').annotate(count=Count('pk'))
+                              .values_list('age', 'count'))
+    get_cache().set(cache_key, counts, timeout=aggregates_cache_timeout)
+  return counts
+
+def parse_birthdays_count_by_querystring(by):
+  """Either 'month' (the default) or 'day'"""
+  if by is None:
+    return 'month'
+  if by not in ('month', 'day'):
+    raise ValueError('Bad by, expected either month or day\n')
+  return by
+
+def get_birthdays_count(by, version):
+  """
+  Users count by birthday month (a list of {'month', 'count'}), or by month and day
+  (a list of {'month', 'day', 'count'}, February 29th included), all of them in order.
+  """
+  counts = _get_users_count_by_month_day(version)
+  if by == 'month':
+    by_month = [0] * 13
+    for mmdd, count in counts.items():
+      by_month[mmdd // 100] += count
+    return [{'month': month, 'count': by_month[month]} for month in range(1, 13)]
+  days = (date(2000, 1, 1) + datetime.timedelta(days=n) for n in range(366))  # A leap year
+  return [{'month': day.month, 'day': day.day, 'count': counts.get(month_day_key(day), 0)}
+          for day in days]
+
+def _get_users_count_by_month_day(version):
+  """{birthday MMDD key: users count}, a single GROUP BY cached by the users `version`"""
+  cache_key = 'user_birthday:birthdays_count:{}'.format(version)
+  counts = get_cache().get(cache_key)
+  if counts is None:
+    counts = dict(User.objects.order_by().values('birthday_mmdd').annotate(count=Count('pk'))
+                              .values_list('birthday_mmdd', 'count'))
+    get_cache().set(cache_key, counts, timeout=aggregates_cache_timeout)
+  return counts
@@ -0,0 +1,115 @@
+import re
+import json
+import datetime
+from django.conf import settings
+from django.core.validators import EMPTY_VALUES
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.forms.utils import ErrorDict, ErrorList
+
+
+# Birthdays are received in the %d.%m.%Y format (see settings.DATE_FORMAT)
+birthday_pattern = "^(0?[1-9]|[12][0-9]|3[01])\\.(0?[1-9]|1[012])\\.\\d{4}$"
+_fast_date_regex = re.compile(r'([0-9][0-9]?)\.([0-9][0-9]?)\.([0-9]{4})')
+
+
+class RowFormatError(ValueError):
+  """A row doesn't match the JSON schema (a bad formatted payload)"""
+
+
+def parse_long_date(date_string):
+  """
+  Same as `strptime(date_string, settings.DATE_FORMAT).date()`, but skipping
+  strptime's format parsing for the usual dd.mm.yyyy strings.
+  """
+  match = _fast_date_regex.fullmatch(date_string)
+  if match and settings.DATE_FORMAT == '%d.%m.%Y':
+    day, month, year = match.groups()
+    return datetime.date(int(year), int(month), int(day))
+  return datetime.datetime.strptime(date_string, settings.DATE_FORMAT).date()
+
+
+def build_json_schema(model):
+  """JSON Schema to validate a list of `model` objects received in post requests"""
+  properties = {}
+  for field in model._meta.concrete_fields:
+    if not field.editable:
+      continue
+    properties[field.name] = {"type": "string"}
+    if isinstance(field, models.EmailField):
+      properties[field.name]["format"] = "email"
+    elif isinstance(field, models.DateField):
+      properties[field.name]["pattern"] = birthday_pattern
+  return {
+    "type": "array",
+    "items": {
+      "type": "object",
+      "properties": properties,
+      "required": list(properties),
+    }
+  }
+
+
+def compile_row_validator(model, form_class):
+  """
+  Builds, once, a function validating and cleaning one row of a post request.
+  It checks the same as the model's JSON schema, the `form_class` form and the
+  date parsing did, with the same error messages:
+  * RowFormatError when the row doesn't match the schema.
+  * ValueError with the form errors as json, or the bad birthday format message.
+  Returns the cleaned row (model fields only, birthday as a date).
+  """
+  schema_items = build_json_schema(model)['items']
+  required = tuple(schema_items['required'])
+  patterns = tuple((name, re.compile(prop['pattern']))
+                   for name, prop in schema_items['properties'].items()
+                   if 'pattern' in prop)
+  date_fields = tuple(field.name for field in model._meta.concrete_fields
+                      if field.editable and isinstance(field, models.DateField))
+  # Form fields receiving strings, in the order the form cleans them
+  checks = tuple(
+    (name, getattr(field, 'strip', False), field.error_messages['required'],
+     tuple(field.validators))
+    for name, field in form_class.base_fields.items() if name not in date_fields)
+  bad_date_msg = json.dumps({'birthday': 'Bad date format, expected: %d.%m.%Y'})
+
+  def validate_row(row):
+    if type(row) is not dict:
+      raise RowFormatError(row)
+    try:
+      cleaned = {name: row[name] for name in required}
+    except KeyError:
+      raise RowFormatError(row)
+    for value in cleaned.values():
+      if type(value) is not str:
+        raise RowFormatError(row)
+    for name, regex in patterns:
+      if not regex.search(cleaned[name]):
+        raise RowFormatError(row)
+
+    try:
+      for name in date_fields:
+        cleaned[name] = parse_long_date(cleaned[name])
+    except ValueError:
+      raise ValueError(bad_date_msg)
+
+    errors = None
+    for name, strip, required_msg, validators in checks:
+      value = cleaned[name].strip() if strip else cleaned[name]
+      if value in EMPTY_VALUES:
+        field_errors = [ValidationError(required_msg, code='required')]
+      else:
+        field_errors = []
+        for validator in validators:
+          try:
+            validator(value)
+          except ValidationError as err:
+            field_errors.extend(err.error_list)
+      if field_errors:
+        errors = errors or ErrorDict()
+        errors[name] = ErrorList(field_errors)
+    if errors:
+      raise ValueError(errors.as_json())
+    return cleaned
+
+  return validate_row